@@ -0,0 +1,70 @@
+"""
+Bulk versus single order submission benchmark.
+
+Drives the FastAPI app in-process (JWT auth, validation and the matching
+engine included, no network) and compares orders/sec through
+``/trades/place-order`` one at a time with ``/trades/place-orders`` in
+batches.
+
+Run from the backend directory:
+    python -m benchmarks.bench_bulk_orders
+"""
+import random
+import time
+
+from fastapi.testclient import TestClient
+
+from main import app
+
+ORDERS = 2_000
+BATCH_SIZES = (50, 500)
+SYMBOLS = ["AAPL", "MSFT", "NVDA", "TSLA"]
+
+def make_orders(rng: random.Random, count: int) -> list:
+    orders = []
+    for _ in range(count):
+        order = {
+            "symbol": rng.choice(SYMBOLS),
+            "quantity": rng.randint(1, 100),
+            "order_type": rng.choice(["buy", "sell"]),
+            "price_type": "market",
+        }
+        if rng.random() < 0.5:
+            # Passive limit orders far from the market so they rest
+            order["price_type"] = "limit"
+            order["limit_price"] = 1.0 if order["order_type"] == "buy" else 100_000.0
+        orders.append(order)
+    return orders
+
+def login(client: TestClient) -> dict:
+    client.post("/auth/register", json={
+        "username": "bench", "email": "bench@example.com", "password": "benchmark", "full_name": "Bench"
+    })
+    token = client.post("/auth/login", data={"username": "bench", "password": "benchmark"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+def main():
+    rng = random.Random(42)
+    with TestClient(app) as client:
+        headers = login(client)
+        orders = make_orders(rng, ORDERS)
+
+        start = time.perf_counter()
+        for order in orders:
+            response = client.post("/trades/place-order", json=order, headers=headers)
+            assert response.status_code == 200, response.text
+        single = ORDERS / (time.perf_counter() - start)
+        print(f"{'path':<22} {'orders/sec':>11} {'speedup':>8}")
+        print(f"{'single':<22} {single:>11,.0f} {1:>7.1f}x")
+
+        for batch_size in BATCH_SIZES:
+            start = time.perf_counter()
+            for i in range(0, ORDERS, batch_size):
+                response = client.post("/trades/place-orders", headers=headers,
+                                       json={"orders": orders[i:i + batch_size], "mode": "strict"})
+                assert response.status_code == 200, response.text
+            bulk = ORDERS / (time.perf_counter() - start)
+            print(f"{f'bulk x{batch_size}':<22} {bulk:>11,.0f} {bulk / single:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
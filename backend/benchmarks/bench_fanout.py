@@ -0,0 +1,91 @@
+"""
+Price fan-out benchmark.
+
+Simulates 1k and 10k connected sockets and measures how long one price tick
+takes to reach all of them through the shared market data engine. The
+legacy design (one price loop per client) is emulated for comparison at the
+smaller size only, since it sends N^2 messages per tick.
+
+Run from the backend directory:
+    python -m benchmarks.bench_fanout
+"""
+import asyncio
+import time
+
+from services.market_data import MarketDataEngine
+from websocket_manager import ConnectionManager
+
+class FakeWebSocket:
+    """Stand-in for a Starlette WebSocket that just counts frames"""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        self.sent += 1
+
+    async def send_bytes(self, message: bytes):
+        self.sent += 1
+
+async def drain(manager: ConnectionManager):
+    """Let the per-client writer tasks flush their queues"""
+    while any(client.queue_depth for client in manager.connections.values()):
+        await asyncio.sleep(0)
+
+def close_all(manager: ConnectionManager):
+    for websocket in manager.active_connections:
+        manager.disconnect(websocket)
+
+async def run_shared(clients: int, ticks: int):
+    manager = ConnectionManager()
+    sockets = [FakeWebSocket() for _ in range(clients)]
+    for socket in sockets:
+        await manager.connect(socket)
+
+    engine = MarketDataEngine()
+    engine.add_listener(manager.broadcast_prices)
+
+    start = time.perf_counter()
+    for _ in range(ticks):
+        engine.step()
+        await engine.publish()
+        await drain(manager)
+    elapsed = time.perf_counter() - start
+    close_all(manager)
+    return elapsed / ticks, sum(s.sent for s in sockets) / ticks
+
+async def run_legacy(clients: int, ticks: int):
+    manager = ConnectionManager(queue_size=clients + 1)
+    sockets = [FakeWebSocket() for _ in range(clients)]
+    for socket in sockets:
+        await manager.connect(socket)
+
+    # Every client used to run its own price loop, each broadcasting to everyone
+    engines = [MarketDataEngine() for _ in range(clients)]
+    for engine in engines:
+        engine.add_listener(manager.broadcast_prices)
+
+    start = time.perf_counter()
+    for _ in range(ticks):
+        for engine in engines:
+            engine.step()
+            await engine.publish()
+        await drain(manager)
+    elapsed = time.perf_counter() - start
+    close_all(manager)
+    return elapsed / ticks, sum(s.sent for s in sockets) / ticks
+
+async def main():
+    print(f"{'mode':<8} {'clients':>8} {'ms/tick':>10} {'msgs/tick':>12} {'us/client':>10}")
+    for clients, ticks in ((1_000, 20), (10_000, 5)):
+        per_tick, msgs = await run_shared(clients, ticks)
+        print(f"{'shared':<8} {clients:>8} {per_tick * 1000:>10.2f} {msgs:>12.0f} {per_tick / clients * 1e6:>10.2f}")
+
+    per_tick, msgs = await run_legacy(1_000, 1)
+    print(f"{'legacy':<8} {1_000:>8} {per_tick * 1000:>10.2f} {msgs:>12.0f} {per_tick / 1_000 * 1e6:>10.2f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
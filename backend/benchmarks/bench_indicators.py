@@ -0,0 +1,46 @@
+"""
+Technical indicator benchmark.
+
+Times the vectorised RSI, MACD, Bollinger Bands and ATR on one million
+points against the straightforward pure-Python loops in
+tests/indicator_reference.py, which the indicator tests check against.
+
+Run from the backend directory:
+    python -m benchmarks.bench_indicators
+"""
+import time
+
+import numpy as np
+
+from services.indicators import atr, bollinger, macd, rsi
+from tests.indicator_reference import py_atr, py_bollinger, py_macd, py_rsi
+
+POINTS = 1_000_000
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    rng = np.random.default_rng(42)
+    closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, POINTS)))
+    highs = closes * (1 + rng.random(POINTS) * 0.01)
+    lows = closes * (1 - rng.random(POINTS) * 0.01)
+    py_closes, py_highs, py_lows = closes.tolist(), highs.tolist(), lows.tolist()
+
+    cases = [
+        ("RSI(14)", rsi, (closes,), py_rsi, (py_closes,)),
+        ("MACD(12,26,9)", macd, (closes,), py_macd, (py_closes,)),
+        ("Bollinger(20,2)", bollinger, (closes,), py_bollinger, (py_closes,)),
+        ("ATR(14)", atr, (highs, lows, closes), py_atr, (py_highs, py_lows, py_closes)),
+    ]
+    print(f"{POINTS:,} points")
+    print(f"{'indicator':<16} {'numpy ms':>10} {'python ms':>10} {'speedup':>8}")
+    for name, fast_fn, fast_args, slow_fn, slow_args in cases:
+        _, fast_time = timed(fast_fn, *fast_args)
+        _, slow_time = timed(slow_fn, *slow_args)
+        print(f"{name:<16} {fast_time * 1e3:>10.1f} {slow_time * 1e3:>10.1f} {slow_time / fast_time:>7.0f}x")
+
+if __name__ == "__main__":
+    main()
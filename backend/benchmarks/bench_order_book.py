@@ -0,0 +1,92 @@
+"""
+Order book matching benchmark.
+
+Fills a book with resting orders spread over thousands of price levels,
+then replays a random mix of passive limit orders, cancels and marketable
+orders against it. Reports throughput and latency percentiles per kind of
+operation.
+
+Run from the backend directory:
+    python -m benchmarks.bench_order_book
+"""
+import random
+import time
+
+import numpy as np
+
+from services.order_book import BUY, LIMIT, MARKET, SELL, Order, OrderBook
+
+MID = 10_000          # ticks, i.e. $100.00
+LEVELS = 2_000        # price levels each side
+RESTING = 200_000     # orders in the book before the run
+OPERATIONS = 200_000
+
+def build_book(rng: random.Random):
+    book = OrderBook("BENCH")
+    ids = []
+    for i in range(RESTING):
+        side = BUY if i % 2 else SELL
+        offset = rng.randint(1, LEVELS)
+        price = MID - offset if side == BUY else MID + offset
+        order = Order(f"r{i}", 1, "BENCH", side, rng.randint(1, 500), LIMIT, price)
+        book.submit(order)
+        ids.append(order.id)
+    return book, ids
+
+def main():
+    rng = random.Random(42)
+    start = time.perf_counter()
+    book, resting = build_book(rng)
+    print(f"Built book: {len(book.orders):,} resting orders, "
+          f"{len(book.bids) + len(book.asks):,} levels in {time.perf_counter() - start:.2f}s")
+
+    latencies = {"passive": [], "cancel": [], "marketable": [], "market": []}
+    fills = 0
+    run_start = time.perf_counter()
+    for i in range(OPERATIONS):
+        kind = rng.random()
+        side = BUY if rng.random() < 0.5 else SELL
+        if kind < 0.5:
+            name = "passive"
+            offset = rng.randint(1, LEVELS)
+            best = book.best_bid() if side == BUY else book.best_ask()
+            best = MID if best is None else best
+            price = best - offset if side == BUY else best + offset
+            order = Order(f"o{i}", 2, "BENCH", side, rng.randint(1, 500), LIMIT, price)
+            t = time.perf_counter_ns()
+            book.submit(order)
+            latencies[name].append(time.perf_counter_ns() - t)
+            resting.append(order.id)
+        elif kind < 0.75:
+            name = "cancel"
+            index = rng.randrange(len(resting))
+            resting[index], resting[-1] = resting[-1], resting[index]
+            order_id = resting.pop()
+            t = time.perf_counter_ns()
+            book.cancel(order_id)
+            latencies[name].append(time.perf_counter_ns() - t)
+        else:
+            # Crosses the spread by a few levels, like a typical aggressive order
+            market = kind > 0.95
+            name = "market" if market else "marketable"
+            best = book.best_ask() if side == BUY else book.best_bid()
+            best = MID if best is None else best
+            price = None if market else (best + 3 if side == BUY else best - 3)
+            order = Order(f"o{i}", 3, "BENCH", side, rng.randint(50, 500),
+                          MARKET if market else LIMIT, price, "IOC")
+            t = time.perf_counter_ns()
+            fills += len(book.submit(order))
+            latencies[name].append(time.perf_counter_ns() - t)
+    elapsed = time.perf_counter() - run_start
+
+    print(f"{OPERATIONS:,} operations, {fills:,} fills: {OPERATIONS / elapsed:,.0f} ops/sec "
+          f"(including the benchmark's own bookkeeping)")
+    print(f"{'operation':<11} {'count':>8} {'p50 us':>8} {'p99 us':>8} {'max us':>8}")
+    for name, values in latencies.items():
+        values = np.array(values) / 1e3
+        print(f"{name:<11} {len(values):>8,} {np.percentile(values, 50):>8.1f} "
+              f"{np.percentile(values, 99):>8.1f} {values.max():>8.1f}")
+    print(f"Resting orders at the end: {len(book.orders):,}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Order pipeline benchmark.
+
+Submits orders concurrently on 64 symbols through pipelines with 1 to 16
+shards. Each publish waits ``PUBLISH_LATENCY`` to stand in for fanning
+deltas and fills out to clients. Prints orders/sec per shard count, and
+checks that every symbol's orders ran in submission order and its deltas
+went out with consecutive ``seq``.
+
+Run from the backend directory:
+    python -m benchmarks.bench_order_pipeline
+"""
+import asyncio
+import os
+import random
+import time
+from collections import defaultdict
+
+# Enough symbols to spread over every shard; must be set before the engine is built
+os.environ.setdefault("MARKET_UNIVERSE_SIZE", "1000")
+
+from services.market_data import market_engine
+from services.matching_engine import MatchingEngine
+from services.order_book import BUY, LIMIT, MARKET, SELL
+from services.order_pipeline import OrderPipeline
+
+ORDERS = 5_000
+SYMBOLS = market_engine.symbols[:64]
+SHARDS = (1, 2, 4, 8, 16)
+PUBLISH_LATENCY = 0.0005
+
+class RecordingEngine(MatchingEngine):
+    """Remembers the order in which each symbol's orders ran"""
+
+    def __init__(self):
+        super().__init__()
+        self.executed = defaultdict(list)
+
+    async def submit(self, order):
+        self.executed[order.symbol].append(order.id)
+        return await super().submit(order)
+
+async def run(shards: int, rng: random.Random) -> float:
+    engine = RecordingEngine()
+    pipeline = OrderPipeline(engine, shards)
+    sequences = defaultdict(list)
+
+    async def on_delta(delta):
+        sequences[delta["symbol"]].append(delta["seq"])
+        await asyncio.sleep(PUBLISH_LATENCY)
+
+    engine.add_depth_listener(on_delta)
+    orders = []
+    for _ in range(ORDERS):
+        symbol = rng.choice(SYMBOLS)
+        price = market_engine.price(symbol) * rng.uniform(0.99, 1.01)
+        order_type = LIMIT if rng.random() < 0.7 else MARKET
+        orders.append(engine.new_order(
+            "bench", symbol, rng.choice((BUY, SELL)), rng.randint(1, 500),
+            order_type, price if order_type == LIMIT else None,
+        ))
+
+    await pipeline.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(pipeline.submit(order) for order in orders))
+    elapsed = time.perf_counter() - start
+    await pipeline.stop()
+
+    submitted = defaultdict(list)
+    for order in orders:
+        submitted[order.symbol].append(order.id)
+    assert engine.executed == submitted, "orders on a symbol ran out of submission order"
+    for symbol, seqs in sequences.items():
+        assert seqs == list(range(1, len(seqs) + 1)), f"{symbol} deltas out of sequence"
+    return ORDERS / elapsed
+
+async def main():
+    rng = random.Random(42)
+    print(f"{ORDERS:,} orders on {len(SYMBOLS)} symbols, {PUBLISH_LATENCY * 1e3:.1f} ms per publish")
+    print(f"{'shards':>6} {'orders/sec':>11} {'speedup':>8}")
+    baseline = None
+    for shards in SHARDS:
+        rate = await run(shards, rng)
+        baseline = baseline or rate
+        print(f"{shards:>6} {rate:>11,.0f} {rate / baseline:>7.1f}x")
+
+if __name__ == "__main__":
+    asyncio.run(main())
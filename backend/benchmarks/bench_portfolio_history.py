@@ -0,0 +1,101 @@
+"""
+Portfolio history benchmark.
+
+Stores a year of one-minute snapshots for one portfolio (525,600 raw
+rows, plus the 15-minute, hourly and daily rollups the snapshot job
+keeps) in a scratch SQLite database. It then times a chart for every
+period, reporting rows read and JSON bytes, against reading and sending
+the raw year. A 1Y chart must read a bounded number of rows and fit in a
+few kilobytes.
+
+Run from the backend directory:
+    python -m benchmarks.bench_portfolio_history
+"""
+import asyncio
+import json
+import os
+import time
+
+# The database must be set before the engine is built
+os.environ.setdefault("DATABASE_URL", "sqlite:////tmp/bench_portfolio_history.db")
+
+import numpy as np
+from sqlalchemy import delete, insert
+
+from database import Base, SessionLocal, engine
+from models.portfolio import PortfolioSnapshot
+from services.portfolio_history import ROLLUPS, PortfolioHistory
+
+USER = 1
+INTERVAL = 60
+DAYS = 365
+POINTS = 200
+PERIODS = {"1D": 1, "1W": 7, "1M": 30, "3M": 90, "6M": 180, "1Y": 365}
+
+def rollup(times: np.ndarray, series: np.ndarray, resolution: int) -> np.ndarray:
+    """Rows of one tier: bucket start, then last/min/max of each series"""
+    buckets = times // resolution * resolution
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(times)] - 1
+    columns = [buckets[starts]]
+    for values in series:
+        columns += [values[ends], np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts)]
+    return np.column_stack(columns)
+
+def store(rows: np.ndarray, resolution: int):
+    names = ("bucket_start", "value", "value_min", "value_max", "pnl", "pnl_min", "pnl_max")
+    with SessionLocal() as session:
+        for i in range(0, len(rows), 50_000):
+            session.execute(insert(PortfolioSnapshot), [
+                {"user_id": USER, "resolution": resolution, "worker": 0, **dict(zip(names, row)),
+                 "bucket_start": int(row[0])}
+                for row in rows[i:i + 50_000].tolist()
+            ])
+        session.commit()
+
+def chart(rows: np.ndarray) -> bytes:
+    return json.dumps([{"date": int(t), "value": round(v, 2)} for t, v in zip(rows[:, 0].tolist(), rows[:, 1].tolist())]).encode()
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as session:
+        session.execute(delete(PortfolioSnapshot))
+        session.commit()
+
+    end = (int(time.time()) // 86400) * 86400
+    times = np.arange(end - DAYS * 86400, end, INTERVAL)
+    rng = np.random.default_rng(42)
+    value = 100_000 * np.exp(np.cumsum(rng.normal(0, 0.0005, len(times))))
+    series = np.stack([value, value - 100_000])
+    start = time.perf_counter()
+    store(rollup(times, series, INTERVAL), INTERVAL)
+    for resolution in ROLLUPS:
+        store(rollup(times, series, resolution), resolution)
+    print(f"{len(times):,} one-minute snapshots and their rollups stored in {time.perf_counter() - start:.1f} s\n")
+
+    history = PortfolioHistory(interval=INTERVAL)
+    now = float(end)
+    start = time.perf_counter()
+    raw = history._load(USER, INTERVAL, now - DAYS * 86400, now)
+    raw_bytes = len(chart(raw))
+    raw_time = time.perf_counter() - start
+    print(f"{'period':<8} {'method':<8} {'tier':>6} {'rows read':>10} {'points':>7} {'bytes':>8} {'ms':>8}")
+    print(f"{'1Y raw':<8} {'-':<8} {INTERVAL:>6} {len(raw):>10,} {len(raw):>7,} {raw_bytes:>8,} {raw_time * 1e3:>8.1f}")
+    for period, days in PERIODS.items():
+        for method in ("lttb", "min_max"):
+            t0 = time.perf_counter()
+            resolution, rows = asyncio.run(history.history(USER, now - days * 86400, now, POINTS, "value", method))
+            body = chart(rows)
+            elapsed = time.perf_counter() - t0
+            read = len(history._load(USER, resolution, now - days * 86400, now))
+            print(f"{period:<8} {method:<8} {resolution:>6} {read:>10,} {len(rows):>7,} {len(body):>8,} {elapsed * 1e3:>8.1f}")
+            assert len(rows) <= POINTS
+            assert len(np.unique(rows[:, 0])) == len(rows), "one point per date"
+            if period == "1Y":
+                assert read <= DAYS + 1 and len(body) < 16_384
+                if method == "min_max":
+                    # The year's extremes survive downsampling
+                    assert rows[:, 1].max() == round(value.max(), 2) and rows[:, 1].min() == round(value.min(), 2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Order expiry scheduling benchmark.
+
+Schedules 200,000 GTD expiries at random times within one simulated
+trading hour, played at 3600x (one hour in one second). It does this two
+ways:
+- The heap Scheduler: one task, one timer per expiry.
+- One asyncio task per order that sleeps until its expiry, as a naive
+  implementation would.
+
+It reports the cost of scheduling, how late the expiries fire
+(in market seconds) and memory per pending expiry. It then times the
+session close: 200,000 DAY orders sharing a single timer.
+
+Run from the backend directory:
+    python -m benchmarks.bench_scheduler
+"""
+import asyncio
+import random
+import time
+import tracemalloc
+
+import numpy as np
+
+from services.scheduler import MarketClock, Scheduler
+
+EXPIRIES = 200_000
+SPEED = 3600.0
+HORIZON = 3600.0
+# Real seconds between scheduling and the first expiry, so scheduling doesn't make them late
+LEAD = 2.0
+
+def report(name: str, schedule: float, memory: int, lateness: list, elapsed: float):
+    late = np.array(lateness)
+    print(f"{name:<16} {schedule * 1e3:>9.0f} {memory / EXPIRIES:>9.0f} "
+          f"{np.percentile(late, 50):>9.2f} {np.percentile(late, 99):>9.2f} {elapsed - LEAD:>8.2f}")
+
+async def heap(times: list, measure: bool = False):
+    clock = MarketClock(speed=SPEED)
+    scheduler = Scheduler(clock)
+    lateness = []
+
+    def expire(when):
+        lateness.append(clock.now() - when)
+
+    if measure:
+        tracemalloc.start()
+    start = time.perf_counter()
+    base = clock.now() + LEAD * SPEED
+    for offset in times:
+        scheduler.call_at(base + offset, expire, base + offset)
+    schedule = time.perf_counter() - start
+    if measure:
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return memory
+    await scheduler.start()
+    while len(lateness) < len(times):
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    await scheduler.stop()
+    return schedule, lateness, elapsed
+
+async def tasks(times: list, measure: bool = False):
+    clock = MarketClock(speed=SPEED)
+    lateness = []
+
+    async def expire(when):
+        await asyncio.sleep(clock.delay(when))
+        lateness.append(clock.now() - when)
+
+    if measure:
+        tracemalloc.start()
+    start = time.perf_counter()
+    base = clock.now() + LEAD * SPEED
+    pending = [asyncio.create_task(expire(base + offset)) for offset in times]
+    schedule = time.perf_counter() - start
+    if measure:
+        # Let every task reach its sleep, then count what is held
+        await asyncio.sleep(0)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        return memory
+    await asyncio.gather(*pending)
+    elapsed = time.perf_counter() - start
+    return schedule, lateness, elapsed
+
+async def session_close():
+    clock = MarketClock(speed=SPEED)
+    scheduler = Scheduler(clock)
+    await scheduler.start()
+    orders = list(range(EXPIRIES))
+    expired = []
+    done = asyncio.Event()
+
+    def close(batch):
+        # What the order pipeline does: one timer for everything due at the close
+        expired.extend(batch)
+        done.set()
+
+    start = time.perf_counter()
+    scheduler.call_at(clock.now() + 1.0, close, orders)
+    await done.wait()
+    await scheduler.stop()
+    print(f"\nsession close: {len(expired):,} DAY orders on 1 timer, "
+          f"fired {(time.perf_counter() - start) * 1e3 - 1e3 / SPEED:.1f} ms after it was due")
+
+def main():
+    rng = random.Random(42)
+    times = [rng.uniform(0, HORIZON) for _ in range(EXPIRIES)]
+    print(f"{EXPIRIES:,} expiries over {HORIZON / 60:.0f} market minutes at {SPEED:.0f}x")
+    print(f"{'':<16} {'sched ms':>9} {'B/expiry':>9} {'p50 late':>9} {'p99 late':>9} {'total s':>8}")
+    for name, run in (("heap scheduler", heap), ("task per order", tasks)):
+        memory = asyncio.run(run(times, measure=True))
+        schedule, lateness, elapsed = asyncio.run(run(times))
+        report(name, schedule, memory, lateness, elapsed)
+    asyncio.run(session_close())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+Price simulator throughput benchmark.
+
+Reports how many whole-universe ticks per second the vectorised GBM
+simulator sustains for different universe sizes.
+
+Run from the backend directory:
+    python -m benchmarks.bench_simulator
+"""
+import time
+
+import numpy as np
+
+from services.price_simulator import PriceSimulator
+
+def ticks_per_second(simulator: PriceSimulator, seconds: float = 1.0) -> float:
+    ticks = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        simulator.step(2.0)
+        ticks += 1
+    return ticks / (time.perf_counter() - start)
+
+def main():
+    print(f"{'symbols':>8} {'correlated':>11} {'ticks/sec':>11} {'us/symbol':>10}")
+    for size in (100, 10_000, 100_000):
+        rate = ticks_per_second(PriceSimulator.with_universe(size, seed=42))
+        print(f"{size:>8} {'no':>11} {rate:>11.0f} {1e6 / rate / size:>10.4f}")
+
+    # Correlated shocks need an n x n Cholesky factor, so only try modest sizes
+    for size in (100, 2_000):
+        correlation = np.full((size, size), 0.3)
+        np.fill_diagonal(correlation, 1.0)
+        rate = ticks_per_second(PriceSimulator.with_universe(size, seed=42, correlation=correlation))
+        print(f"{size:>8} {'yes':>11} {rate:>11.0f} {1e6 / rate / size:>10.4f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Tick store query benchmark.
+
+Fills a temporary store with increasingly long histories for one symbol
+and times a one-day range query plus daily bar aggregation, showing the
+lookup stays flat as the history grows.
+
+Run from the backend directory:
+    python -m benchmarks.bench_tick_store
+"""
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from services.tick_store import TickStore
+
+def write_history(root: str, ticks: int, interval: float = 2.0):
+    directory = os.path.join(root, "AAPL")
+    os.makedirs(directory, exist_ok=True)
+    end = time.time()
+    timestamps = end - interval * np.arange(ticks, 0, -1, dtype=np.float64)
+    prices = 175 + np.cumsum(np.random.default_rng(1).normal(0, 0.05, ticks))
+    volumes = np.full(ticks, 100, dtype=np.int64)
+    prices.astype("<f8").tofile(os.path.join(directory, "price.f8"))
+    volumes.astype("<i8").tofile(os.path.join(directory, "volume.i8"))
+    timestamps.astype("<f8").tofile(os.path.join(directory, "timestamp.f8"))
+    return end
+
+def main():
+    print(f"{'stored ticks':>13} {'query us':>9} {'1D bars ms':>11}")
+    # 2-second ticks: ~1 week, ~6 months, ~4 years
+    for ticks in (300_000, 8_000_000, 60_000_000):
+        with tempfile.TemporaryDirectory() as root:
+            end = write_history(root, ticks)
+            store = TickStore(root)
+            store.query("AAPL")
+            runs = 200
+            start = time.perf_counter()
+            for _ in range(runs):
+                store.query("AAPL", end - 86400, end + 1)
+            query = (time.perf_counter() - start) / runs
+            start = time.perf_counter()
+            for _ in range(20):
+                store.daily_bars("AAPL", end - 86400, end + 1)
+            bars = (time.perf_counter() - start) / 20
+            print(f"{ticks:>13} {query * 1e6:>9.1f} {bars * 1000:>11.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Trade history benchmark.
+
+Fills in-memory trade stores with 10k to 1M trades over 1,000 users and
+times history pages (unfiltered, by symbol, by symbol and side, and deep
+behind a cursor). Page latency should stay flat as the volume grows.
+
+Run from the backend directory:
+    python -m benchmarks.bench_trade_history
+"""
+import asyncio
+import random
+import time
+
+from services.trade_store import TradeStore
+
+VOLUMES = (10_000, 100_000, 1_000_000)
+USERS = 1_000
+SYMBOLS = ["AAPL", "MSFT", "NVDA", "TSLA", "AMZN", "GOOGL", "META", "NFLX"]
+QUERIES = 2_000
+PAGE = 50
+
+def fill(volume: int, rng: random.Random) -> TradeStore:
+    store = TradeStore(index_size=volume, persist=False)
+    for _ in range(volume):
+        store.record(rng.randrange(USERS), "order", rng.choice(SYMBOLS), rng.choice(("buy", "sell")),
+                     rng.randint(1, 100), 100.0, time.time())
+    return store
+
+async def timed(store: TradeStore, rng: random.Random, **filters) -> float:
+    start = time.perf_counter()
+    for _ in range(QUERIES):
+        user = rng.randrange(USERS)
+        before = None
+        if filters.get("deep"):
+            ids = store.users[user].all.ids
+            before = ids[len(ids) // 10]
+        await store.query(user, filters.get("symbol"), filters.get("side"), before=before, limit=PAGE)
+    return (time.perf_counter() - start) / QUERIES * 1e6
+
+async def main():
+    rng = random.Random(42)
+    cases = [
+        ("all", {}),
+        ("symbol", {"symbol": "AAPL"}),
+        ("symbol+side", {"symbol": "AAPL", "side": "sell"}),
+        ("deep cursor", {"deep": True}),
+    ]
+    print(f"{PAGE}-trade pages, µs per query")
+    print(f"{'trades':>10} " + " ".join(f"{name:>12}" for name, _ in cases))
+    for volume in VOLUMES:
+        store = fill(volume, rng)
+        times = [await timed(store, rng, **filters) for _, filters in cases]
+        print(f"{volume:>10,} " + " ".join(f"{t:>12.1f}" for t in times))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+"""
+Mark-to-market benchmark.
+
+Books 20 positions each for 50,000 users over a 1,000-symbol universe,
+then times one tick of the valuation engine: the sparse revalue of every
+portfolio, plus portfolio_update messages (JSON-encoded) for every user
+whose figures moved, with all users watched as the worst case. It
+compares that with a per-user Python loop like the old holdings code,
+checks both agree, and checks the total fits in the tick interval.
+
+Run from the backend directory:
+    python -m benchmarks.bench_valuation
+"""
+import json
+import os
+import random
+import time
+
+# The universe must be set before the market engine is built
+os.environ.setdefault("MARKET_UNIVERSE_SIZE", "1000")
+
+import numpy as np
+
+from services.market_data import market_engine
+from services.positions import PositionBook
+from services.valuation import ValuationEngine
+
+USERS = 50_000
+POSITIONS_PER_USER = 20
+TICKS = 10
+TICK_BUDGET = 2.0
+
+def python_values(book: PositionBook, prices: np.ndarray) -> dict:
+    quantities, costs, symbols = book.quantity.tolist(), book.average_cost.tolist(), book.symbol_index.tolist()
+    values = {}
+    for user_id, rows in book._user_rows.items():
+        value = unrealized = 0.0
+        for row in rows:
+            price = prices[symbols[row]]
+            value += quantities[row] * price
+            unrealized += (price - costs[row]) * quantities[row]
+        values[user_id] = (value, unrealized)
+    return values
+
+def main():
+    rng = random.Random(42)
+    symbols = market_engine.symbols
+    book = PositionBook(symbols, persist=False)
+    start = time.perf_counter()
+    for user in range(USERS):
+        for symbol in rng.sample(symbols, POSITIONS_PER_USER):
+            price = market_engine.price(symbol)
+            book.apply(user, symbol, rng.choice(("buy", "sell")), rng.randint(1, 500), price * rng.uniform(0.9, 1.1))
+    print(f"{book.size:,} positions for {USERS:,} users booked in {time.perf_counter() - start:.1f} s "
+          f"({(time.perf_counter() - start) / book.size * 1e6:.1f} µs per fill)")
+
+    engine = ValuationEngine(book)
+    for user in range(USERS):
+        engine.watch(user)
+    start = time.perf_counter()
+    engine._rebuild()
+    print(f"sparse matrix built in {(time.perf_counter() - start) * 1e3:.0f} ms")
+
+    revalue = changes = encode = 0.0
+    pushed = 0
+    for _ in range(TICKS):
+        tick = market_engine.step()
+        engine.seq = tick.seq
+        t0 = time.perf_counter()
+        engine.revalue(tick.prices)
+        t1 = time.perf_counter()
+        messages = engine.changes()
+        t2 = time.perf_counter()
+        for message in messages.values():
+            json.dumps(message)
+        t3 = time.perf_counter()
+        revalue += t1 - t0
+        changes += t2 - t1
+        encode += t3 - t2
+        pushed += len(messages)
+
+    start = time.perf_counter()
+    expected = python_values(book, tick.prices.tolist())
+    loop = time.perf_counter() - start
+    value = np.array([expected[user][0] for user in range(USERS)])
+    unrealized = np.array([expected[user][1] for user in range(USERS)])
+    assert np.allclose(engine.figures[0], value, atol=0.01) and np.allclose(engine.figures[1], unrealized, atol=0.01)
+
+    total = (revalue + changes + encode) / TICKS
+    print(f"\nper tick, averaged over {TICKS} ticks ({pushed / TICKS:,.0f} users updated per tick)")
+    print(f"{'sparse revalue':<22} {revalue / TICKS * 1e3:>8.1f} ms")
+    print(f"{'changed-figure diff':<22} {changes / TICKS * 1e3:>8.1f} ms")
+    print(f"{'JSON messages':<22} {encode / TICKS * 1e3:>8.1f} ms")
+    print(f"{'total':<22} {total * 1e3:>8.1f} ms  ({total / TICK_BUDGET:.1%} of the {TICK_BUDGET:.0f} s tick)")
+    print(f"{'python loop revalue':<22} {loop * 1e3:>8.1f} ms  ({loop / (revalue / TICKS):.0f}x slower)")
+    assert total < TICK_BUDGET
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+Price frame encoding benchmark.
+
+Compares encode time and frame size of the JSON and binary wire formats
+for a large symbol universe.
+
+Run from the backend directory:
+    python -m benchmarks.bench_wire_format
+"""
+import time
+
+from services.market_data import MarketDataEngine
+from services.price_simulator import PriceSimulator
+from services.wire_format import PriceFrame, decode_prices_binary
+
+def main():
+    print(f"{'symbols':>8} {'encoding':>9} {'ms/encode':>10} {'bytes':>10}")
+    for size in (100, 10_000):
+        engine = MarketDataEngine(PriceSimulator.with_universe(size, seed=1))
+        tick = engine.step()
+        for encoding in ("json", "binary"):
+            runs = 20
+            start = time.perf_counter()
+            for _ in range(runs):
+                frame = PriceFrame(tick).encode(encoding)
+            elapsed = (time.perf_counter() - start) / runs
+            size_bytes = len(frame.encode() if isinstance(frame, str) else frame)
+            print(f"{size:>8} {encoding:>9} {elapsed * 1000:>10.2f} {size_bytes:>10}")
+
+        decoded = decode_prices_binary(PriceFrame(tick).encode("binary"), engine.symbols)
+        assert list(decoded) == tick.changed_symbols
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -17,3 +17,27 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def upsert_statement(model, rows, keys, columns):
+    """INSERT ... ON CONFLICT (keys) DO UPDATE SET columns, or None where the
+    dialect has no such statement"""
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif engine.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    statement = insert(model).values(rows)
+    return statement.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={name: statement.excluded[name] for name in columns},
+    )
+
+def lock_for_write(session):
+    """Take SQLite's write lock at the start of the session's transaction.
+
+    SQLite ignores SELECT ... FOR UPDATE, so a read-modify-write there
+    takes the whole database instead; elsewhere FOR UPDATE locks the rows.
+    """
+    if engine.dialect.name == "sqlite":
+        session.execute(text("BEGIN IMMEDIATE"))
@@ -4,6 +4,9 @@ Database initialization script for the Trading Simulator
 """
 from database import engine, Base
 from models.user import User, WalletTransaction
+from models.trade import Trade
+from models.position import Position
+from models.portfolio import PortfolioSnapshot
 
 def init_db():
     """Initialize the database with all tables"""
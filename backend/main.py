@@ -1,8 +1,24 @@
+import os
+
 from fastapi import FastAPI, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from database import engine, Base
-from routers import auth, trade
-from websocket_manager import websocket_endpoint
+from routers import auth, trade, user
+from websocket_manager import manager, websocket_endpoint
+from services.market_data import market_engine
+from services.pubsub import bus
+from services.tick_store import tick_store
+from services.candles import candle_aggregator, candle_store
+from services.indicators import indicator_engine
+from services.market_indices import market_indices
+from services.matching_engine import matching_engine
+from services.order_pipeline import order_pipeline
+from services.result_cache import result_cache
+from services.trade_store import trade_store
+from services.positions import position_book
+from services.valuation import valuation_engine
+from services.portfolio_history import portfolio_history
+from services.scheduler import market_clock, scheduler
 
 app = FastAPI(title="Stock Trading Simulator", version="1.0.0")
 
@@ -18,12 +34,39 @@ app.add_middleware(
 # Include routers
 app.include_router(auth.router)
 app.include_router(trade.router)
+app.include_router(user.router)
 
 # WebSocket endpoint
 @app.websocket("/ws")
 async def websocket_endpoint_route(websocket: WebSocket):
     await websocket_endpoint(websocket)
 
+@app.get("/ws/stats")
+def websocket_stats():
+    """Per-connection send queue depth, most lagging clients first"""
+    return {
+        "pid": os.getpid(),
+        "leader": bus.is_leader,
+        "connections": len(manager.connections),
+        "policy": manager.policy,
+        "clients": manager.stats(),
+    }
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Analytics and portfolio result cache hit/miss counters"""
+    return {"pid": os.getpid(), **result_cache.stats()}
+
+@app.get("/market/clock")
+def market_clock_stats():
+    """Market time, clock speed, session state and pending scheduler timers"""
+    return scheduler.stats()
+
+@app.get("/orders/stats")
+def order_pipeline_stats():
+    """Queued and processed operations per order pipeline shard"""
+    return {"pid": os.getpid(), "shards": order_pipeline.stats()}
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize database tables on startup"""
@@ -33,6 +76,56 @@ async def startup_event():
     except Exception as e:
         print(f"⚠️ Database connection failed: {e}")
         print("📝 Make sure PostgreSQL is running with docker-compose up db -d")
+    position_book.load()
+    # Market time goes on from the stored history, so the ticks and candles
+    # of an accelerated session aren't followed by older ones after a restart
+    market_clock.resume(max(tick_store.end(market_engine.symbols), candle_store.end()))
+    # Ticks and order expiries run on the market clock's scheduler
+    await scheduler.start()
+
+    # Join the pub/sub backplane; the leader worker runs the shared market
+    # data feed and every worker fans ticks and events out to its own clients
+    market_engine.add_listener(manager.broadcast_prices)
+    market_engine.add_listener(candle_aggregator.on_tick)
+    # Indicators read finished bars, so they must run after the aggregator
+    market_engine.add_listener(indicator_engine.on_tick)
+    market_engine.add_listener(result_cache.on_tick)
+    # Every worker keeps its own indices from the ticks and pushes them to its clients
+    market_engine.add_listener(market_indices.on_tick)
+    market_indices.add_listener(manager.broadcast_event)
+    # Resting limit orders fill as the market moves through them; re-quotes
+    # go through the same per-symbol sequencers as orders
+    await order_pipeline.start()
+    market_engine.add_listener(order_pipeline.on_tick)
+    matching_engine.add_listener(trade.record_fills)
+    matching_engine.add_depth_listener(manager.broadcast_depth)
+    # Every portfolio is revalued on each tick; connected users get what moved
+    market_engine.add_listener(valuation_engine.on_tick)
+    valuation_engine.add_listener(manager.broadcast_portfolios)
+    # Portfolio value and P&L are snapshotted at fixed intervals for charts
+    await portfolio_history.start()
+    market_engine.add_sink(tick_store.append)
+    market_engine.attach(bus)
+    bus.on_leader(candle_aggregator.start_persisting)
+    bus.on_leader(portfolio_history.lead)
+    manager.attach(bus)
+    result_cache.attach(bus)
+    await bus.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background tasks"""
+    await market_engine.stop()
+    await order_pipeline.stop()
+    await portfolio_history.stop()
+    await scheduler.stop()
+    portfolio_history.wait()
+    trade_store.wait()
+    position_book.wait()
+    tick_store.flush()
+    candle_aggregator.flush()
+    candle_store.wait()
+    await bus.stop()
 
 @app.get("/")
 def root():
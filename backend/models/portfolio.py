@@ -0,0 +1,25 @@
+from sqlalchemy import BigInteger, Column, Integer, Numeric
+from database import Base
+
+class PortfolioSnapshot(Base):
+    """A user's portfolio value and total P&L over one time bucket.
+
+    ``resolution`` is the bucket length in seconds, one row series per
+    rollup tier, and ``bucket_start`` is Unix seconds. Each worker writes
+    its own share of the figures under its ``worker`` id, and readers sum
+    them. The primary key doubles as the (user, tier, time) index charts
+    are read through.
+    """
+    __tablename__ = "portfolio_snapshots"
+
+    user_id = Column(Integer, primary_key=True)
+    resolution = Column(Integer, primary_key=True)
+    bucket_start = Column(BigInteger, primary_key=True)
+    worker = Column(Integer, primary_key=True, autoincrement=False)
+    # Last value in the bucket, and its range
+    value = Column(Numeric(18, 2), nullable=False)
+    value_min = Column(Numeric(18, 2), nullable=False)
+    value_max = Column(Numeric(18, 2), nullable=False)
+    pnl = Column(Numeric(18, 2), nullable=False)
+    pnl_min = Column(Numeric(18, 2), nullable=False)
+    pnl_max = Column(Numeric(18, 2), nullable=False)
@@ -0,0 +1,14 @@
+from sqlalchemy import Column, DateTime, Integer, Numeric, String
+from sqlalchemy.sql import func
+from database import Base
+
+class Position(Base):
+    """A user's net position in one symbol; quantity is negative when short"""
+    __tablename__ = "positions"
+
+    user_id = Column(Integer, primary_key=True)
+    symbol = Column(String, primary_key=True)
+    quantity = Column(Integer, nullable=False)
+    average_cost = Column(Numeric(18, 6), nullable=False)
+    realized_pnl = Column(Numeric(18, 6), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
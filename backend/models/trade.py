@@ -0,0 +1,27 @@
+from sqlalchemy import BigInteger, Column, DateTime, Index, Integer, Numeric, String
+from database import Base
+
+class Trade(Base):
+    """One user's side of a fill.
+
+    ``id`` is a snowflake id, so it orders trades by time and history pages
+    are keyset scans on (user_id, id) or, filtered, on (user_id, symbol, id)
+    and (user_id, side, id).
+    """
+    __tablename__ = "trades"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, nullable=False)
+    order_id = Column(String, nullable=False)
+    symbol = Column(String, nullable=False)
+    side = Column(String, nullable=False)  # 'buy' or 'sell'
+    quantity = Column(Integer, nullable=False)
+    price = Column(Numeric(15, 4), nullable=False)
+    total = Column(Numeric(18, 2), nullable=False)
+    executed_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        Index("ix_trades_user_id_id", "user_id", "id"),
+        Index("ix_trades_user_symbol_id", "user_id", "symbol", "id"),
+        Index("ix_trades_user_side_id", "user_id", "side", "id"),
+    )
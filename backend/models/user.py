@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, DateTime, Numeric, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Numeric, Boolean, Index
 from sqlalchemy.sql import func
+from datetime import datetime, timezone
 from database import Base
 
 class User(Base):
@@ -23,4 +24,13 @@ class WalletTransaction(Base):
     amount = Column(Numeric(15, 2), nullable=False)
     balance_after = Column(Numeric(15, 2), nullable=False)
     description = Column(String)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Stamped here rather than by the server so the value round-trips through
+    # page cursors exactly: SQLite stores CURRENT_TIMESTAMP without the
+    # microseconds a bound datetime carries, and the keyset comparison misses
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc),
+                        server_default=func.now())
+
+    # Ledger pages are keyset scans newest first; id breaks created_at ties
+    __table_args__ = (
+        Index("ix_wallet_transactions_user_created_id", "user_id", "created_at", "id"),
+    )
@@ -2,17 +2,20 @@ from fastapi import APIRouter, HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from datetime import timedelta
-from typing import Dict, Optional
+from decimal import Decimal
+from typing import Optional
 import bcrypt
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from auth import create_access_token, verify_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from database import SessionLocal, get_db
+from models.user import User as UserRecord
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
-# In-memory user storage for testing (replace with database in production)
-mock_users_db: Dict[str, dict] = {}
-
 class UserCreate(BaseModel):
     username: str
     email: str
@@ -39,7 +42,22 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash"""
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
+def _user_dict(user: UserRecord) -> dict:
+    return {
+        "id": user.id,
+        "username": user.username,
+        "email": user.email,
+        "hashed_password": user.hashed_password,
+        "wallet_balance": float(user.wallet_balance),
+        "is_active": user.is_active,
+    }
+
+def get_user(db: Session, username: str) -> Optional[dict]:
+    """A user from the users table, so ids stay unique across restarts and workers"""
+    user = db.query(UserRecord).filter(UserRecord.username == username).first()
+    return None if user is None else _user_dict(user)
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -47,44 +65,63 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
     )
     
     username = verify_token(token, credentials_exception)
-    user = mock_users_db.get(username)
+    user = get_user(db, username)
     if user is None:
         raise credentials_exception
     return user
 
+def _user_from_token(token: str) -> Optional[dict]:
+    with SessionLocal() as db:
+        try:
+            return get_current_user(token, db)
+        except HTTPException:
+            return None
+
+async def user_from_token(token: str) -> Optional[dict]:
+    """The user a bearer token belongs to, or None, for callers outside a request (e.g. WebSockets).
+
+    The lookup blocks on the database, so it runs in the thread pool rather
+    than on the event loop.
+    """
+    return await run_in_threadpool(_user_from_token, token)
+
 @router.post("/register", response_model=User)
-def register_user(user_data: UserCreate):
+def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
     """Register a new user"""
     # Check if user already exists
-    if user_data.username in mock_users_db:
+    if db.query(UserRecord).filter(UserRecord.username == user_data.username).first():
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered"
         )
-    
+
     # Check if email already exists
-    for user in mock_users_db.values():
-        if user['email'] == user_data.email:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Email already registered"
-            )
-    
-    # Hash password and create user
-    hashed_password = hash_password(user_data.password)
-    user_id = len(mock_users_db) + 1
-    
-    new_user = {
-        "id": user_id,
-        "username": user_data.username,
-        "email": user_data.email,
-        "hashed_password": hashed_password,
-        "wallet_balance": 10000.0,  # Starting balance
-        "is_active": True
-    }
-    
-    mock_users_db[user_data.username] = new_user
-    
+    if db.query(UserRecord).filter(UserRecord.email == user_data.email).first():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
+
+    # Hash password and create user; the database assigns the id
+    user = UserRecord(
+        username=user_data.username,
+        email=user_data.email,
+        hashed_password=hash_password(user_data.password),
+        wallet_balance=10000.0,  # Starting balance
+        is_active=True
+    )
+    db.add(user)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Registered concurrently, e.g. through another worker
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username or email already registered"
+        )
+    new_user = _user_dict(user)
+
     # Return user without password
     return User(
         id=new_user["id"],
@@ -95,9 +132,9 @@ def register_user(user_data: UserCreate):
     )
 
 @router.post("/login", response_model=Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
+def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """Login and get access token"""
-    user = mock_users_db.get(form_data.username)
+    user = get_user(db, form_data.username)
     
     if not user or not verify_password(form_data.password, user["hashed_password"]):
         raise HTTPException(
@@ -134,23 +171,25 @@ def get_current_user_info(current_user: dict = Depends(get_current_user)):
 def update_wallet_balance(
     amount: float,
     transaction_type: str,  # 'deposit', 'withdrawal', 'trade'
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
 ):
     """Update user wallet balance"""
-    if transaction_type == "withdrawal" and current_user["wallet_balance"] < amount:
+    # Locked, so concurrent updates through any worker apply one at a time
+    user = db.query(UserRecord).filter(UserRecord.id == current_user["id"]).with_for_update().one()
+    if transaction_type == "withdrawal" and user.wallet_balance < Decimal(str(amount)):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Insufficient funds"
         )
-    
     if transaction_type == "deposit":
-        mock_users_db[current_user["username"]]["wallet_balance"] += amount
+        user.wallet_balance += Decimal(str(amount))
     elif transaction_type == "withdrawal":
-        mock_users_db[current_user["username"]]["wallet_balance"] -= amount
+        user.wallet_balance -= Decimal(str(amount))
     elif transaction_type == "trade":
-        mock_users_db[current_user["username"]]["wallet_balance"] += amount  # Can be negative for purchases
-    
-    new_balance = mock_users_db[current_user["username"]]["wallet_balance"]
+        user.wallet_balance += Decimal(str(amount))  # Can be negative for purchases
+    db.commit()
+    new_balance = float(user.wallet_balance)
     
     return {
         "message": f"{transaction_type.title()} successful",
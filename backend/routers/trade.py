@@ -1,11 +1,32 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
 from pydantic import BaseModel
 from typing import List, Optional
 from decimal import Decimal
 from datetime import datetime, timedelta
 import random
+import time
+import zlib
+
+import numpy as np
 
 from routers.auth import get_current_user
+from services.market_data import SEED, market_engine
+from services.result_cache import TICKS, cached, result_cache, user_tag
+from services.candles import candle_aggregator
+from services.market_indices import market_indices
+from services.matching_engine import DEPTH_LEVELS, MARKET_MAKER, matching_engine
+from services.order_pipeline import order_pipeline
+from services.order_book import BUY, LIMIT, MARKET, RESTING, SELL, TIME_IN_FORCE, Fill, Order, from_ticks
+from services.stop_orders import STOP, STOP_LIMIT, TRAILING_STOP
+from services.scheduler import market_clock
+from services.indicators import (
+    atr, batch_metrics, bollinger, indicator_engine, macd, metric_warmup, rsi, sma, vwap
+)
+from services.tick_store import tick_store
+from services.trade_store import TradeRecord, trade_store
+from services.positions import position_book
+from services.portfolio_history import DOWNSAMPLING, portfolio_history
+from websocket_manager import manager
 
 router = APIRouter(prefix="/trades", tags=["trades"])
 
@@ -13,8 +34,25 @@ class TradeRequest(BaseModel):
     symbol: str
     quantity: int
     order_type: str  # 'buy' or 'sell'
-    price_type: str  # 'market' or 'limit'
+    price_type: str  # 'market', 'limit', 'stop', 'stop_limit' or 'trailing_stop'
     limit_price: Optional[Decimal] = None
+    stop_price: Optional[Decimal] = None  # trigger for 'stop' and 'stop_limit'
+    trail_amount: Optional[Decimal] = None  # distance from the best price for 'trailing_stop'
+    time_in_force: Optional[str] = None  # 'DAY', 'GTC', 'GTD', 'IOC' or 'FOK'
+    expire_time: Optional[datetime] = None  # market time a GTD order expires at
+
+class BulkOrderRequest(BaseModel):
+    orders: List[TradeRequest]
+    mode: str = "best_effort"  # 'strict' or 'best_effort'
+
+class ReplaceOrderRequest(BaseModel):
+    price: Optional[Decimal] = None
+    quantity: Optional[int] = None
+
+class BatchAnalyticsRequest(BaseModel):
+    symbols: List[str]
+    metrics: List[str]
+    period: str = "1M"
 
 class TradeResponse(BaseModel):
     id: str
@@ -25,9 +63,228 @@ class TradeResponse(BaseModel):
     total: Decimal
     status: str
     timestamp: datetime
+    filled_quantity: Optional[int] = None
+    price_type: Optional[str] = None
+    time_in_force: Optional[str] = None
+    stop_price: Optional[Decimal] = None
+    trail_amount: Optional[Decimal] = None
+    expires_at: Optional[datetime] = None
+
+class BulkOrderResult(BaseModel):
+    index: int
+    status: str  # 'accepted' or 'rejected'
+    order: Optional[TradeResponse] = None
+    error: Optional[str] = None
+
+class BulkOrderResponse(BaseModel):
+    mode: str
+    accepted: int
+    rejected: int
+    results: List[BulkOrderResult]
+
+def _history_rng(*key) -> random.Random:
+    """Random generator seeded from the market seed and the request, so the
+    same synthetic series is returned every time it is asked for"""
+    return random.Random(zlib.crc32(":".join(map(str, (SEED or 0,) + key)).encode()))
+
+# Longest moving-average window accepted by the API
+MAX_MA_PERIOD = 1000
+
+# Orders accepted by one bulk request, and how it treats invalid ones
+MAX_BULK_ORDERS = 1000
+BULK_MODES = ("strict", "best_effort")
+
+# Order types accepted by order entry
+PRICE_TYPES = (MARKET, LIMIT, STOP, STOP_LIMIT, TRAILING_STOP)
 
-# Mock trade storage
-mock_trades = []
+# Largest trade history page
+MAX_HISTORY_PAGE = 500
+
+# Portfolio chart points served per request, and how they are picked
+MAX_CHART_POINTS = 1000
+PORTFOLIO_PERIODS = {"1D": 1, "1W": 7, "1M": 30, "3M": 90, "6M": 180, "1Y": 365}
+
+# Deepest order-book snapshot served
+MAX_DEPTH_LEVELS = 100
+
+# Most symbols accepted by one batch analytics request
+MAX_BATCH_SYMBOLS = 500
+
+# Chart period -> (candle resolution, number of candles)
+HISTORY_CANDLES = {
+    "1D": ("5m", 288), "1W": ("1h", 168), "1M": ("1d", 30),
+    "3M": ("1d", 90), "6M": ("1d", 180), "1Y": ("1d", 365),
+}
+
+def _candle_dates(starts, resolution: str) -> list:
+    unit = 'D' if resolution == "1d" else 'm'
+    dates = np.asarray(starts, dtype=np.int64).astype('datetime64[s]').astype(f'datetime64[{unit}]')
+    return [str(date).replace("T", " ") for date in dates]
+
+def _columns(values: np.ndarray) -> list:
+    """Rounded nested lists with NaN as None, for JSON"""
+    values = np.asarray(values)
+    if values.dtype.kind != 'f':
+        return values.tolist()
+    return np.where(np.isnan(values), None, np.round(values, 2)).tolist()
+
+def _candle_bars(symbol: str, resolution: str, count: int) -> list:
+    """OHLCV bars sliced from the live candle aggregator"""
+    if symbol not in candle_aggregator.symbol_ids:
+        return []
+    candles = candle_aggregator.candles(symbol, resolution, count)
+    dates = _candle_dates(candles["start"], resolution)
+    return [
+        {
+            "date": date,
+            "open": round(o, 2),
+            "high": round(h, 2),
+            "low": round(l, 2),
+            "close": round(c, 2),
+            "volume": v,
+        }
+        for date, o, h, l, c, v in zip(
+            dates, candles["open"].tolist(), candles["high"].tolist(), candles["low"].tolist(),
+            candles["close"].tolist(), candles["volume"].tolist()
+        )
+    ]
+
+def _daily_bars(symbol: str, days: int) -> list:
+    """Daily OHLCV bars from the candle aggregator, falling back to stored ticks
+    and then the market recording"""
+    bars = _candle_bars(symbol, "1d", days)
+    if bars:
+        return bars
+    now = market_clock.now()
+    start = now - days * 86400
+    bars = tick_store.daily_bars(symbol, start, now + 1)
+    if not bars and market_engine.history is not None:
+        bars = market_engine.history.daily_ohlcv(symbol, start, now + 1)
+    return bars
+
+async def _portfolio_history(user_id, period: str, points: int, method: str, series: str):
+    """Chart dates and downsampled snapshot rows for one portfolio"""
+    if method not in DOWNSAMPLING:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="method must be 'lttb' or 'min_max'")
+    end = time.time()
+    start = end - PORTFOLIO_PERIODS.get(period, 30) * 86400
+    resolution, rows = await portfolio_history.history(user_id, start, end, points, series, method)
+    fmt = "%Y-%m-%d" if resolution >= 86400 else "%Y-%m-%d %H:%M"
+    return [datetime.fromtimestamp(t).strftime(fmt) for t in rows[:, 0].tolist()], rows
+
+def _order_response(order: Order) -> TradeResponse:
+    """Summary of an order: average fill price, or its limit (else stop) while nothing has filled"""
+    if order.filled:
+        price = order.average_price
+    elif order.price is not None:
+        price = from_ticks(order.price)
+    elif order.stop_price is not None:
+        price = from_ticks(order.stop_price)
+    else:
+        price = market_engine.price(order.symbol)
+    return TradeResponse(
+        id=order.id,
+        symbol=order.symbol,
+        quantity=order.quantity,
+        order_type=order.side,
+        price=Decimal(str(round(price, 4))),
+        total=Decimal(str(from_ticks(order.filled_value))),
+        status=order.status,
+        timestamp=datetime.fromtimestamp(order.timestamp),
+        filled_quantity=order.filled,
+        price_type=order.order_type,
+        time_in_force=order.time_in_force,
+        stop_price=None if order.stop_price is None else Decimal(str(from_ticks(order.stop_price))),
+        trail_amount=None if order.trail is None else Decimal(str(from_ticks(order.trail))),
+        expires_at=None if order.expires_at is None else datetime.fromtimestamp(order.expires_at),
+    )
+
+def _trade_response(trade: TradeRecord) -> TradeResponse:
+    return TradeResponse(
+        id=str(trade.id),
+        symbol=trade.symbol,
+        quantity=trade.quantity,
+        order_type=trade.side,
+        price=Decimal(str(trade.price)),
+        total=Decimal(str(trade.total)),
+        status="executed",
+        timestamp=datetime.fromtimestamp(trade.timestamp)
+    )
+
+def _trade_print(fill: Fill) -> dict:
+    return {
+        'symbol': fill.symbol,
+        'side': fill.taker.side,
+        'quantity': fill.quantity,
+        'price': from_ticks(fill.price),
+        'timestamp': datetime.fromtimestamp(fill.timestamp).isoformat(),
+    }
+
+async def record_fills(fills: List[Fill]):
+    """Record each user's side of every fill and print the trades to WebSocket clients.
+
+    Fills of a bulk submission are left for ``place_orders`` to print in one event.
+    """
+    users = set()
+    for fill in fills:
+        price = from_ticks(fill.price)
+        for order in (fill.maker, fill.taker):
+            if order.user_id == MARKET_MAKER:
+                continue
+            users.add(order.user_id)
+            trade_store.record(order.user_id, order.id, fill.symbol, order.side, fill.quantity,
+                               price, fill.timestamp)
+            position_book.apply(order.user_id, fill.symbol, order.side, fill.quantity, price)
+        if not fill.taker.batched:
+            # Print the trade to every worker's WebSocket clients
+            await manager.publish_event({'type': 'trade', **_trade_print(fill)})
+    trade_store.flush()
+    position_book.flush()
+    for user_id in users:
+        await result_cache.publish_invalidation(user_tag(user_id))
+
+def _new_order(trade_request: TradeRequest, user_id) -> Order:
+    """Validate a trade request into an engine order; ValueError says what's wrong"""
+    if trade_request.symbol not in market_engine.symbol_ids:
+        raise ValueError(f"Stock symbol {trade_request.symbol} not found")
+    price_type = trade_request.price_type
+    if trade_request.order_type not in (BUY, SELL) or price_type not in PRICE_TYPES:
+        raise ValueError(f"order_type must be 'buy' or 'sell' and price_type one of {', '.join(PRICE_TYPES)}")
+    if trade_request.quantity <= 0:
+        raise ValueError("Quantity must be positive")
+    limited = price_type in (LIMIT, STOP_LIMIT)
+    if limited and (not trade_request.limit_price or trade_request.limit_price <= 0):
+        raise ValueError("Limit and stop-limit orders need a positive limit_price")
+    if price_type in (STOP, STOP_LIMIT) and (not trade_request.stop_price or trade_request.stop_price <= 0):
+        raise ValueError("Stop and stop-limit orders need a positive stop_price")
+    if price_type == TRAILING_STOP and (not trade_request.trail_amount or trade_request.trail_amount <= 0):
+        raise ValueError("Trailing stops need a positive trail_amount")
+    # Market orders never rest, so they are IOC unless asked to be FOK. For
+    # stops, DAY/GTC/GTD is how long they stay pending.
+    time_in_force = trade_request.time_in_force or ("IOC" if price_type == MARKET else "GTC")
+    if time_in_force not in TIME_IN_FORCE:
+        raise ValueError(f"time_in_force must be one of {', '.join(TIME_IN_FORCE)}")
+    if price_type == MARKET and time_in_force in RESTING:
+        time_in_force = "IOC"
+    expires_at = None
+    if time_in_force == "GTD":
+        if trade_request.expire_time is None:
+            raise ValueError("GTD orders need an expire_time")
+        expires_at = trade_request.expire_time.timestamp()
+        if expires_at <= market_clock.now():
+            raise ValueError("expire_time must be in the future (market time)")
+    elif trade_request.expire_time is not None:
+        raise ValueError("expire_time is only for GTD orders")
+
+    return matching_engine.new_order(
+        user_id, trade_request.symbol, trade_request.order_type, trade_request.quantity,
+        price_type,
+        trade_request.limit_price if limited else None,
+        time_in_force,
+        trade_request.stop_price if price_type in (STOP, STOP_LIMIT) else None,
+        trade_request.trail_amount if price_type == TRAILING_STOP else None,
+        expires_at,
+    )
 
 @router.post("/place-order", response_model=TradeResponse)
 async def place_order(
@@ -35,200 +292,282 @@ async def place_order(
     current_user: dict = Depends(get_current_user)
 ):
     """Place a buy or sell order"""
-    
-    # Mock stock prices
-    mock_prices = {
-        'AAPL': 175.50, 'GOOGL': 2845.20, 'MSFT': 378.90, 'TSLA': 245.67,
-        'AMZN': 3456.78, 'NVDA': 456.32, 'META': 324.15, 'NFLX': 456.78
-    }
-    
-    if trade_request.symbol not in mock_prices:
+    try:
+        order = _new_order(trade_request, current_user["id"])
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    await order_pipeline.submit(order)
+    return _order_response(order)
+
+@router.post("/place-orders", response_model=BulkOrderResponse)
+async def place_orders(
+    bulk_request: BulkOrderRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Place many orders in one request.
+
+    All orders are validated first. In ``strict`` mode one invalid order
+    rejects the whole batch before any of it executes; in ``best_effort``
+    mode invalid orders are reported and the rest go ahead. Only validation
+    is all-or-nothing: each accepted order then executes on its own, so
+    some may fill while others rest or, as IOC/FOK orders, cancel. Accepted
+    orders on the same shard run back to back, so no other order on their
+    symbols interleaves with them. Their trades are printed to WebSocket
+    clients as one ``trades`` event.
+    """
+    if bulk_request.mode not in BULK_MODES:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Stock symbol {trade_request.symbol} not found"
+            detail=f"mode must be one of {', '.join(BULK_MODES)}"
         )
-    
-    # Get current price (use limit price if provided and valid)
-    current_price = mock_prices[trade_request.symbol]
-    execution_price = current_price
-    
-    if trade_request.price_type == "limit" and trade_request.limit_price:
-        if trade_request.order_type == "buy" and trade_request.limit_price < current_price:
-            # Can't execute buy limit order above current price
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Buy limit price ${trade_request.limit_price} is below current price ${current_price}"
-            )
-        elif trade_request.order_type == "sell" and trade_request.limit_price > current_price:
-            # Can't execute sell limit order below current price
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Sell limit price ${trade_request.limit_price} is above current price ${current_price}"
-            )
-        execution_price = float(trade_request.limit_price)
-    
-    total = execution_price * trade_request.quantity
-    
-    # Create trade record
-    trade = TradeResponse(
-        id=f"trade_{len(mock_trades) + 1}",
-        symbol=trade_request.symbol,
-        quantity=trade_request.quantity,
-        order_type=trade_request.order_type,
-        price=Decimal(str(execution_price)),
-        total=Decimal(str(total)),
-        status="executed",
-        timestamp=datetime.now()
+    if not bulk_request.orders or len(bulk_request.orders) > MAX_BULK_ORDERS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Send between 1 and {MAX_BULK_ORDERS} orders"
+        )
+
+    orders, results = [], []
+    for index, trade_request in enumerate(bulk_request.orders):
+        try:
+            orders.append(_new_order(trade_request, current_user["id"]))
+            results.append(BulkOrderResult(index=index, status="accepted"))
+        except ValueError as e:
+            results.append(BulkOrderResult(index=index, status="rejected", error=str(e)))
+    if bulk_request.mode == "strict" and len(orders) < len(results):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=[result.model_dump(exclude_none=True) for result in results if result.status == "rejected"]
+        )
+
+    fills = await order_pipeline.submit_many(orders)
+    # Stop orders the batch triggered were printed as they filled
+    batch = set(orders)
+    prints = [_trade_print(fill) for fill in fills if fill.taker in batch]
+    if prints:
+        await manager.publish_event({'type': 'trades', 'trades': prints})
+    accepted = iter(orders)
+    for result in results:
+        if result.status == "accepted":
+            result.order = _order_response(next(accepted))
+    return BulkOrderResponse(
+        mode=bulk_request.mode,
+        accepted=len(orders),
+        rejected=len(results) - len(orders),
+        results=results
     )
-    
-    mock_trades.append(trade)
-    
-    return trade
+
+@router.get("/orderbook/{symbol}")
+async def get_order_book(
+    symbol: str,
+    levels: int = Query(DEPTH_LEVELS, ge=1, le=MAX_DEPTH_LEVELS, description="Price levels per side"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Get L2 depth for a stock; ``seq`` lines up with the book_delta stream on /ws"""
+    if symbol not in market_engine.symbol_ids:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Stock symbol {symbol} not found"
+        )
+    return await order_pipeline.snapshot(symbol, levels)
+
+@router.get("/orders", response_model=List[TradeResponse])
+async def get_open_orders(
+    current_user: dict = Depends(get_current_user)
+):
+    """Get the user's resting orders and pending stops"""
+    return [_order_response(order) for order in matching_engine.open_orders(current_user["id"])]
+
+@router.delete("/orders/{order_id}", response_model=TradeResponse)
+async def cancel_order(
+    order_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """Cancel a resting order or a pending stop"""
+    order = await order_pipeline.cancel(order_id, current_user["id"])
+    if order is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Open order not found")
+    return _order_response(order)
+
+@router.patch("/orders/{order_id}", response_model=TradeResponse)
+async def replace_order(
+    order_id: str,
+    replace_request: ReplaceOrderRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Change the price and/or quantity of a resting or pending order.
+
+    A pending stop keeps its trigger; ``price`` changes a stop-limit's limit
+    and is rejected for stop and trailing-stop orders, which have none.
+    """
+    if replace_request.quantity is not None and replace_request.quantity <= 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Quantity must be positive")
+    if replace_request.price is not None and replace_request.price <= 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Price must be positive")
+    try:
+        replaced = await order_pipeline.replace(
+            order_id, current_user["id"], replace_request.price, replace_request.quantity
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if replaced is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Open order not found")
+    return _order_response(replaced[0])
 
 @router.get("/history", response_model=List[TradeResponse])
 async def get_trade_history(
-    limit: int = 10,
+    response: Response,
+    limit: int = Query(10, ge=1, le=MAX_HISTORY_PAGE),
+    symbol: Optional[str] = None,
+    side: Optional[str] = Query(None, description="'buy' or 'sell'"),
+    start: Optional[datetime] = Query(None, description="Trades at or after this time"),
+    end: Optional[datetime] = Query(None, description="Trades before this time"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor header of the previous page"),
     current_user: dict = Depends(get_current_user)
 ):
-    """Get user's trade history"""
-    return mock_trades[-limit:]
+    """Get the user's trades, newest first.
+
+    When there are more, the response carries an ``X-Next-Cursor`` header;
+    pass it back as ``cursor`` with the same filters for the next page.
+    """
+    if side is not None and side not in (BUY, SELL):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="side must be 'buy' or 'sell'")
+    if cursor is not None and not cursor.isdigit():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    trades, next_cursor = await trade_store.query(
+        current_user["id"], symbol, side,
+        None if start is None else start.timestamp(),
+        None if end is None else end.timestamp(),
+        None if cursor is None else int(cursor),
+        limit,
+    )
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    return [_trade_response(trade) for trade in trades]
 
 @router.get("/positions")
 async def get_positions(
     current_user: dict = Depends(get_current_user)
 ):
     """Get current stock positions"""
-    positions = [
-        {"symbol": "AAPL", "quantity": 10, "avg_price": 170.25},
-        {"symbol": "GOOGL", "quantity": 2, "avg_price": 2800.00},
-        {"symbol": "MSFT", "quantity": 5, "avg_price": 365.50}
+    return [
+        {
+            "symbol": position["symbol"],
+            "quantity": position["quantity"],
+            "avg_price": round(position["average_cost"], 4),
+            "realized_pnl": round(position["realized_pnl"], 2),
+        }
+        for position in position_book.positions(current_user["id"])
     ]
-    return positions
 
 # Portfolio Analytics Endpoints
 @router.get("/portfolio/holdings")
 async def get_portfolio_holdings(
     current_user: dict = Depends(get_current_user)
 ):
-    """Get detailed portfolio holdings with current market values"""
-    mock_prices = {
-        'AAPL': 175.50, 'GOOGL': 2845.20, 'MSFT': 378.90, 'TSLA': 245.67,
-        'AMZN': 3456.78, 'NVDA': 456.32, 'META': 324.15, 'NFLX': 456.78
-    }
-    
-    holdings = [
-        {
-            "symbol": "AAPL",
-            "shares": 50,
-            "avgCost": 150.25,
-            "currentPrice": mock_prices['AAPL'],
-            "marketValue": 50 * mock_prices['AAPL'],
-            "gainLoss": (mock_prices['AAPL'] - 150.25) * 50,
-            "gainLossPercent": ((mock_prices['AAPL'] - 150.25) / 150.25) * 100
-        },
-        {
-            "symbol": "GOOGL",
-            "shares": 25,
-            "avgCost": 2700.80,
-            "currentPrice": mock_prices['GOOGL'],
-            "marketValue": 25 * mock_prices['GOOGL'],
-            "gainLoss": (mock_prices['GOOGL'] - 2700.80) * 25,
-            "gainLossPercent": ((mock_prices['GOOGL'] - 2700.80) / 2700.80) * 100
-        },
-        {
-            "symbol": "MSFT",
-            "shares": 30,
-            "avgCost": 355.50,
-            "currentPrice": mock_prices['MSFT'],
-            "marketValue": 30 * mock_prices['MSFT'],
-            "gainLoss": (mock_prices['MSFT'] - 355.50) * 30,
-            "gainLossPercent": ((mock_prices['MSFT'] - 355.50) / 355.50) * 100
-        }
-    ]
-    
+    """Get detailed portfolio holdings with current market values.
+
+    Not cached: it is a lookup of the user's positions, and must show a
+    fill as soon as the order returns.
+    """
+    holdings = []
+    for position in position_book.positions(current_user["id"]):
+        shares, cost = position["quantity"], position["average_cost"]
+        price = market_engine.price(position["symbol"])
+        gain = (price - cost) * shares
+        holdings.append({
+            "symbol": position["symbol"],
+            "shares": shares,
+            "avgCost": round(cost, 4),
+            "currentPrice": round(price, 2),
+            "marketValue": round(shares * price, 2),
+            "gainLoss": round(gain, 2),
+            "gainLossPercent": round(gain / abs(cost * shares) * 100, 2) if cost else 0.0,
+            "realizedGainLoss": round(position["realized_pnl"], 2),
+        })
     return holdings
 
+def _day_open(symbol: str) -> float:
+    """Open of the symbol's current daily candle, or its price before the first tick"""
+    candles = candle_aggregator.candles(symbol, "1d", 1)
+    return float(candles["open"][-1]) if len(candles["open"]) else market_engine.price(symbol)
+
 @router.get("/portfolio/performance")
 async def get_portfolio_performance(
     current_user: dict = Depends(get_current_user)
 ):
-    """Get portfolio performance metrics"""
+    """Get portfolio performance metrics from the user's positions at current prices"""
+    value = invested = realized = day_gain = day_open_value = 0.0
+    for position in position_book.positions(current_user["id"], open_only=False):
+        shares = position["quantity"]
+        price = market_engine.price(position["symbol"])
+        open_price = _day_open(position["symbol"])
+        value += shares * price
+        invested += shares * position["average_cost"]
+        realized += position["realized_pnl"]
+        day_gain += shares * (price - open_price)
+        day_open_value += shares * open_price
+    total_gain = value - invested + realized
     return {
-        "totalValue": 125450.75,
-        "dayGainLoss": 2834.50,
-        "dayGainLossPercent": 2.31,
-        "totalGainLoss": 15750.25,
-        "totalGainLossPercent": 14.35,
-        "totalInvested": 109700.50
+        "totalValue": round(value, 2),
+        "dayGainLoss": round(day_gain, 2),
+        "dayGainLossPercent": round(day_gain / abs(day_open_value) * 100, 2) if day_open_value else 0.0,
+        "totalGainLoss": round(total_gain, 2),
+        "totalGainLossPercent": round(total_gain / abs(invested) * 100, 2) if invested else 0.0,
+        "totalInvested": round(invested, 2),
     }
 
 @router.get("/portfolio/pnl")
+@cached("portfolio-pnl", ttl=5, per_user=True)
 async def get_portfolio_pnl(
     period: str = Query("1M", description="Time period: 1D, 1W, 1M, 3M, 6M, 1Y"),
+    points: int = Query(200, ge=2, le=MAX_CHART_POINTS, description="Most points returned"),
+    method: str = Query("lttb", description="Downsampling: 'lttb' or 'min_max'"),
     current_user: dict = Depends(get_current_user)
 ):
     """Get portfolio profit/loss data over time"""
-    days_map = {"1D": 1, "1W": 7, "1M": 30, "3M": 90, "6M": 180, "1Y": 365}
-    days = days_map.get(period, 30)
-    
+    dates, rows = await _portfolio_history(current_user["id"], period, points, method, "pnl")
     pnl_data = []
-    base_value = 100000
-    
-    for i in range(days):
-        date = datetime.now() - timedelta(days=days-i-1)
-        # Simulate portfolio growth with some volatility
-        daily_change = random.uniform(-2, 3)  # -2% to +3% daily change
-        base_value *= (1 + daily_change / 100)
-        
+    for date, value, pnl in zip(dates, rows[:, 1].tolist(), rows[:, 4].tolist()):
+        invested = value - pnl
         pnl_data.append({
-            "date": date.strftime("%Y-%m-%d"),
-            "value": round(base_value, 2),
-            "gainLoss": round(base_value - 100000, 2),
-            "gainLossPercent": round(((base_value - 100000) / 100000) * 100, 2)
+            "date": date,
+            "value": round(value, 2),
+            "gainLoss": round(pnl, 2),
+            "gainLossPercent": round(pnl / abs(invested) * 100, 2) if invested else 0.0,
         })
-    
     return pnl_data
 
 @router.get("/portfolio/allocation")
 async def get_portfolio_allocation(
     current_user: dict = Depends(get_current_user)
 ):
-    """Get portfolio allocation by stock"""
+    """Get portfolio allocation by stock, and cash, by market value"""
+    slices = [
+        (position["symbol"], abs(position["quantity"]) * market_engine.price(position["symbol"]))
+        for position in position_book.positions(current_user["id"])
+    ]
+    slices.append(("Cash", max(current_user["wallet_balance"], 0.0)))
+    total = sum(value for _, value in slices)
     return [
-        {"name": "AAPL", "value": 8775, "percentage": 35.1},
-        {"name": "GOOGL", "value": 7113, "percentage": 28.4},
-        {"name": "MSFT", "value": 5367, "percentage": 21.5},
-        {"name": "TSLA", "value": 2456, "percentage": 9.8},
-        {"name": "Cash", "value": 1289, "percentage": 5.2}
+        {"name": name, "value": round(value, 2), "percentage": round(value / total * 100, 1) if total else 0.0}
+        for name, value in slices
     ]
 
 @router.get("/portfolio/value-history")
+@cached("portfolio-value-history", ttl=60, per_user=True)
 async def get_portfolio_value_history(
     period: str = Query("1M", description="Time period: 1D, 1W, 1M, 3M, 6M, 1Y"),
+    points: int = Query(200, ge=2, le=MAX_CHART_POINTS, description="Most points returned"),
+    method: str = Query("lttb", description="Downsampling: 'lttb' or 'min_max'"),
     current_user: dict = Depends(get_current_user)
 ):
     """Get portfolio value history over time"""
-    days_map = {"1D": 1, "1W": 7, "1M": 30, "3M": 90, "6M": 180, "1Y": 365}
-    days = days_map.get(period, 30)
-    
-    value_history = []
-    base_value = 100000
-    
-    for i in range(days):
-        date = datetime.now() - timedelta(days=days-i-1)
-        # Simulate portfolio growth
-        daily_change = random.uniform(-1.5, 2.5)
-        base_value *= (1 + daily_change / 100)
-        
-        value_history.append({
-            "date": date.strftime("%Y-%m-%d"),
-            "value": round(base_value, 2)
-        })
-    
-    return value_history
+    dates, rows = await _portfolio_history(current_user["id"], period, points, method, "value")
+    return [{"date": date, "value": round(value, 2)} for date, value in zip(dates, rows[:, 1].tolist())]
 
 # Analytics Endpoints
 @router.get("/analytics/stock-history/{symbol}")
+@cached("stock-history", ttl=30)
 async def get_stock_history(
     symbol: str,
     period: str = Query("1M", description="Time period: 1D, 1W, 1M, 3M, 6M, 1Y"),
@@ -237,7 +576,14 @@ async def get_stock_history(
     """Get stock price history for charts"""
     days_map = {"1D": 1, "1W": 7, "1M": 30, "3M": 90, "6M": 180, "1Y": 365}
     days = days_map.get(period, 30)
+
+    # Prefer live candles and stored ticks; synthesise a series only when there are none
+    resolution, count = HISTORY_CANDLES.get(period, HISTORY_CANDLES["1M"])
+    bars = _candle_bars(symbol, resolution, count) or _daily_bars(symbol, days)
+    if bars:
+        return bars
     
+    rng = _history_rng("stock-history", symbol, period)
     history = []
     base_price = 150.0  # Starting price
     
@@ -245,17 +591,17 @@ async def get_stock_history(
         date = datetime.now() - timedelta(days=days-i-1)
         
         # Simulate price movement
-        daily_change = random.uniform(-5, 5)
+        daily_change = rng.uniform(-5, 5)
         base_price += daily_change
         base_price = max(10, base_price)  # Minimum price
         
-        volume = random.randint(500000, 2000000)
+        volume = rng.randint(500000, 2000000)
         
         history.append({
             "date": date.strftime("%Y-%m-%d"),
-            "open": round(base_price - random.uniform(-2, 2), 2),
-            "high": round(base_price + random.uniform(0, 5), 2),
-            "low": round(base_price - random.uniform(0, 5), 2),
+            "open": round(base_price - rng.uniform(-2, 2), 2),
+            "high": round(base_price + rng.uniform(0, 5), 2),
+            "low": round(base_price - rng.uniform(0, 5), 2),
             "close": round(base_price, 2),
             "volume": volume
         })
@@ -263,33 +609,50 @@ async def get_stock_history(
     return history
 
 @router.get("/analytics/moving-averages/{symbol}")
+@cached("moving-averages", ttl=30)
 async def get_moving_averages(
     symbol: str,
     periods: str = Query("20,50,200", description="Comma-separated periods"),
     current_user: dict = Depends(get_current_user)
 ):
     """Get moving averages for a stock"""
-    period_list = [int(p) for p in periods.split(',')]
+    try:
+        period_list = [int(p) for p in periods.split(',')]
+    except ValueError:
+        period_list = []
+    if not period_list or any(p < 1 or p > MAX_MA_PERIOD for p in period_list):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Periods must be integers between 1 and {MAX_MA_PERIOD}"
+        )
+    if len(set(period_list)) > indicator_engine.max_periods:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Request at most {indicator_engine.max_periods} periods"
+        )
+
+    # Daily candle closes, with the running state kept warm by the indicator engine
+    if symbol in indicator_engine.aggregator.symbol_ids:
+        moving_averages = indicator_engine.moving_averages(symbol, period_list)
+        if moving_averages[f'ma{max(period_list)}']:
+            return moving_averages
     
-    # Generate mock price data
+    # Generate mock price data if there isn't enough history yet
+    rng = _history_rng("moving-averages", symbol)
     prices = []
     base_price = 150.0
     for i in range(200):  # Generate 200 days of data
-        base_price += random.uniform(-3, 3)
+        base_price += rng.uniform(-3, 3)
         prices.append(base_price)
     
     # Calculate moving averages
-    moving_averages = {}
-    for period in period_list:
-        ma_values = []
-        for i in range(period - 1, len(prices)):
-            ma = sum(prices[i - period + 1:i + 1]) / period
-            ma_values.append(round(ma, 2))
-        moving_averages[f'ma{period}'] = ma_values
-    
-    return moving_averages
+    return {
+        f'ma{period}': np.round(sma(prices, period), 2).tolist()
+        for period in period_list
+    }
 
 @router.get("/analytics/volume-trends/{symbol}")
+@cached("volume-trends", ttl=60)
 async def get_volume_trends(
     symbol: str,
     period: str = Query("1M", description="Time period"),
@@ -298,11 +661,20 @@ async def get_volume_trends(
     """Get volume trends for a stock"""
     days_map = {"1D": 1, "1W": 7, "1M": 30, "3M": 90, "6M": 180, "1Y": 365}
     days = days_map.get(period, 30)
+
+    bars = _daily_bars(symbol, days)
+    if bars:
+        avg_volume = round(sum(bar["volume"] for bar in bars) / len(bars))
+        return [
+            {"date": bar["date"], "volume": bar["volume"], "avgVolume": avg_volume}
+            for bar in bars
+        ]
     
+    rng = _history_rng("volume-trends", symbol, period)
     volume_data = []
     for i in range(days):
         date = datetime.now() - timedelta(days=days-i-1)
-        volume = random.randint(500000, 2000000)
+        volume = rng.randint(500000, 2000000)
         avg_volume = 1000000
         
         volume_data.append({
@@ -314,49 +686,113 @@ async def get_volume_trends(
     return volume_data
 
 @router.get("/analytics/technical-indicators/{symbol}")
+@cached("technical-indicators", ttl=15)
 async def get_technical_indicators(
     symbol: str,
     current_user: dict = Depends(get_current_user)
 ):
     """Get technical indicators for a stock"""
+    # Daily candles, with the running state kept warm by the indicator engine
+    if symbol in indicator_engine.aggregator.symbol_ids:
+        indicators = indicator_engine.technical_indicators(symbol)
+        if indicators is not None:
+            return indicators
+
+    # Generate mock daily bars if there isn't enough history yet
+    rng = _history_rng("technical-indicators", symbol)
+    closes, highs, lows, volumes = [], [], [], []
+    base_price = 150.0
+    for i in range(200):
+        base_price += rng.uniform(-3, 3)
+        closes.append(base_price)
+        highs.append(base_price + rng.uniform(0, 2))
+        lows.append(base_price - rng.uniform(0, 2))
+        volumes.append(rng.randint(500000, 2000000))
+
+    line, signal, histogram = macd(closes)
+    upper, middle, lower = bollinger(closes)
     return {
-        "rsi": round(random.uniform(30, 70), 2),
+        "rsi": round(float(rsi(closes)[-1]), 2),
         "macd": {
-            "macd": round(random.uniform(-2, 2), 2),
-            "signal": round(random.uniform(-2, 2), 2),
-            "histogram": round(random.uniform(-1, 1), 2)
+            "macd": round(float(line[-1]), 2),
+            "signal": round(float(signal[-1]), 2),
+            "histogram": round(float(histogram[-1]), 2)
         },
         "bollingerBands": {
-            "upper": round(random.uniform(160, 180), 2),
-            "middle": round(random.uniform(150, 160), 2),
-            "lower": round(random.uniform(140, 150), 2)
-        }
+            "upper": round(float(upper[-1]), 2),
+            "middle": round(float(middle[-1]), 2),
+            "lower": round(float(lower[-1]), 2)
+        },
+        "atr": round(float(atr(highs, lows, closes)[-1]), 2),
+        "vwap": round(float(vwap(highs, lows, closes, volumes)[-1]), 2)
     }
 
+@router.post("/analytics/batch")
+async def get_batch_analytics(
+    batch_request: BatchAnalyticsRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Compute metrics for many symbols at once, returned column-wise.
+
+    ``series`` metrics hold one row per symbol with a value per timestamp;
+    ``summary`` metrics hold one value per symbol, in the order of ``symbols``.
+    """
+    symbols = list(dict.fromkeys(batch_request.symbols))
+    metrics = list(dict.fromkeys(batch_request.metrics))
+    if not symbols or len(symbols) > MAX_BATCH_SYMBOLS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Request between 1 and {MAX_BATCH_SYMBOLS} symbols"
+        )
+    unknown = [symbol for symbol in symbols if symbol not in candle_aggregator.symbol_ids]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Stock symbols not found: {', '.join(unknown)}"
+        )
+    if batch_request.period not in HISTORY_CANDLES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Period must be one of {', '.join(HISTORY_CANDLES)}"
+        )
+    try:
+        warmup = metric_warmup(metrics)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if not metrics or warmup > MAX_MA_PERIOD:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Request at least one metric, with moving-average periods up to {MAX_MA_PERIOD}"
+        )
+    resolution, count = HISTORY_CANDLES[batch_request.period]
+
+    async def compute():
+        indices = [candle_aggregator.symbol_ids[symbol] for symbol in symbols]
+        candles = candle_aggregator.matrix(resolution, count + warmup, indices)
+        series, summary = batch_metrics(candles, metrics, count)
+        return {
+            "symbols": symbols,
+            "period": batch_request.period,
+            "resolution": resolution,
+            "timestamps": _candle_dates(candles["start"][-count:], resolution),
+            "series": {name: _columns(values) for name, values in series.items()},
+            "summary": {name: _columns(values) for name, values in summary.items()},
+        }
+
+    key = (("symbols", tuple(symbols)), ("metrics", tuple(metrics)), ("period", batch_request.period))
+    return await result_cache.get_or_compute("analytics-batch", key, 15, (TICKS,), compute)
+
 @router.get("/analytics/market-overview")
 async def get_market_overview(
     current_user: dict = Depends(get_current_user)
 ):
     """Get market overview data"""
-    return {
-        "sp500": {"value": 4185.47, "change": 1.2},
-        "nasdaq": {"value": 12846.81, "change": 2.1},
-        "dow": {"value": 33745.40, "change": -0.5},
-        "vix": {"value": 18.52, "change": -3.2}
-    }
+    # Indices are kept up to date tick by tick, so reading them is O(1)
+    return market_indices.overview()
 
 @router.get("/analytics/sector-performance")
 async def get_sector_performance(
     current_user: dict = Depends(get_current_user)
 ):
     """Get sector performance data"""
-    return [
-        {"sector": "Technology", "performance": 12.5},
-        {"sector": "Healthcare", "performance": 8.3},
-        {"sector": "Finance", "performance": -2.1},
-        {"sector": "Energy", "performance": 15.7},
-        {"sector": "Consumer", "performance": 6.2},
-        {"sector": "Industrial", "performance": 4.8},
-        {"sector": "Utilities", "performance": 3.1},
-        {"sector": "Real Estate", "performance": 9.4}
-    ]
+    return market_indices.sectors()
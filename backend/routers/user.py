@@ -1,15 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from datetime import timedelta
-from typing import List
+from typing import List, Optional
 
 from database import get_db
 from schemas.user import User, UserCreate, Token, WalletUpdate, WalletTransactionResponse
-from services.user_service import UserService
+from services.user_service import EXPORT_FORMATS, UserService, export_wallet_transactions
 from auth import create_access_token, verify_token, ACCESS_TOKEN_EXPIRE_MINUTES
 
 router = APIRouter(prefix="/users", tags=["users"])
+
+# Largest wallet transaction page
+MAX_TRANSACTIONS_PAGE = 100
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="users/token")
 
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
@@ -61,9 +65,33 @@ def update_wallet(
 
 @router.get("/wallet/transactions", response_model=List[WalletTransactionResponse])
 def get_wallet_transactions(
-    limit: int = 10,
+    response: Response,
+    limit: int = Query(10, ge=1, le=MAX_TRANSACTIONS_PAGE),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor header of the previous page"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
+    """Newest transactions first; follow ``X-Next-Cursor`` for older pages"""
     user_service = UserService(db)
-    return user_service.get_wallet_transactions(current_user.id, limit)
+    transactions, next_cursor = user_service.get_wallet_transactions(current_user.id, limit, cursor)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return transactions
+
+@router.get("/wallet/transactions/export")
+def export_transactions(
+    format: str = Query("ndjson", description="'ndjson' or 'csv'"),
+    current_user: User = Depends(get_current_user)
+):
+    """Download the whole ledger, oldest first, streamed as it is read"""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"format must be one of {', '.join(EXPORT_FORMATS)}"
+        )
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        export_wallet_transactions(current_user.id, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="wallet-transactions.{format}"'}
+    )
@@ -0,0 +1,324 @@
+"""
+Streaming OHLCV candles.
+
+``CandleAggregator`` listens to the market feed and keeps candles at several
+resolutions for every symbol. All symbols tick together, so each resolution
+is a ring buffer of shape (symbols, capacity) and a tick is one vectorised
+update of the current column: O(1) work per symbol per resolution.
+
+Finished candles (1m and coarser) are rolled up into ``CandleStore``, one
+append-only file per column and resolution with a row per candle holding
+every symbol. Reads combine the persisted rows with the in-memory ring, so
+a chart request is a couple of slices rather than a recomputation. The
+store's symbol table sits next to the columns; a store written for another
+universe is moved aside and started afresh, since its columns would be
+read as the wrong symbols. Reads binary-search the start column, so rows
+that don't start after the last stored one are dropped. The market clock
+resumes from the store's ``end`` on startup, so live candles aren't.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from services.market_data import market_engine
+
+logger = logging.getLogger(__name__)
+
+STORE_PATH = os.getenv("CANDLE_STORE_PATH", "data/candles")
+
+# Resolution name -> (seconds, ring capacity)
+RESOLUTIONS = {
+    "1s": (1, 120),
+    "1m": (60, 120),
+    "5m": (300, 288),
+    "1h": (3600, 168),
+    "1d": (86400, 30),
+}
+
+# 1s candles are not persisted; the tick store already covers that detail
+PERSISTED = ("1m", "5m", "1h", "1d")
+
+ROLLUP_BATCH = 16
+
+# Newline-separated symbols, in column order
+SYMBOL_TABLE = "symbols.txt"
+
+COLUMNS = (("start", "<f8"), ("open", "<f8"), ("high", "<f8"), ("low", "<f8"), ("close", "<f8"), ("volume", "<i8"))
+
+def empty_candles() -> Dict[str, np.ndarray]:
+    return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS}
+
+class CandleSeries:
+    """Ring buffer of candles at one resolution for the whole universe"""
+
+    def __init__(self, seconds: int, capacity: int, size: int):
+        self.seconds = seconds
+        self.capacity = capacity
+        self.start = np.zeros(capacity, dtype=np.float64)
+        self.open = np.zeros((size, capacity), dtype=np.float64)
+        self.high = np.zeros((size, capacity), dtype=np.float64)
+        self.low = np.zeros((size, capacity), dtype=np.float64)
+        self.close = np.zeros((size, capacity), dtype=np.float64)
+        self.volume = np.zeros((size, capacity), dtype=np.int64)
+        self.head = -1
+        self.count = 0
+
+    def update(self, timestamp: float, prices: np.ndarray, volumes: np.ndarray) -> Optional[int]:
+        """Fold one tick into the current candle.
+
+        Returns the ring slot of the candle that was just finished, if the
+        tick opened a new one.
+        """
+        bucket = timestamp // self.seconds * self.seconds
+        head = self.head
+        if head >= 0 and self.start[head] == bucket:
+            np.maximum(self.high[:, head], prices, out=self.high[:, head])
+            np.minimum(self.low[:, head], prices, out=self.low[:, head])
+            self.close[:, head] = prices
+            self.volume[:, head] += volumes
+            return None
+
+        finished = head if head >= 0 else None
+        head = self.head = (head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.start[head] = bucket
+        self.open[:, head] = prices
+        self.high[:, head] = prices
+        self.low[:, head] = prices
+        self.close[:, head] = prices
+        self.volume[:, head] = volumes
+        return finished
+
+    def order(self, count: int = None) -> np.ndarray:
+        """Ring slots of the last ``count`` candles, oldest first"""
+        count = self.count if count is None else min(count, self.count)
+        return (np.arange(self.head - count + 1, self.head + 1)) % self.capacity
+
+    def candles(self, index: int, count: int = None) -> Dict[str, np.ndarray]:
+        """Last ``count`` candles of one symbol (the live one included)"""
+        slots = self.order(count)
+        return {
+            "start": self.start[slots],
+            "open": self.open[index, slots],
+            "high": self.high[index, slots],
+            "low": self.low[index, slots],
+            "close": self.close[index, slots],
+            "volume": self.volume[index, slots],
+        }
+
+class CandleStore:
+    """Append-only persisted candles: per resolution, one file per column.
+
+    Each row holds the candle of every symbol for one time bucket, so a
+    symbol's history is a strided column of a memory-mapped matrix.
+    """
+
+    def __init__(self, symbols: List[str], root: str = STORE_PATH):
+        self.root = root
+        self.symbols = list(symbols)
+        self.size = len(self.symbols)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="candle-store")
+        self._maps = {}
+        # Resolution -> start of its last stored row
+        self._last: Dict[str, float] = {}
+        self._open()
+
+    def _open(self):
+        """Check the stored symbol table, or start a fresh store for this universe"""
+        table = os.path.join(self.root, SYMBOL_TABLE)
+        if os.path.exists(table):
+            with open(table) as f:
+                if f.read().split("\n") == self.symbols:
+                    return
+        if os.path.isdir(self.root) and os.listdir(self.root):
+            stale = f"{self.root}.stale-{int(time.time())}"
+            logger.warning("%s holds candles of a different symbol universe; moving it to %s", self.root, stale)
+            try:
+                os.rename(self.root, stale)
+            except OSError:
+                # Another worker moved it first
+                pass
+        os.makedirs(self.root, exist_ok=True)
+        with open(table, "w") as f:
+            f.write("\n".join(self.symbols))
+
+    def append(self, resolution: str, rows: Dict[str, np.ndarray]):
+        """Queue a batch of finished candles (arrays of shape (rows, symbols))"""
+        self._writer.submit(self._write, resolution, rows)
+
+    def wait(self):
+        self._writer.submit(lambda: None).result()
+
+    def _write(self, resolution: str, rows: Dict[str, np.ndarray]):
+        directory = os.path.join(self.root, resolution)
+        os.makedirs(directory, exist_ok=True)
+        last = self._last.get(resolution)
+        if last is None:
+            last = self._last[resolution] = self._stored_end(directory)
+        keep = rows["start"] > last
+        if not keep.all():
+            logger.warning("Dropping %d %s candles that start before the end of the store at %s",
+                           int((~keep).sum()), resolution, last)
+            rows = {name: values[keep] for name, values in rows.items()}
+            if not keep.any():
+                return
+        self._last[resolution] = float(rows["start"][-1])
+        # "start" goes last: readers size the other columns from it
+        for name, dtype in COLUMNS[1:] + COLUMNS[:1]:
+            with open(os.path.join(directory, f"{name}.{dtype[1:]}"), "ab") as f:
+                f.write(np.ascontiguousarray(rows[name], dtype=dtype).tobytes())
+
+    def end(self) -> float:
+        """Market time the last stored candle of any resolution ends at"""
+        return max(
+            self._stored_end(os.path.join(self.root, resolution)) + RESOLUTIONS[resolution][0]
+            for resolution in PERSISTED
+        )
+
+    @staticmethod
+    def _stored_end(directory: str) -> float:
+        path = os.path.join(directory, "start.f8")
+        if not os.path.exists(path) or os.path.getsize(path) < 8:
+            return -np.inf
+        with open(path, "rb") as f:
+            f.seek(-8, os.SEEK_END)
+            return float(np.frombuffer(f.read(8), dtype="<f8")[0])
+
+    def _columns(self, resolution: str) -> Optional[Dict[str, np.ndarray]]:
+        directory = os.path.join(self.root, resolution)
+        start_path = os.path.join(directory, "start.f8")
+        if not os.path.exists(start_path):
+            return None
+        rows = os.path.getsize(start_path) // 8
+        cached = self._maps.get(resolution)
+        if cached is None or cached[0] != rows:
+            maps = {"start": np.memmap(start_path, dtype="<f8", mode="r", shape=(rows,))}
+            for name, dtype in COLUMNS[1:]:
+                maps[name] = np.memmap(
+                    os.path.join(directory, f"{name}.{dtype[1:]}"), dtype=dtype, mode="r", shape=(rows, self.size)
+                )
+            cached = self._maps[resolution] = (rows, maps)
+        return cached[1]
+
+    def rows(self, resolution: str, before: float, count: int) -> Dict[str, np.ndarray]:
+        """Up to ``count`` persisted rows starting before ``before``.
+
+        ``start`` has shape (rows,); the other columns are (rows, symbols).
+        """
+        maps = self._columns(resolution)
+        if maps is None:
+            return {name: np.empty((0,) if name == "start" else (0, self.size), dtype=dtype) for name, dtype in COLUMNS}
+        hi = int(np.searchsorted(maps["start"], before))
+        lo = max(0, hi - count)
+        return {name: maps[name][lo:hi] for name, _ in COLUMNS}
+
+    def candles(self, resolution: str, index: int, before: float, count: int) -> Dict[str, np.ndarray]:
+        """Up to ``count`` persisted candles of one symbol starting before ``before``"""
+        maps = self._columns(resolution)
+        if maps is None:
+            return empty_candles()
+        hi = int(np.searchsorted(maps["start"], before))
+        lo = max(0, hi - count)
+        result = {"start": maps["start"][lo:hi]}
+        for name, _ in COLUMNS[1:]:
+            result[name] = maps[name][lo:hi, index]
+        return result
+
+class CandleAggregator:
+    """Keeps candles at every resolution up to date from the live tick stream"""
+
+    def __init__(self, symbols: List[str], store: CandleStore = None, resolutions: dict = RESOLUTIONS):
+        self.symbols = symbols
+        self.symbol_ids = {symbol: i for i, symbol in enumerate(symbols)}
+        self.series = {
+            name: CandleSeries(seconds, capacity, len(symbols))
+            for name, (seconds, capacity) in resolutions.items()
+        }
+        self.store = store
+        # Only the producing worker writes rollups; see start_persisting
+        self.persist = False
+        self._rollups: Dict[str, List[dict]] = {name: [] for name in PERSISTED}
+
+    async def start_persisting(self):
+        self.persist = True
+
+    async def on_tick(self, tick):
+        self.update(tick.timestamp, tick.prices, tick.volumes)
+
+    def update(self, timestamp: float, prices: np.ndarray, volumes: np.ndarray):
+        for name, series in self.series.items():
+            finished = series.update(timestamp, prices, volumes)
+            if finished is not None and self.persist and self.store is not None and name in self._rollups:
+                self._queue_rollup(name, series, finished)
+
+    def _queue_rollup(self, name: str, series: CandleSeries, slot: int):
+        pending = self._rollups[name]
+        pending.append({
+            "start": series.start[slot],
+            "open": series.open[:, slot].copy(),
+            "high": series.high[:, slot].copy(),
+            "low": series.low[:, slot].copy(),
+            "close": series.close[:, slot].copy(),
+            "volume": series.volume[:, slot].copy(),
+        })
+        if len(pending) >= ROLLUP_BATCH:
+            self.flush(name)
+
+    def flush(self, name: str = None):
+        """Hand pending rollups to the store (all resolutions by default)"""
+        for resolution in ([name] if name else list(self._rollups)):
+            pending = self._rollups[resolution]
+            if not pending or self.store is None:
+                continue
+            rows = {column: np.array([row[column] for row in pending]) for column, _ in COLUMNS}
+            self.store.append(resolution, rows)
+            self._rollups[resolution] = []
+
+    def candles(self, symbol: str, resolution: str, count: int) -> Dict[str, np.ndarray]:
+        """Last ``count`` candles for a symbol, oldest first, live candle included.
+
+        Older candles than the ring holds are read from the persisted rollups.
+        """
+        index = self.symbol_ids[symbol]
+        series = self.series[resolution]
+        recent = series.candles(index, count)
+        missing = count - len(recent["start"])
+        if missing <= 0 or self.store is None or resolution not in PERSISTED:
+            return recent
+        before = recent["start"][0] if len(recent["start"]) else np.inf
+        older = self.store.candles(resolution, index, before, missing)
+        if not len(older["start"]):
+            return recent
+        return {name: np.concatenate([older[name], recent[name]]) for name, _ in COLUMNS}
+
+    def matrix(self, resolution: str, count: int, indices: np.ndarray = None) -> Dict[str, np.ndarray]:
+        """Last ``count`` candles of every symbol, oldest first, live candle included.
+
+        ``start`` has shape (count,); the other columns are (symbols, count),
+        or (len(indices), count) when only the symbols at ``indices`` are wanted.
+        """
+        series = self.series[resolution]
+        slots = series.order(count)
+        rows = slice(None) if indices is None else np.asarray(indices)[:, None]
+        recent = {"start": series.start[slots]}
+        for name, _ in COLUMNS[1:]:
+            recent[name] = getattr(series, name)[rows, slots]
+        missing = count - len(slots)
+        if missing <= 0 or self.store is None or resolution not in PERSISTED:
+            return recent
+        before = recent["start"][0] if len(slots) else np.inf
+        older = self.store.rows(resolution, before, missing)
+        if not len(older["start"]):
+            return recent
+        combined = {"start": np.concatenate([older["start"], recent["start"]])}
+        columns = slice(None) if indices is None else np.asarray(indices)
+        for name, _ in COLUMNS[1:]:
+            combined[name] = np.concatenate([np.asarray(older[name][:, columns]).T, recent[name]], axis=1)
+        return combined
+
+candle_store = CandleStore(market_engine.symbols)
+candle_aggregator = CandleAggregator(market_engine.symbols, candle_store)
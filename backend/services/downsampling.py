@@ -0,0 +1,60 @@
+"""
+Reducing a time series to a number of points for charting.
+
+lttb
+    Largest-Triangle-Three-Buckets: keeps the first and last points and,
+    from each bucket in between, the point forming the largest triangle
+    with the point kept from the previous bucket and the average of the
+    next. Preserves the visual shape of the line.
+min_max
+    For each bucket, its lowest and highest points in time order, so
+    spikes survive however far the series is reduced.
+
+Both return indices into the input, in order.
+"""
+import numpy as np
+
+def lttb(times: np.ndarray, values: np.ndarray, points: int) -> np.ndarray:
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    count = len(values)
+    if points >= count:
+        return np.arange(count)
+    if points < 3:
+        return np.array([0, count - 1][:max(points, 0)], dtype=np.intp)
+    # Bucket edges for the points between the first and the last
+    edges = np.linspace(1, count - 1, points - 1).astype(np.intp)
+    chosen = np.empty(points, dtype=np.intp)
+    chosen[0], chosen[-1] = 0, count - 1
+    previous = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # Average of the next bucket (the last point for the final one)
+        next_start, next_end = end, edges[bucket + 2] if bucket + 2 < len(edges) else count
+        next_time = times[next_start:next_end].mean()
+        next_value = values[next_start:next_end].mean()
+        area = np.abs(
+            (times[previous] - next_time) * (values[start:end] - values[previous])
+            - (times[previous] - times[start:end]) * (next_value - values[previous])
+        )
+        previous = chosen[bucket + 1] = start + int(np.argmax(area))
+    return chosen
+
+def min_max(values: np.ndarray, points: int) -> np.ndarray:
+    """Indices of each bucket's minimum and maximum; at most ``points`` of them"""
+    values = np.asarray(values, dtype=np.float64)
+    count = len(values)
+    if points >= count:
+        return np.arange(count)
+    buckets = max(points // 2, 1)
+    edges = np.linspace(0, count, buckets + 1).astype(np.intp)
+    starts = edges[:-1]
+    lows = np.minimum.reduceat(values, starts)
+    highs = np.maximum.reduceat(values, starts)
+    chosen = []
+    for start, end, low, high in zip(starts.tolist(), edges[1:].tolist(), lows.tolist(), highs.tolist()):
+        window = values[start:end]
+        first = start + int(np.argmax(window == low))
+        second = start + int(np.argmax(window == high))
+        chosen.extend(sorted({first, second}))
+    return np.asarray(chosen, dtype=np.intp)
@@ -0,0 +1,532 @@
+"""
+Technical indicators.
+
+The bulk functions work along the last axis, so they take a single series
+or a (symbols, time) matrix alike, and apart from the Bollinger deviation
+run in O(n) regardless of the window length. Values that need more
+history than is available are NaN.
+
+``IndicatorEngine`` keeps per-symbol indicator state over candle closes
+warm between requests. Moving averages, RSI, MACD, Bollinger Bands and
+ATR hold their state up to the last finished bar in arrays with one entry
+per symbol, so the live value for the current bar is an O(1) update per
+tick; VWAP accumulates every tick of the current session. A moving-average
+period costs a window of (symbols, period) floats, so at most
+``INDICATOR_MAX_PERIODS`` of them are kept, least recently used dropped first.
+"""
+import os
+import re
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from scipy.signal import lfilter
+
+from services.candles import candle_aggregator
+
+SECONDS_PER_DAY = 86400
+
+# Moving-average periods kept warm at once
+MAX_PERIODS = int(os.getenv("INDICATOR_MAX_PERIODS", "8"))
+
+def sma(values, period: int) -> np.ndarray:
+    """Simple moving average over complete windows (length n - period + 1)"""
+    values = np.asarray(values, dtype=np.float64)
+    n = values.shape[-1]
+    if period <= 0 or n < period:
+        return np.empty(values.shape[:-1] + (0,))
+    sums = np.cumsum(values, axis=-1)
+    sums = np.concatenate([np.zeros(values.shape[:-1] + (1,)), sums], axis=-1)
+    return (sums[..., period:] - sums[..., :-period]) / period
+
+def ema_filter(values, alpha: float) -> np.ndarray:
+    """First-order recursive smoothing y[t] = alpha * x[t] + (1 - alpha) * y[t-1], seeded with x[0]"""
+    values = np.asarray(values, dtype=np.float64)
+    if values.shape[-1] == 0:
+        return values.copy()
+    initial = (1 - alpha) * values[..., :1]
+    smoothed, _ = lfilter([alpha], [1.0, alpha - 1.0], values, axis=-1, zi=initial)
+    return smoothed
+
+def ema(values, period: int) -> np.ndarray:
+    """Exponential moving average with alpha = 2 / (period + 1)"""
+    return ema_filter(values, 2.0 / (period + 1))
+
+def wilder(values, period: int) -> np.ndarray:
+    """Wilder's smoothing: seeded with the mean of the first ``period`` values,
+    then avg[t] = (avg[t-1] * (period - 1) + x[t]) / period"""
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(values.shape, np.nan)
+    if values.shape[-1] < period:
+        return out
+    seed = values[..., :period].mean(axis=-1, keepdims=True)
+    out[..., period - 1:period] = seed
+    alpha = 1.0 / period
+    rest = values[..., period:]
+    if rest.shape[-1]:
+        out[..., period:], _ = lfilter([alpha], [1.0, alpha - 1.0], rest, axis=-1, zi=(1 - alpha) * seed)
+    return out
+
+def rsi(close, period: int = 14) -> np.ndarray:
+    """Wilder's Relative Strength Index"""
+    close = np.asarray(close, dtype=np.float64)
+    out = np.full(close.shape, np.nan)
+    if close.shape[-1] <= period:
+        return out
+    change = np.diff(close, axis=-1)
+    avg_gain = wilder(np.maximum(change, 0), period)
+    avg_loss = wilder(np.maximum(-change, 0), period)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        value = 100 - 100 / (1 + avg_gain / avg_loss)
+    value = np.where(avg_loss == 0, 100.0, value)
+    out[..., 1:] = np.where(np.isnan(avg_gain), np.nan, value)
+    return out
+
+def macd(close, fast: int = 12, slow: int = 26, signal: int = 9):
+    """MACD line, signal line and histogram"""
+    line = ema(close, fast) - ema(close, slow)
+    signal_line = ema(line, signal)
+    return line, signal_line, line - signal_line
+
+def bollinger(close, period: int = 20, width: float = 2.0):
+    """Upper, middle and lower Bollinger Bands (population standard deviation)"""
+    close = np.asarray(close, dtype=np.float64)
+    out = np.full((3,) + close.shape, np.nan)
+    if close.shape[-1] < period:
+        return out[0], out[1], out[2]
+    middle = sma(close, period)
+    # Sum squared deviations one window offset at a time: exact, unlike a
+    # running sum of squares, and only needs arrays the size of the input
+    n = close.shape[-1]
+    squares = np.zeros_like(middle)
+    for offset in range(period):
+        squares += (close[..., offset:n - period + 1 + offset] - middle) ** 2
+    std = np.sqrt(squares / period)
+    out[0][..., period - 1:] = middle + width * std
+    out[1][..., period - 1:] = middle
+    out[2][..., period - 1:] = middle - width * std
+    return out[0], out[1], out[2]
+
+def true_range(high, low, close) -> np.ndarray:
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    ranges = high - low
+    previous = close[..., :-1]
+    ranges[..., 1:] = np.maximum.reduce([
+        ranges[..., 1:], np.abs(high[..., 1:] - previous), np.abs(low[..., 1:] - previous)
+    ])
+    return ranges
+
+def atr(high, low, close, period: int = 14) -> np.ndarray:
+    """Average True Range with Wilder's smoothing"""
+    return wilder(true_range(high, low, close), period)
+
+def vwap(high, low, close, volume) -> np.ndarray:
+    """Cumulative volume-weighted average (typical) price over the series"""
+    typical = (np.asarray(high, dtype=np.float64) + np.asarray(low, dtype=np.float64)
+               + np.asarray(close, dtype=np.float64)) / 3
+    volume = np.asarray(volume, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.cumsum(typical * volume, axis=-1) / np.cumsum(volume, axis=-1)
+
+# Metrics for batch_metrics: series have a value per bar, summaries one per symbol
+SERIES_METRICS = (
+    "open", "high", "low", "close", "volume", "rsi", "macd", "macd_signal", "macd_histogram",
+    "bollinger_upper", "bollinger_middle", "bollinger_lower", "atr", "vwap",
+)
+SUMMARY_METRICS = ("change_percent", "volatility", "avg_volume")
+MOVING_AVERAGE_METRIC = re.compile(r"^(sma|ema)([1-9][0-9]*)$")
+
+# Bars fetched ahead of the window so recursive indicators have settled
+WARMUP_BARS = 100
+
+def metric_warmup(metrics: Iterable[str]) -> int:
+    """Bars of history needed ahead of the window, or ValueError for unknown metrics"""
+    unknown = []
+    warmup = WARMUP_BARS
+    for metric in metrics:
+        moving_average = MOVING_AVERAGE_METRIC.match(metric)
+        if moving_average:
+            warmup = max(warmup, int(moving_average.group(2)))
+        elif metric not in SERIES_METRICS and metric not in SUMMARY_METRICS:
+            unknown.append(metric)
+    if unknown:
+        raise ValueError(f"Unknown metrics: {', '.join(unknown)}")
+    return warmup
+
+def _pad(values: np.ndarray, length: int) -> np.ndarray:
+    """Left-pad a shorter result (e.g. ``sma``) with NaN to ``length`` bars"""
+    out = np.full(values.shape[:-1] + (length,), np.nan)
+    if values.shape[-1]:
+        out[..., length - values.shape[-1]:] = values
+    return out
+
+def batch_metrics(candles: Dict[str, np.ndarray], metrics: Iterable[str],
+                  window: int) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+    """Compute ``metrics`` over (symbols, bars) candle columns in one pass per indicator.
+
+    ``candles`` may hold warm-up bars ahead of the last ``window``; series
+    are trimmed to the window and summaries are taken over it. Volatility is
+    the standard deviation of per-bar log returns, in percent.
+    """
+    close = np.asarray(candles["close"], dtype=np.float64)
+    n = close.shape[-1]
+    window = min(window, n)
+    tail = slice(n - window, n)
+    groups = {}
+
+    def group(name, compute):
+        if name not in groups:
+            groups[name] = compute()
+        return groups[name]
+
+    series, summary = {}, {}
+    for metric in metrics:
+        moving_average = MOVING_AVERAGE_METRIC.match(metric)
+        if moving_average:
+            kind, period = moving_average.group(1), int(moving_average.group(2))
+            values = _pad(sma(close, period), n) if kind == "sma" else ema(close, period)
+        elif metric in ("open", "high", "low", "close", "volume"):
+            values = candles[metric]
+        elif metric == "rsi":
+            values = rsi(close)
+        elif metric.startswith("macd"):
+            line, signal, histogram = group("macd", lambda: macd(close))
+            values = {"macd": line, "macd_signal": signal, "macd_histogram": histogram}[metric]
+        elif metric.startswith("bollinger"):
+            upper, middle, lower = group("bollinger", lambda: bollinger(close))
+            values = {"bollinger_upper": upper, "bollinger_middle": middle, "bollinger_lower": lower}[metric]
+        elif metric == "atr":
+            values = atr(candles["high"], candles["low"], close)
+        elif metric == "vwap":
+            # Anchored at the start of the window rather than the warm-up
+            values = _pad(vwap(candles["high"][..., tail], candles["low"][..., tail],
+                               close[..., tail], candles["volume"][..., tail]), n)
+        elif metric == "change_percent":
+            with np.errstate(divide="ignore", invalid="ignore"):
+                summary[metric] = (close[..., -1] / close[..., n - window] - 1) * 100 if window else np.nan
+            continue
+        elif metric == "volatility":
+            returns = np.diff(np.log(close[..., tail]), axis=-1)
+            summary[metric] = returns.std(axis=-1) * 100 if returns.shape[-1] > 1 else np.full(close.shape[:-1], np.nan)
+            continue
+        elif metric == "avg_volume":
+            volume = np.asarray(candles["volume"][..., tail], dtype=np.float64)
+            summary[metric] = volume.mean(axis=-1) if window else np.full(close.shape[:-1], np.nan)
+            continue
+        else:
+            raise ValueError(f"Unknown metric: {metric}")
+        series[metric] = values[..., tail]
+    return series, summary
+
+class MovingAverageState:
+    """Streaming SMA/EMA of one period for every symbol.
+
+    ``push`` is called with the closes of each finished bar; ``sma`` and
+    ``ema`` combine that state with the live bar's close.
+    """
+
+    def __init__(self, period: int, size: int):
+        self.period = period
+        self.alpha = 2.0 / (period + 1)
+        self.length = period - 1
+        self.window = np.zeros((size, max(self.length, 1)))
+        self.sum = np.zeros(size)
+        self.ema_prev = np.full(size, np.nan)
+        self.count = 0
+        self._pos = 0
+
+    def push(self, closes: np.ndarray):
+        if self.length:
+            if self.count >= self.length:
+                self.sum -= self.window[:, self._pos]
+            self.window[:, self._pos] = closes
+            self.sum += closes
+            self._pos = (self._pos + 1) % self.length
+            if self._pos == 0:
+                # Re-sum once per window so rounding error can't accumulate
+                self.sum = self.window.sum(axis=1)
+        self.count += 1
+        self.ema_prev = np.where(
+            np.isnan(self.ema_prev), closes, self.alpha * closes + (1 - self.alpha) * self.ema_prev
+        )
+
+    @property
+    def ready(self) -> bool:
+        return self.count >= self.length
+
+    def sma(self, live):
+        return (self.sum + live) / self.period if self.ready else np.nan
+
+    def ema(self, live):
+        previous = np.where(np.isnan(self.ema_prev), live, self.ema_prev)
+        return self.alpha * live + (1 - self.alpha) * previous
+
+class WilderState:
+    """Streaming Wilder average of one period for every symbol"""
+
+    def __init__(self, period: int, size: int):
+        self.period = period
+        self.sum = np.zeros(size)
+        self.average = np.full(size, np.nan)
+        self.count = 0
+
+    def push(self, values: np.ndarray):
+        self.count += 1
+        if self.count < self.period:
+            self.sum += values
+        elif self.count == self.period:
+            self.average = (self.sum + values) / self.period
+        else:
+            self.average = (self.average * (self.period - 1) + values) / self.period
+
+    def live(self, values):
+        if self.count + 1 < self.period:
+            return np.full(self.sum.shape, np.nan)
+        if self.count + 1 == self.period:
+            return (self.sum + values) / self.period
+        return (self.average * (self.period - 1) + values) / self.period
+
+class TechnicalState:
+    """Streaming RSI, MACD, Bollinger Bands and ATR for every symbol.
+
+    Same contract as ``MovingAverageState``: ``push`` takes each finished
+    bar, ``live`` combines the state with the current bar and returns
+    one array per value, matching the bulk functions at the last bar.
+    """
+
+    def __init__(self, size: int, rsi_period: int = 14, macd_periods=(12, 26, 9),
+                 bollinger_period: int = 20, bollinger_width: float = 2.0, atr_period: int = 14):
+        fast, slow, signal = macd_periods
+        self.gain = WilderState(rsi_period, size)
+        self.loss = WilderState(rsi_period, size)
+        self.fast = MovingAverageState(fast, size)
+        self.slow = MovingAverageState(slow, size)
+        self.signal = MovingAverageState(signal, size)
+        self.mean = MovingAverageState(bollinger_period, size)
+        self.square = MovingAverageState(bollinger_period, size)
+        self.width = bollinger_width
+        self.range = WilderState(atr_period, size)
+        self.prev_close = np.full(size, np.nan)
+        self.count = 0
+
+    def _true_range(self, close, high, low):
+        # fmax ignores the NaN previous close before the first finished bar
+        return np.fmax(np.fmax(high - low, np.abs(high - self.prev_close)), np.abs(low - self.prev_close))
+
+    def push(self, close: np.ndarray, high: np.ndarray, low: np.ndarray):
+        if self.count:
+            change = close - self.prev_close
+            self.gain.push(np.maximum(change, 0))
+            self.loss.push(np.maximum(-change, 0))
+        self.range.push(self._true_range(close, high, low))
+        self.fast.push(close)
+        self.slow.push(close)
+        self.signal.push(self.fast.ema_prev - self.slow.ema_prev)
+        self.mean.push(close)
+        self.square.push(close * close)
+        self.prev_close = close.copy()
+        self.count += 1
+
+    def live(self, close, high, low) -> Dict[str, np.ndarray]:
+        if self.count:
+            change = close - self.prev_close
+            gain = self.gain.live(np.maximum(change, 0))
+            loss = self.loss.live(np.maximum(-change, 0))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                rsi_value = np.where(loss == 0, 100.0, 100 - 100 / (1 + gain / loss))
+            rsi_value = np.where(np.isnan(gain), np.nan, rsi_value)
+        else:
+            rsi_value = np.full(np.shape(self.prev_close), np.nan)
+        line = self.fast.ema(close) - self.slow.ema(close)
+        signal = self.signal.ema(line)
+        middle = self.mean.sma(close)
+        std = np.sqrt(np.maximum(self.square.sma(close * close) - middle ** 2, 0))
+        values = {
+            "rsi": rsi_value,
+            "macd": line,
+            "signal": signal,
+            "histogram": line - signal,
+            "upper": middle + self.width * std,
+            "middle": middle,
+            "lower": middle - self.width * std,
+            "atr": self.range.live(self._true_range(close, high, low)),
+        }
+        # The moving averages return a scalar NaN until they have enough bars
+        return {name: np.broadcast_to(value, np.shape(close)) for name, value in values.items()}
+
+class SessionVwap:
+    """Volume-weighted average price of every symbol since the start of the UTC day"""
+
+    def __init__(self, size: int):
+        self.day = None
+        self.value = np.zeros(size)
+        self.volume = np.zeros(size)
+
+    def reset(self, day: int, value: np.ndarray, volume: np.ndarray):
+        self.day = day
+        self.value = value.astype(np.float64)
+        self.volume = volume.astype(np.float64)
+
+    def update(self, prices: np.ndarray, volumes: np.ndarray):
+        self.value += prices * volumes
+        self.volume += volumes
+
+    def get(self, index: int):
+        return self.value[index] / self.volume[index] if self.volume[index] else np.nan
+
+class IndicatorEngine:
+    """Indicators over candles, kept warm as ticks arrive.
+
+    Must be registered as a tick listener after the candle aggregator so it
+    sees each bar roll over. Moving-average periods and the technical state
+    are set up on first use and warmed from the aggregator's history; past
+    ``max_periods`` periods the least recently used one is dropped.
+    """
+
+    def __init__(self, aggregator, resolution: str = "1d", history: int = 200,
+                 max_periods: int = MAX_PERIODS):
+        self.aggregator = aggregator
+        self.resolution = resolution
+        self.history = history
+        self.max_periods = max_periods
+        self.states: "OrderedDict[int, MovingAverageState]" = OrderedDict()
+        self.technical: Optional[TechnicalState] = None
+        self.vwap = SessionVwap(len(aggregator.symbols))
+        self.generation = 0
+        self._head = aggregator.series[resolution].head
+        # period -> symbol -> (generation, SMA over finished bars)
+        self._series_cache: Dict[int, Dict[str, tuple]] = {}
+
+    @property
+    def _series(self):
+        return self.aggregator.series[self.resolution]
+
+    async def on_tick(self, tick):
+        day = int(tick.timestamp // SECONDS_PER_DAY)
+        if day != self.vwap.day:
+            self._warm_vwap(day)
+        else:
+            self.vwap.update(tick.prices, tick.volumes)
+        series = self._series
+        if series.head == self._head:
+            return
+        if self._head >= 0:
+            finished = series.close[:, self._head]
+            for state in self.states.values():
+                state.push(finished)
+            # Every cached series is a bar behind now
+            self._series_cache.clear()
+            if self.technical is not None:
+                self.technical.push(finished, series.high[:, self._head], series.low[:, self._head])
+            self.generation += 1
+        self._head = series.head
+
+    def _warm_vwap(self, day: int):
+        """Start a new session from today's minute candles, which already include the current tick"""
+        start = day * SECONDS_PER_DAY
+        minutes = self.aggregator.matrix("1m", SECONDS_PER_DAY // 60)
+        today = minutes["start"] >= start
+        typical = (minutes["high"][:, today] + minutes["low"][:, today] + minutes["close"][:, today]) / 3
+        volume = minutes["volume"][:, today]
+        self.vwap.reset(day, (typical * volume).sum(axis=1), volume.sum(axis=1))
+
+    def register(self, periods: Iterable[int]):
+        """Start tracking new periods, warming them from stored candles.
+
+        Raises ValueError for more distinct periods than ``max_periods``.
+        """
+        periods = set(periods)
+        if len(periods) > self.max_periods:
+            raise ValueError(f"At most {self.max_periods} moving-average periods at once")
+        for period in periods:
+            if period in self.states:
+                self.states.move_to_end(period)
+        new = [p for p in periods if p > 0 and p not in self.states]
+        if not new:
+            return
+        closes = self._finished_closes(max(max(new), self.history))
+        for period in new:
+            state = MovingAverageState(period, len(self.aggregator.symbols))
+            for column in closes.T:
+                state.push(column)
+            self.states[period] = state
+        while len(self.states) > self.max_periods:
+            period, _ = self.states.popitem(last=False)
+            self._series_cache.pop(period, None)
+
+    def _finished_closes(self, count: int) -> np.ndarray:
+        """(symbols, bars) closes of finished bars, i.e. without the live one"""
+        return self._finished(count)["close"]
+
+    def _finished(self, count: int) -> Dict[str, np.ndarray]:
+        candles = self.aggregator.matrix(self.resolution, count + 1)
+        if self._series.count:
+            candles = {name: column[..., :-1] for name, column in candles.items()}
+        return candles
+
+    def _technical_state(self) -> TechnicalState:
+        if self.technical is None:
+            candles = self._finished(self.history)
+            state = TechnicalState(len(self.aggregator.symbols))
+            for close, high, low in zip(candles["close"].T, candles["high"].T, candles["low"].T):
+                state.push(close, high, low)
+            self.technical = state
+        return self.technical
+
+    def technical_indicators(self, symbol: str) -> Optional[dict]:
+        """Live RSI, MACD, Bollinger Bands, ATR and session VWAP for one symbol.
+
+        Returns None until there are enough bars for every indicator.
+        """
+        index = self.aggregator.symbol_ids[symbol]
+        series = self._series
+        if not series.count:
+            return None
+        state = self._technical_state()
+        head = series.head
+        live = state.live(series.close[:, head], series.high[:, head], series.low[:, head])
+        values = {name: float(value[index]) for name, value in live.items()}
+        if any(np.isnan(value) for value in values.values()):
+            return None
+        vwap_value = self.vwap.get(index)
+        values = {name: round(value, 2) for name, value in values.items()}
+        return {
+            "rsi": values["rsi"],
+            "macd": {name: values[name] for name in ("macd", "signal", "histogram")},
+            "bollingerBands": {name: values[name] for name in ("upper", "middle", "lower")},
+            "atr": values["atr"],
+            "vwap": None if np.isnan(vwap_value) else round(float(vwap_value), 2),
+        }
+
+    def moving_averages(self, symbol: str, periods: List[int]) -> Dict[str, list]:
+        """SMA series over the last ``history`` bars, ending with the live bar.
+
+        The part over finished bars is computed once per bar with a cumulative
+        sum and cached; each request only adds the live value.
+        """
+        self.register(periods)
+        index = self.aggregator.symbol_ids[symbol]
+        series = self._series
+        live = series.close[index, series.head] if series.count else None
+        closes = None
+        result = {}
+        for period in periods:
+            by_symbol = self._series_cache.setdefault(period, {})
+            cached = by_symbol.get(symbol)
+            if cached is None or cached[0] != self.generation:
+                if closes is None:
+                    closes = self.aggregator.candles(symbol, self.resolution, self.history + 1)["close"]
+                    if live is not None:
+                        closes = closes[:-1]
+                cached = (self.generation, np.round(sma(closes, period), 2).tolist())
+                by_symbol[symbol] = cached
+            values = cached[1]
+            state = self.states[period]
+            if live is not None and state.ready:
+                values = values + [round(float(state.sma(live)[index]), 2)]
+            result[f"ma{period}"] = values
+        return result
+
+indicator_engine = IndicatorEngine(candle_aggregator)
@@ -0,0 +1,318 @@
+import asyncio
+import logging
+import os
+import struct
+from collections.abc import Mapping
+from typing import Awaitable, Callable, List, Optional
+
+import numpy as np
+
+from services.price_simulator import PriceSimulator
+from services.pubsub import Backplane
+from services.scheduler import Scheduler, scheduler as default_scheduler
+from services.tick_recorder import TickRecorder, TickRecording, replay
+
+logger = logging.getLogger(__name__)
+
+# Size of the simulated universe and how often it ticks (seconds)
+UNIVERSE_SIZE = int(os.getenv("MARKET_UNIVERSE_SIZE", "8"))
+TICK_INTERVAL = float(os.getenv("MARKET_TICK_INTERVAL", "2.0"))
+
+# Reproducible markets: a fixed seed gives the same universe and price path,
+# ticks can be recorded to a file, and a recording can be replayed at 1x,
+# Nx ("10") or maximum ("max") speed instead of simulating
+SEED = int(os.environ["MARKET_SEED"]) if os.getenv("MARKET_SEED") else None
+RECORD_PATH = os.getenv("MARKET_RECORD_PATH")
+REPLAY_PATH = os.getenv("MARKET_REPLAY_PATH")
+REPLAY_SPEED = os.getenv("MARKET_REPLAY_SPEED", "1")
+
+# Backplane channel carrying ticks from the producer to every worker
+TICK_CHANNEL = "ticks"
+
+# Tick wire layout: u64 seq, f64 timestamp, u32 universe size, u32 moved
+# count, then prices f64[n], changes f64[n], volumes i64[n], moved u32[k]
+TICK_HEADER = struct.Struct("<QdII")
+
+class Quotes(Mapping):
+    """Read-only ``{symbol: {'price': ..., 'change': ...}}`` view over tick arrays.
+
+    Quotes are materialised on access, so handing the view around costs
+    nothing even for very large universes.
+    """
+
+    def __init__(self, tick: "Tick"):
+        self._tick = tick
+
+    def __getitem__(self, symbol: str) -> dict:
+        return self._tick.quote(self._tick.symbol_ids[symbol])
+
+    def __iter__(self):
+        return iter(self._tick.symbols)
+
+    def __len__(self) -> int:
+        return len(self._tick.symbols)
+
+class Tick:
+    """Immutable snapshot of the whole universe after one simulation step"""
+
+    def __init__(self, seq: int, timestamp: float, symbols: List[str], symbol_ids: dict,
+                 prices: np.ndarray, changes: np.ndarray, volumes: np.ndarray, changed: np.ndarray):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.symbols = symbols
+        self.symbol_ids = symbol_ids
+        self.prices = prices
+        self.changes = changes
+        self.volumes = volumes
+        # Indices of the symbols whose price moved on this tick
+        self.changed = changed
+
+    def quote(self, index: int) -> dict:
+        return {'price': float(self.prices[index]), 'change': float(self.changes[index])}
+
+    @property
+    def stock_data(self) -> Quotes:
+        return Quotes(self)
+
+    @property
+    def changed_symbols(self) -> List[str]:
+        return [self.symbols[i] for i in self.changed]
+
+    def to_bytes(self) -> bytes:
+        return b"".join((
+            TICK_HEADER.pack(self.seq, self.timestamp, len(self.symbols), len(self.changed)),
+            self.prices.astype("<f8", copy=False).tobytes(),
+            self.changes.astype("<f8", copy=False).tobytes(),
+            self.volumes.astype("<i8", copy=False).tobytes(),
+            self.changed.astype("<u4").tobytes(),
+        ))
+
+    @classmethod
+    def from_bytes(cls, payload: bytes, symbols: List[str], symbol_ids: dict) -> "Tick":
+        seq, timestamp, size, moved = TICK_HEADER.unpack_from(payload, 0)
+        if size != len(symbols):
+            raise ValueError(f"Tick for {size} symbols does not match local universe of {len(symbols)}")
+        offset = TICK_HEADER.size
+        prices = np.frombuffer(payload, "<f8", size, offset)
+        offset += 8 * size
+        changes = np.frombuffer(payload, "<f8", size, offset)
+        offset += 8 * size
+        volumes = np.frombuffer(payload, "<i8", size, offset)
+        offset += 8 * size
+        changed = np.frombuffer(payload, "<u4", moved, offset).astype(np.intp)
+        return cls(seq, timestamp, symbols, symbol_ids, prices, changes, volumes, changed)
+
+TickListener = Callable[[Tick], Awaitable[None]]
+# Sinks persist ticks and only run on the producing worker
+TickSink = Callable[[Tick], None]
+
+class MarketDataEngine:
+    """Single producer of simulated price ticks.
+
+    The engine owns a vectorised ``PriceSimulator`` and advances it on its
+    own clock. Every tick is handed to the registered listeners (e.g. the
+    WebSocket connection manager), so the market moves once per interval no
+    matter how many clients are connected.
+
+    When attached to a backplane only the leader worker runs the clock; it
+    publishes each tick on the bus and every worker (itself included) hands
+    it to its local listeners.
+
+    Ticks are ``interval`` seconds apart in market time and are timed by the
+    event scheduler, so an accelerated market clock speeds them up along
+    with everything else scheduled on it.
+    """
+
+    def __init__(self, simulator: PriceSimulator = None, interval: float = TICK_INTERVAL,
+                 recording: TickRecording = None, replay_speed: Optional[float] = 1.0,
+                 scheduler: Scheduler = default_scheduler):
+        self.simulator = simulator or PriceSimulator.with_universe(UNIVERSE_SIZE, seed=SEED)
+        # Stable numeric ids used by compact wire formats
+        self.symbols = self.simulator.symbols
+        self.symbol_ids = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.interval = interval
+        self.scheduler = scheduler
+        self.clock = scheduler.clock
+        self.tick_count = 0
+        self.latest = self._snapshot(np.arange(len(self.symbols)))
+        self._listeners: List[TickListener] = []
+        self._sinks: List[TickSink] = []
+        self._task = None
+        self._bus = None
+        # Replay source (instead of the simulator) and optional recorder
+        self.recording = recording
+        self.replay_speed = replay_speed
+        if recording is not None and len(recording):
+            self.latest = self._snapshot(self.latest.changed, float(recording.records['timestamp'][0]))
+        self.record_path = None
+        self.recorder = None
+        self._history = None
+
+    @classmethod
+    def from_recording(cls, path: str, speed: Optional[float] = 1.0) -> "MarketDataEngine":
+        """Engine that replays a recording at ``speed`` x real time (None = max speed)"""
+        recording = TickRecording(path)
+        size = len(recording.symbols)
+        prices = recording.records['prices'][0] if len(recording) else np.ones(size)
+        simulator = PriceSimulator(recording.symbols, prices, np.zeros(size), np.zeros(size))
+        return cls(simulator, recording.interval, recording=recording, replay_speed=speed)
+
+    def record_to(self, path: str):
+        """Append every produced tick to ``path`` (opened when the clock starts)"""
+        self.record_path = path
+
+    @property
+    def history(self) -> Optional[TickRecording]:
+        """Recording that history queries can read, if any"""
+        if self.recording is not None:
+            return self.recording
+        if self._history is None and self.record_path and os.path.exists(self.record_path):
+            try:
+                self._history = TickRecording(self.record_path)
+            except (ValueError, struct.error):
+                return None
+        return self._history
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def stock_data(self) -> Quotes:
+        return self.latest.stock_data
+
+    def price(self, symbol: str) -> float:
+        """Latest price for a symbol (KeyError if it is not in the universe)"""
+        return float(self.latest.prices[self.symbol_ids[symbol]])
+
+    def attach(self, bus: Backplane):
+        """Receive ticks through a backplane and run the clock on the leader only"""
+        self._bus = bus
+        bus.subscribe(TICK_CHANNEL, self._on_bus_tick)
+        bus.on_leader(self.start)
+
+    def add_sink(self, sink: TickSink):
+        """Register a storage callback that sees every produced tick exactly once"""
+        if sink not in self._sinks:
+            self._sinks.append(sink)
+
+    def add_listener(self, listener: TickListener):
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener: TickListener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    async def start(self):
+        """Start the tick loop (no-op if it is already running)"""
+        if self.running:
+            return
+        if self.record_path and self.recorder is None:
+            self.recorder = TickRecorder(self.record_path, self.symbols, self.interval)
+            # Ticks go on from the end of the recording, not before it
+            self.clock.resume(self.recorder.last)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the tick loop and wait for it to finish"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def step(self) -> Tick:
+        """Advance the whole universe by one tick"""
+        changed = self.simulator.step(self.interval)
+        self.tick_count += 1
+        self.latest = self._snapshot(changed)
+        return self.latest
+
+    def _snapshot(self, changed: np.ndarray, timestamp: Optional[float] = None) -> Tick:
+        """The simulator's state as a tick, stamped ``timestamp`` or else the market clock's time"""
+        simulator = self.simulator
+        return Tick(
+            self.tick_count, self.clock.now() if timestamp is None else timestamp, self.symbols, self.symbol_ids,
+            simulator.prices.copy(), simulator.changes.copy(), simulator.volumes.copy(), changed,
+        )
+
+    async def publish(self):
+        """Hand the latest tick to every listener"""
+        for listener in list(self._listeners):
+            try:
+                await listener(self.latest)
+            except Exception:
+                logger.exception("Market data listener failed")
+
+    async def emit(self):
+        """Distribute the latest tick, through the backplane if there is one"""
+        if self.recorder is not None:
+            self.recorder.record(self.latest)
+        for sink in self._sinks:
+            try:
+                sink(self.latest)
+            except Exception:
+                logger.exception("Market data sink failed")
+        if self._bus is None:
+            await self.publish()
+        else:
+            await self._bus.publish(TICK_CHANNEL, self.latest.to_bytes())
+
+    async def _on_bus_tick(self, payload: bytes):
+        tick = Tick.from_bytes(payload, self.symbols, self.symbol_ids)
+        if not self.running:
+            # Follow the leader's prices so a failover continues the same path
+            self.simulator.prices = tick.prices.copy()
+            self.tick_count = tick.seq
+            self.latest = tick
+        await self.publish()
+
+    async def _replay(self):
+        simulator = self.simulator
+        # The first record is the engine's starting state, so replay from the second
+        async for record in replay(self.recording, self.replay_speed, start=1):
+            prices = np.array(record['prices'])
+            simulator.changes = prices - simulator.prices
+            simulator.prices = prices
+            simulator.volumes = np.array(record['volumes'])
+            self.tick_count += 1
+            # Stamped with the recorded time, so candles and history match the original run
+            self.latest = self._snapshot(np.flatnonzero(simulator.changes), float(record['timestamp']))
+            await self.emit()
+        logger.info("Replay of %s finished after %s ticks", self.recording.path, self.tick_count)
+
+    async def _run(self):
+        if self.recording is not None:
+            await self._replay()
+            return
+        clock = self.clock
+        next_tick = clock.now()
+        while True:
+            self.step()
+            await self.emit()
+            # Schedule against a fixed clock so slow listeners don't make the tick rate drift
+            next_tick += self.interval
+            if next_tick < clock.now():
+                next_tick = clock.now()
+            await self.scheduler.sleep_until(next_tick)
+
+def parse_speed(value: str) -> Optional[float]:
+    return None if value == "max" else float(value)
+
+def create_engine() -> MarketDataEngine:
+    if REPLAY_PATH:
+        engine = MarketDataEngine.from_recording(REPLAY_PATH, parse_speed(REPLAY_SPEED))
+    else:
+        engine = MarketDataEngine()
+    if RECORD_PATH:
+        engine.record_to(RECORD_PATH)
+    return engine
+
+market_engine = create_engine()
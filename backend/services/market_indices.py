@@ -0,0 +1,207 @@
+"""
+Synthetic market and sector indices over the simulated universe.
+
+sp500
+    cap-weighted, the 500 largest symbols by starting market cap
+nasdaq
+    cap-weighted, every Technology symbol
+dow
+    price-weighted, the 30 largest symbols
+vix
+    annualised EWMA volatility of the sp500 tick returns
+sectors
+    cap-weighted, one per sector
+
+Each index keeps its weighted price sum and moves it by the weighted price
+changes of the symbols that moved on a tick, so an update costs O(changed
+symbols) and a read is O(1) in the size of the universe. ``change`` is the
+percentage move since the first tick of the UTC day.
+"""
+import logging
+from typing import Awaitable, Callable, Dict, List
+
+import numpy as np
+
+from services.market_data import market_engine
+from services.price_simulator import SECONDS_PER_TRADING_YEAR, SECTORS
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 86400
+
+# Name -> (constituents, weighting, starting level)
+INDICES = {
+    "sp500": ("top500", "cap", 4185.47),
+    "nasdaq": ("Technology", "cap", 12846.81),
+    "dow": ("top30", "price", 33745.40),
+}
+SECTOR_BASE_LEVEL = 1000.0
+
+# Changes are rounded to 2dp; "+ 0.0" below turns a rounded -0.0 into 0.0
+
+# RiskMetrics decay for the per-tick variance behind vix
+VOLATILITY_DECAY = 0.94
+
+# Recompute the sums from scratch this often so rounding can't accumulate
+RESUM_EVERY = 1000
+
+IndexListener = Callable[[dict], Awaitable[None]]
+
+class MarketIndices:
+    """Cap- and price-weighted indices kept up to date from the tick stream"""
+
+    def __init__(self, symbols: List[str], sectors: List[str], shares: np.ndarray,
+                 prices: np.ndarray, interval: float, volatilities: np.ndarray = None):
+        self.symbols = symbols
+        self.names = list(INDICES)
+        self.sector_names = list(SECTORS)
+        sector_ids = {name: i for i, name in enumerate(self.sector_names)}
+        self.sector_ids = np.array([sector_ids[sector] for sector in sectors], dtype=np.intp)
+        self.shares = np.asarray(shares, dtype=np.float64)
+        self.prices = np.asarray(prices, dtype=np.float64).copy()
+        self.interval = interval
+
+        # (indices, symbols) weight per unit of price
+        caps = self.shares * self.prices
+        by_cap = np.argsort(-caps, kind="stable")
+        self.weights = np.zeros((len(self.names), len(symbols)))
+        for row, (members, weighting, _) in enumerate(INDICES.values()):
+            if members.startswith("top"):
+                chosen = by_cap[:int(members[3:])]
+            else:
+                chosen = np.flatnonzero(self.sector_ids == sector_ids[members])
+            self.weights[row, chosen] = self.shares[chosen] if weighting == "cap" else 1.0
+        self.base_levels = np.array([level for _, _, level in INDICES.values()])
+
+        self.sums = self.weights @ self.prices
+        self.sector_sums = self._sector_sums()
+        # Divisors: the sums at which each index sits at its base level
+        self.base_sums = np.where(self.sums > 0, self.sums, 1.0)
+        self.sector_base_sums = np.where(self.sector_sums > 0, self.sector_sums, 1.0)
+        self.open_sums = self.sums.copy()
+        self.sector_open_sums = self.sector_sums.copy()
+
+        # Per-tick variance of sp500 log returns, seeded with the variance of
+        # the constituents taken as uncorrelated, as the simulator moves them
+        self.variance = None
+        if volatilities is not None and np.any(volatilities):
+            fractions = self.weights[0] * self.prices / max(self.sums[0], 1e-12)
+            annual = float(np.sum((fractions * np.asarray(volatilities)) ** 2))
+            self.variance = annual * interval / SECONDS_PER_TRADING_YEAR
+        self.vix_open = self.vix
+
+        self.day = None
+        self.seq = None
+        self._ticks = 0
+        self._listeners: List[IndexListener] = []
+        self._last_pushed: Dict[str, tuple] = {}
+
+    @classmethod
+    def from_engine(cls, engine) -> "MarketIndices":
+        simulator = engine.simulator
+        return cls(engine.symbols, simulator.sectors, simulator.shares_outstanding,
+                   simulator.prices, engine.interval, simulator.volatilities)
+
+    def _sector_sums(self) -> np.ndarray:
+        return np.bincount(self.sector_ids, weights=self.shares * self.prices, minlength=len(self.sector_names))
+
+    def add_listener(self, listener: IndexListener):
+        """Register a coroutine called with an ``index_update`` message after each tick"""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def update(self, seq: int, timestamp: float, prices: np.ndarray, changed: np.ndarray):
+        day = int(timestamp // SECONDS_PER_DAY)
+        previous = self.sums[0]
+        self._ticks += 1
+        contiguous = self.seq is not None and seq == self.seq + 1
+        if contiguous and self._ticks % RESUM_EVERY:
+            diff = prices[changed] - self.prices[changed]
+            self.prices[changed] = prices[changed]
+            self.sums += self.weights[:, changed] @ diff
+            self.sector_sums += np.bincount(
+                self.sector_ids[changed], weights=self.shares[changed] * diff, minlength=len(self.sector_names)
+            )
+        else:
+            # First tick, a gap in the sequence, or a periodic re-sum
+            np.copyto(self.prices, prices)
+            self.sums = self.weights @ self.prices
+            self.sector_sums = self._sector_sums()
+        self.seq = seq
+
+        # Only a return over one tick is comparable with the per-tick variance
+        if contiguous and previous > 0 and self.sums[0] > 0:
+            squared = float(np.log(self.sums[0] / previous)) ** 2
+            self.variance = squared if self.variance is None else (
+                VOLATILITY_DECAY * self.variance + (1 - VOLATILITY_DECAY) * squared
+            )
+        if day != self.day:
+            self.day = day
+            self.open_sums = self.sums.copy()
+            self.sector_open_sums = self.sector_sums.copy()
+            self.vix_open = self.vix
+
+    async def on_tick(self, tick):
+        self.update(tick.seq, tick.timestamp, tick.prices, tick.changed)
+        if not self._listeners:
+            return
+        message = self._changes()
+        if message is None:
+            return
+        for listener in self._listeners:
+            try:
+                await listener(message)
+            except Exception:
+                logger.exception("Index listener failed")
+
+    @property
+    def vix(self):
+        if self.variance is None:
+            return None
+        return 100 * float(np.sqrt(self.variance * SECONDS_PER_TRADING_YEAR / self.interval))
+
+    def overview(self) -> Dict[str, dict]:
+        """Level and day change of every headline index"""
+        levels = self.base_levels * self.sums / self.base_sums
+        changes = (self.sums / np.where(self.open_sums > 0, self.open_sums, 1.0) - 1) * 100
+        result = {
+            name: {"value": round(float(level), 2), "change": round(float(change), 2) + 0.0}
+            for name, level, change in zip(self.names, levels, changes)
+        }
+        vix = self.vix
+        if vix is not None:
+            change = (vix / self.vix_open - 1) * 100 if self.vix_open else 0.0
+            result["vix"] = {"value": round(vix, 2), "change": round(change, 2) + 0.0}
+        return result
+
+    def sectors(self) -> List[dict]:
+        """Level and day change of every sector index with constituents"""
+        levels = SECTOR_BASE_LEVEL * self.sector_sums / self.sector_base_sums
+        changes = (self.sector_sums / np.where(self.sector_open_sums > 0, self.sector_open_sums, 1.0) - 1) * 100
+        return [
+            {"sector": name, "value": round(float(level), 2), "performance": round(float(change), 2) + 0.0}
+            for name, level, change, total in zip(self.sector_names, levels, changes, self.sector_base_sums)
+            if total > 1.0
+        ]
+
+    def _changes(self):
+        """``index_update`` message with the indices whose rounded value moved since the last one"""
+        current = dict(self.overview())
+        current.update({row["sector"]: {"value": row["value"], "change": row["performance"]} for row in self.sectors()})
+        changed = {}
+        for name, values in current.items():
+            key = (values["value"], values["change"])
+            if self._last_pushed.get(name) != key:
+                self._last_pushed[name] = key
+                changed[name] = values
+        if not changed:
+            return None
+        return {"type": "index_update", "seq": self.seq, "indices": changed}
+
+    def snapshot_message(self) -> dict:
+        """Every index, for clients that just connected"""
+        indices = dict(self.overview())
+        indices.update({row["sector"]: {"value": row["value"], "change": row["performance"]} for row in self.sectors()})
+        return {"type": "index_update", "seq": self.seq, "snapshot": True, "indices": indices}
+
+market_indices = MarketIndices.from_engine(market_engine)
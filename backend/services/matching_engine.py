@@ -0,0 +1,352 @@
+"""
+Order matching across the universe, with simulated liquidity.
+
+Every symbol gets an ``OrderBook`` on first use. So that orders have
+something to trade against, a market maker quotes both sides around the
+simulator's price: ``MARKET_MAKER_SIZE`` shares each side, with the bid
+and ask ``MARKET_MAKER_SPREAD_BPS / 2`` basis points from it. Quotes are
+refreshed when an order arrives and, for books with resting user orders,
+on every tick, so a resting limit order fills once the market reaches it
+and other books cost nothing per tick. Books with depth subscribers are
+re-quoted on ticks too, so their depth follows the market.
+
+Stop, stop-limit and trailing-stop orders are armed in the symbol's
+StopBook, listed as open orders while ``pending``. They are checked
+against the price when armed and on every tick that re-quotes their book,
+right after the new quotes. Triggered orders then go to the book like any
+other order.
+
+DAY orders get the market clock's next session close as ``expires_at``,
+and GTD orders get the time they asked for. ``expire`` withdraws them,
+resting or still pending, when the order pipeline's scheduler says
+they're due.
+
+After every operation the book's changed levels go to the depth listeners
+as one sequenced ``book_delta``; ``snapshot`` returns ``book_snapshot``
+messages in the same sequence space. The engine itself doesn't serialise
+operations on a book; the app drives it through ``order_pipeline``.
+
+Books live in process memory, so every worker process has its own.
+"""
+import itertools
+import logging
+import os
+from collections import Counter, defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from services.market_data import MarketDataEngine, market_engine
+from services.order_book import (
+    BUY, CANCELLED, EXPIRED, FILLED, LIMIT, PENDING, SELL, Fill, Order, OrderBook, to_ticks,
+)
+from services.stop_orders import STOP_TYPES, StopBook
+
+logger = logging.getLogger(__name__)
+
+MARKET_MAKER = "market-maker"
+MARKET_MAKER_SIZE = int(os.getenv("MARKET_MAKER_SIZE", "10000"))
+MARKET_MAKER_SPREAD_BPS = float(os.getenv("MARKET_MAKER_SPREAD_BPS", "10"))
+
+# Levels per side in depth snapshots unless asked otherwise
+DEPTH_LEVELS = int(os.getenv("BOOK_DEPTH_LEVELS", "10"))
+
+FillListener = Callable[[List[Fill]], Awaitable[None]]
+DepthListener = Callable[[dict], Awaitable[None]]
+
+class MatchingEngine:
+    """Order books for every symbol plus the open-order registry"""
+
+    def __init__(self, market: MarketDataEngine = market_engine, liquidity: int = MARKET_MAKER_SIZE,
+                 spread_bps: float = MARKET_MAKER_SPREAD_BPS):
+        self.market = market
+        self.liquidity = liquidity
+        self.half_spread = spread_bps / 2 / 10_000
+        self.books: Dict[str, OrderBook] = {}
+        self.stops: Dict[str, StopBook] = {}
+        # Resting user orders by id and by user
+        self.orders: Dict[str, Order] = {}
+        self.user_orders: Dict[object, Dict[str, Order]] = defaultdict(dict)
+        # Resting user orders, armed stops and depth subscriptions per symbol: the books to re-quote on ticks
+        self._resting = Counter()
+        self._armed = Counter()
+        self._watched = Counter()
+        # symbol -> (quoted price, bid order, ask order)
+        self._quotes: Dict[str, Tuple[float, Optional[Order], Optional[Order]]] = {}
+        self._ids = itertools.count(1)
+        self._quote_ids = itertools.count(1)
+        self._listeners: List[FillListener] = []
+        self._depth_listeners: List[DepthListener] = []
+
+    def add_listener(self, listener: FillListener):
+        """Register a coroutine called with every batch of fills"""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def add_depth_listener(self, listener: DepthListener):
+        """Register a coroutine called with every ``book_delta`` message"""
+        if listener not in self._depth_listeners:
+            self._depth_listeners.append(listener)
+
+    def watch(self, symbol: str):
+        """Keep a book's quotes following the market while someone watches its depth"""
+        self._watched[symbol] += 1
+
+    def unwatch(self, symbol: str):
+        self._watched[symbol] -= 1
+        if self._watched[symbol] <= 0:
+            del self._watched[symbol]
+
+    async def snapshot(self, symbol: str, levels: int = DEPTH_LEVELS) -> dict:
+        """Current depth of a book, after publishing any pending delta"""
+        book = self.book(symbol)
+        await self._settle(book, self._quote(book))
+        return {"type": "book_snapshot", "symbol": symbol, **book.snapshot(levels)}
+
+    def book(self, symbol: str) -> OrderBook:
+        book = self.books.get(symbol)
+        if book is None:
+            if symbol not in self.market.symbol_ids:
+                raise KeyError(symbol)
+            book = self.books[symbol] = OrderBook(symbol)
+        return book
+
+    def new_order(self, user_id, symbol: str, side: str, quantity: int, order_type: str = LIMIT,
+                  price: Optional[float] = None, time_in_force: str = "GTC",
+                  stop_price: Optional[float] = None, trail: Optional[float] = None,
+                  expires_at: Optional[float] = None) -> Order:
+        """A new order; DAY orders expire at the next session close, GTD ones at ``expires_at``"""
+        if time_in_force == "DAY":
+            expires_at = self.market.clock.session_close()
+        elif time_in_force != "GTD":
+            expires_at = None
+        return Order(
+            f"order_{next(self._ids)}", user_id, symbol, side, quantity, order_type,
+            None if price is None else to_ticks(price), time_in_force,
+            None if stop_price is None else to_ticks(stop_price),
+            None if trail is None else to_ticks(trail),
+            expires_at,
+        )
+
+    def _quote(self, book: OrderBook) -> List[Fill]:
+        """Re-post the market maker's quotes around the current price"""
+        price = self.market.price(book.symbol)
+        quoted = self._quotes.get(book.symbol)
+        if quoted is not None and quoted[0] == price and all(
+            order is not None and order.remaining == self.liquidity for order in quoted[1:]
+        ):
+            return []
+        if quoted is not None:
+            for order in quoted[1:]:
+                if order is not None:
+                    book.cancel(order.id)
+        bid = to_ticks(price * (1 - self.half_spread))
+        ask = max(to_ticks(price * (1 + self.half_spread)), bid + 1)
+        fills = []
+        orders = []
+        for side, limit in ((BUY, bid), (SELL, ask)):
+            if limit <= 0:
+                orders.append(None)
+                continue
+            order = Order(f"mm_{next(self._quote_ids)}", MARKET_MAKER, book.symbol, side,
+                          self.liquidity, LIMIT, limit)
+            # The quote trades with user orders the market has moved through
+            fills += book.submit(order)
+            orders.append(order)
+        self._quotes[book.symbol] = (price, orders[0], orders[1])
+        return fills
+
+    def _execute(self, book: OrderBook, order: Order) -> List[Fill]:
+        """Match one order, or arm it if it waits for a trigger"""
+        if order.order_type in STOP_TYPES and order.status == PENDING:
+            stops = self.stops.get(order.symbol)
+            if stops is None:
+                stops = self.stops[order.symbol] = StopBook(order.symbol)
+            stops.arm(order, to_ticks(self.market.price(order.symbol)))
+            self._register(order)
+            self._armed[order.symbol] += 1
+            # It may already be through its trigger
+            return self._trigger(book)
+        fills = book.submit(order)
+        if order.id in book.orders:
+            self._register(order)
+            self._resting[order.symbol] += 1
+        return fills
+
+    def _trigger(self, book: OrderBook) -> List[Fill]:
+        """Send the book's armed orders that the current price has reached to the book"""
+        stops = self.stops.get(book.symbol)
+        if not stops:
+            return []
+        fills = []
+        for order in stops.triggered(to_ticks(self.market.price(book.symbol))):
+            self._disarm(order)
+            fills += self._execute(book, order)
+        return fills
+
+    async def submit(self, order: Order) -> List[Fill]:
+        """Match an order against its book; resting GTC orders and armed stops join the registry"""
+        book = self.book(order.symbol)
+        fills = self._quote(book)
+        taker_fills = self._execute(book, order)
+        await self._settle(book, fills + taker_fills)
+        return taker_fills
+
+    async def submit_many(self, orders: List[Order]) -> List[Fill]:
+        """Match a batch of orders back to back, then publish once per book.
+
+        Nothing else runs between the orders, and each touched book sends one
+        delta and one batch of fills instead of one per order. The orders are
+        ``batched`` meanwhile, so listeners can leave announcing their fills
+        to the caller.
+        """
+        fills: Dict[str, List[Fill]] = defaultdict(list)
+        for order in orders:
+            order.batched = True
+        try:
+            for order in orders:
+                book = self.book(order.symbol)
+                if order.symbol not in fills:
+                    fills[order.symbol] += self._quote(book)
+                fills[order.symbol] += self._execute(book, order)
+            for symbol, book_fills in fills.items():
+                await self._settle(self.books[symbol], book_fills)
+        finally:
+            for order in orders:
+                order.batched = False
+        return [fill for book_fills in fills.values() for fill in book_fills]
+
+    def get(self, order_id: str, user_id=None) -> Optional[Order]:
+        order = self.orders.get(order_id)
+        if order is None or (user_id is not None and order.user_id != user_id):
+            return None
+        return order
+
+    async def cancel(self, order_id: str, user_id=None) -> Optional[Order]:
+        order = self.get(order_id, user_id)
+        if order is None:
+            return None
+        self._withdraw(order)
+        await self._settle(self.books[order.symbol], [])
+        return order
+
+    async def expire(self, orders: List[Order]) -> List[Order]:
+        """Withdraw the given orders that are still resting or pending, as expired"""
+        expired = []
+        books = {}
+        for order in orders:
+            if self.orders.get(order.id) is not order or not self._withdraw(order):
+                continue
+            order.status = EXPIRED
+            expired.append(order)
+            books[order.symbol] = self.books[order.symbol]
+        for book in books.values():
+            await self._settle(book, [])
+        return expired
+
+    def _withdraw(self, order: Order) -> bool:
+        """Take an order off its book or StopBook, as cancelled"""
+        stops = self.stops.get(order.symbol)
+        if self.books[order.symbol].cancel(order.id) is not None:
+            self._forget(order)
+        elif stops is not None and stops.cancel(order):
+            order.status = CANCELLED
+            self._disarm(order)
+        else:
+            return False
+        return True
+
+    async def replace(self, order_id: str, user_id=None, price: Optional[float] = None,
+                      quantity: Optional[int] = None) -> Optional[Tuple[Order, List[Fill]]]:
+        """Change an open order; raises ValueError for a price on an order without a limit"""
+        order = self.get(order_id, user_id)
+        if order is None:
+            return None
+        book = self.books[order.symbol]
+        if order.status == PENDING:
+            # Armed orders keep their trigger; the new price is the stop-limit's limit
+            if price is not None and order.price is None:
+                raise ValueError("Stop and trailing-stop orders have no limit price to replace")
+            if quantity is not None:
+                order.quantity = order.remaining = quantity
+            if price is not None:
+                order.price = to_ticks(price)
+            return order, []
+        fills = book.replace(order_id, None if price is None else to_ticks(price), quantity)
+        if order.id not in book.orders:
+            self._forget(order)
+        await self._settle(book, fills)
+        return order, fills
+
+    def open_orders(self, user_id) -> List[Order]:
+        return list(self.user_orders.get(user_id, {}).values())
+
+    def _register(self, order: Order):
+        self.orders[order.id] = order
+        self.user_orders[order.user_id][order.id] = order
+
+    def _unregister(self, order: Order) -> bool:
+        if self.orders.pop(order.id, None) is None:
+            return False
+        user_orders = self.user_orders[order.user_id]
+        user_orders.pop(order.id, None)
+        if not user_orders:
+            del self.user_orders[order.user_id]
+        return True
+
+    def _forget(self, order: Order):
+        """Drop an order that has left the book"""
+        if not self._unregister(order):
+            return
+        self._resting[order.symbol] -= 1
+        if not self._resting[order.symbol]:
+            del self._resting[order.symbol]
+
+    def _disarm(self, order: Order):
+        """Drop an order that has left its StopBook"""
+        if not self._unregister(order):
+            return
+        self._armed[order.symbol] -= 1
+        if not self._armed[order.symbol]:
+            del self._armed[order.symbol]
+
+    async def _settle(self, book: OrderBook, fills: List[Fill]):
+        """Publish the book's depth changes, then hand the fills to the listeners"""
+        delta = book.take_changes()
+        if delta is not None:
+            message = {"type": "book_delta", "symbol": book.symbol, **delta}
+            for listener in self._depth_listeners:
+                try:
+                    await listener(message)
+                except Exception:
+                    logger.exception("Depth listener failed")
+        if not fills:
+            return
+        for fill in fills:
+            if fill.maker.status in (FILLED, CANCELLED):
+                self._forget(fill.maker)
+        for listener in self._listeners:
+            try:
+                await listener(fills)
+            except Exception:
+                logger.exception("Fill listener failed")
+
+    def requote_due(self, tick) -> List[str]:
+        """Symbols that moved on ``tick`` whose books have resting user orders, armed stops or watched depth"""
+        if not self._resting and not self._armed and not self._watched:
+            return []
+        return [
+            symbol for symbol in set(self._resting) | set(self._armed) | set(self._watched)
+            if tick.changes[tick.symbol_ids[symbol]]
+        ]
+
+    async def requote(self, symbol: str):
+        """Re-quote a book at the current price, then fire the stops it has reached"""
+        book = self.book(symbol)
+        fills = self._quote(book)
+        await self._settle(book, fills + self._trigger(book))
+
+    async def on_tick(self, tick):
+        """Re-quote the books where user orders rest, stops are armed or depth is watched"""
+        for symbol in self.requote_due(tick):
+            await self.requote(symbol)
+
+matching_engine = MatchingEngine()
@@ -0,0 +1,336 @@
+"""
+Price-time priority limit order book.
+
+Prices are integer ticks (cents) so they can key dicts exactly. Each side
+keeps a dict of price -> level and a sorted list of its prices arranged so
+the best price is at the end: bids ascending, asks as negated prices. That
+makes the best bid/ask O(1), adding a level an O(log n) search plus a list
+insert, and taking the best level off O(1). Each level is an OrderedDict
+of order id -> order, i.e. a FIFO queue with O(1) cancel by id.
+
+Every change to a level's total quantity marks it dirty; ``take_changes``
+turns the dirty levels into one L2 delta and bumps the book's sequence
+number, which snapshots carry too, so a client that applies the deltas
+after a snapshot's ``seq`` tracks the book exactly. A level quantity of 0
+in a delta means the level is gone.
+
+Orders:
+
+market
+    takes whatever liquidity there is; the rest is cancelled
+limit
+    matches up to its price; ``time_in_force`` decides what happens to
+    the rest: DAY, GTC and GTD rest in the book, IOC is cancelled, FOK
+    only executes if the whole quantity can be filled at once and is
+    cancelled otherwise
+
+DAY and GTD orders carry ``expires_at`` (market time): the session close
+for DAY, the requested time for GTD. The book doesn't watch the clock;
+the order pipeline expires them through the scheduler.
+
+Stop, stop-limit and trailing-stop orders wait in a StopBook
+(services.stop_orders) while ``pending`` and come here once triggered,
+priced like a market order or, for stop-limit, like a limit order.
+"""
+import itertools
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+PRICE_SCALE = 100
+
+BUY, SELL = "buy", "sell"
+MARKET, LIMIT = "market", "limit"
+TIME_IN_FORCE = ("DAY", "GTC", "GTD", "IOC", "FOK")
+# Time in force that lets the unfilled part of a limit order rest
+RESTING = ("DAY", "GTC", "GTD")
+
+# Order states; pending orders wait for a trigger price
+PENDING = "pending"
+OPEN, PARTIALLY_FILLED, FILLED, CANCELLED = "open", "partially_filled", "filled", "cancelled"
+EXPIRED = "expired"
+
+def to_ticks(price) -> int:
+    return int(round(float(price) * PRICE_SCALE))
+
+def from_ticks(ticks: int) -> float:
+    return ticks / PRICE_SCALE
+
+class Order:
+    __slots__ = ("id", "user_id", "symbol", "side", "order_type", "price", "quantity",
+                 "remaining", "time_in_force", "timestamp", "status", "filled_value", "stop_price", "trail",
+                 "expires_at", "batched")
+
+    def __init__(self, id: str, user_id, symbol: str, side: str, quantity: int,
+                 order_type: str = LIMIT, price: Optional[int] = None, time_in_force: str = "GTC",
+                 stop_price: Optional[int] = None, trail: Optional[int] = None,
+                 expires_at: Optional[float] = None):
+        self.id = id
+        self.user_id = user_id
+        self.symbol = symbol
+        self.side = side
+        self.order_type = order_type
+        # Limit price in ticks; None for orders that execute at the market
+        self.price = price
+        self.quantity = quantity
+        self.remaining = quantity
+        self.time_in_force = time_in_force
+        self.timestamp = time.time()
+        self.status = OPEN if stop_price is None and trail is None else PENDING
+        # Sum of price ticks * quantity over the fills, for the average price
+        self.filled_value = 0
+        # Trigger price, or distance from the best price for trailing stops, in ticks
+        self.stop_price = stop_price
+        self.trail = trail
+        # Market time a DAY or GTD order expires at
+        self.expires_at = expires_at
+        # Set while a bulk submission runs, whose caller prints its trades at once
+        self.batched = False
+
+    @property
+    def filled(self) -> int:
+        return self.quantity - self.remaining
+
+    @property
+    def average_price(self) -> Optional[float]:
+        return from_ticks(self.filled_value / self.filled) if self.filled else None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "symbol": self.symbol,
+            "side": self.side,
+            "order_type": self.order_type,
+            "price": None if self.price is None else from_ticks(self.price),
+            "quantity": self.quantity,
+            "filled_quantity": self.filled,
+            "average_price": self.average_price,
+            "time_in_force": self.time_in_force,
+            "stop_price": None if self.stop_price is None else from_ticks(self.stop_price),
+            "trail": None if self.trail is None else from_ticks(self.trail),
+            "expires_at": self.expires_at,
+            "status": self.status,
+            "timestamp": self.timestamp,
+        }
+
+class Fill:
+    __slots__ = ("seq", "symbol", "price", "quantity", "maker", "taker", "timestamp")
+
+    def __init__(self, seq: int, symbol: str, price: int, quantity: int, maker: Order, taker: Order):
+        self.seq = seq
+        self.symbol = symbol
+        self.price = price
+        self.quantity = quantity
+        self.maker = maker
+        self.taker = taker
+        self.timestamp = time.time()
+
+class PriceLevel:
+    __slots__ = ("price", "orders", "quantity")
+
+    def __init__(self, price: int):
+        self.price = price
+        self.orders: "OrderedDict[str, Order]" = OrderedDict()
+        self.quantity = 0
+
+class BookSide:
+    """One side of the book; ``keys`` holds sort keys with the best at the end"""
+
+    def __init__(self, side: str):
+        self.side = side
+        self.levels: Dict[int, PriceLevel] = {}
+        self.keys: List[int] = []
+        # Bids sort ascending by price, asks by negated price
+        self._sign = 1 if side == BUY else -1
+
+    def __len__(self):
+        return len(self.keys)
+
+    def best(self) -> Optional[PriceLevel]:
+        return self.levels[self._sign * self.keys[-1]] if self.keys else None
+
+    def level(self, price: int) -> PriceLevel:
+        level = self.levels.get(price)
+        if level is None:
+            level = self.levels[price] = PriceLevel(price)
+            insort(self.keys, self._sign * price)
+        return level
+
+    def remove_level(self, price: int):
+        del self.levels[price]
+        key = self._sign * price
+        if self.keys[-1] == key:
+            self.keys.pop()
+        else:
+            del self.keys[bisect_left(self.keys, key)]
+
+    def crosses(self, level_price: int, limit: Optional[int]) -> bool:
+        """Whether an incoming order on the other side with ``limit`` trades at ``level_price``"""
+        if limit is None:
+            return True
+        return level_price <= limit if self.side == SELL else level_price >= limit
+
+    def levels_from_best(self):
+        for key in reversed(self.keys):
+            yield self.levels[self._sign * key]
+
+class OrderBook:
+    """Limit order book for one symbol"""
+
+    _fill_seq = itertools.count(1)
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.bids = BookSide(BUY)
+        self.asks = BookSide(SELL)
+        self.orders: Dict[str, Order] = {}
+        # L2 sequence number and the levels changed since the last delta
+        self.seq = 0
+        self._dirty: Dict[Tuple[str, int], None] = {}
+
+    def _side(self, side: str) -> BookSide:
+        return self.bids if side == BUY else self.asks
+
+    def best_bid(self) -> Optional[int]:
+        level = self.bids.best()
+        return None if level is None else level.price
+
+    def best_ask(self) -> Optional[int]:
+        level = self.asks.best()
+        return None if level is None else level.price
+
+    def submit(self, order: Order) -> List[Fill]:
+        """Match an incoming order, rest what's left if it has a limit price and a resting time in force"""
+        opposite = self.asks if order.side == BUY else self.bids
+        limit = order.price
+        if order.time_in_force == "FOK" and self._available(opposite, limit, order.quantity) < order.quantity:
+            order.status = CANCELLED
+            return []
+
+        fills = []
+        while order.remaining:
+            level = opposite.best()
+            if level is None or not opposite.crosses(level.price, limit):
+                break
+            self._match_level(order, level, fills)
+            if not level.orders:
+                opposite.remove_level(level.price)
+
+        if order.remaining and limit is not None and order.time_in_force in RESTING:
+            self._rest(order)
+        elif order.remaining:
+            order.status = CANCELLED
+        else:
+            order.status = FILLED
+        return fills
+
+    def _available(self, opposite: BookSide, limit: Optional[int], wanted: int) -> int:
+        available = 0
+        for level in opposite.levels_from_best():
+            if available >= wanted or not opposite.crosses(level.price, limit):
+                break
+            available += level.quantity
+        return available
+
+    def _match_level(self, order: Order, level: PriceLevel, fills: List[Fill]):
+        orders = level.orders
+        self._dirty[(SELL if order.side == BUY else BUY, level.price)] = None
+        while order.remaining and orders:
+            maker = next(iter(orders.values()))
+            quantity = min(order.remaining, maker.remaining)
+            maker.remaining -= quantity
+            order.remaining -= quantity
+            level.quantity -= quantity
+            maker.filled_value += quantity * level.price
+            order.filled_value += quantity * level.price
+            if maker.remaining:
+                maker.status = PARTIALLY_FILLED
+            else:
+                maker.status = FILLED
+                orders.popitem(last=False)
+                del self.orders[maker.id]
+            fills.append(Fill(next(self._fill_seq), self.symbol, level.price, quantity, maker, order))
+        if order.remaining and order.filled:
+            order.status = PARTIALLY_FILLED
+
+    def _rest(self, order: Order):
+        level = self._side(order.side).level(order.price)
+        level.orders[order.id] = order
+        level.quantity += order.remaining
+        self.orders[order.id] = order
+        self._dirty[(order.side, order.price)] = None
+
+    def cancel(self, order_id: str) -> Optional[Order]:
+        """Take a resting order off the book; None if it isn't resting"""
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return None
+        side = self._side(order.side)
+        level = side.levels[order.price]
+        del level.orders[order_id]
+        level.quantity -= order.remaining
+        if not level.orders:
+            side.remove_level(order.price)
+        self._dirty[(order.side, order.price)] = None
+        order.status = CANCELLED
+        return order
+
+    def replace(self, order_id: str, price: Optional[int] = None,
+                quantity: Optional[int] = None) -> Optional[List[Fill]]:
+        """Amend a resting order.
+
+        Reducing the quantity keeps its place in the queue; a new price or a
+        larger quantity re-enters the book (and may trade) at the back of the
+        queue, as on most exchanges. Returns None if the order isn't resting.
+        """
+        order = self.orders.get(order_id)
+        if order is None:
+            return None
+        price = order.price if price is None else price
+        quantity = order.quantity if quantity is None else quantity
+        if quantity <= order.filled:
+            self.cancel(order_id)
+            return []
+        if price == order.price and quantity <= order.quantity:
+            level = self._side(order.side).levels[order.price]
+            level.quantity -= order.quantity - quantity
+            order.remaining -= order.quantity - quantity
+            order.quantity = quantity
+            self._dirty[(order.side, order.price)] = None
+            return []
+        self.cancel(order_id)
+        order.remaining = quantity - order.filled
+        order.quantity = quantity
+        order.price = price
+        order.status = PARTIALLY_FILLED if order.filled else OPEN
+        order.timestamp = time.time()
+        return self.submit(order)
+
+    def depth(self, levels: int) -> Dict[str, list]:
+        """Top ``levels`` price levels per side as [price, quantity], best first"""
+        return {
+            name: [
+                [from_ticks(level.price), level.quantity]
+                for level in itertools.islice(side.levels_from_best(), levels)
+            ]
+            for name, side in (("bids", self.bids), ("asks", self.asks))
+        }
+
+    def snapshot(self, levels: int) -> dict:
+        """Depth at the current sequence number; take pending changes first"""
+        return {"seq": self.seq, **self.depth(levels)}
+
+    def take_changes(self) -> Optional[dict]:
+        """The levels changed since the last call as one delta with the next sequence number"""
+        if not self._dirty:
+            return None
+        self.seq += 1
+        delta = {"seq": self.seq, "bids": [], "asks": []}
+        for side, price in self._dirty:
+            level = self._side(side).levels.get(price)
+            delta["bids" if side == BUY else "asks"].append(
+                [from_ticks(price), 0 if level is None else level.quantity]
+            )
+        self._dirty.clear()
+        return delta
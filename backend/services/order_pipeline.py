@@ -0,0 +1,209 @@
+"""
+Symbol-sharded order-entry pipeline.
+
+Request handlers don't touch the order books. Each operation is queued
+on the shard that owns its symbol (crc32 of the symbol modulo
+``ORDER_SHARDS``), and the handler awaits the result as its ack. One
+sequencer task per shard runs that shard's operations one at a time, and
+each operation finishes, fills and depth deltas published, before the
+next one starts. So orders on a symbol execute in arrival order and its
+book_delta messages go out in ``seq`` order. Shards run concurrently, so
+a shard that is waiting on slow listeners doesn't hold up the others.
+
+Market-maker re-quotes on ticks go through the shards too. At most one
+re-quote job is queued per shard; symbols that move again before it runs
+join that job.
+
+Expiries of DAY and GTD orders go through the event scheduler. Orders
+that expire at the same market time share one timer (a whole day's DAY
+orders share the session close). When it fires, each shard gets one job
+that expires its share of them, in turn with that shard's orders.
+
+Shards are within one process. Each uvicorn worker has its own
+``matching_engine`` and books, and nothing routes an order to another
+worker, so orders placed through different workers never meet, and
+ordering holds per worker only. Run a single worker where users must
+trade against each other; the backplane only shares the prints.
+
+A queued operation runs even if its caller goes away. Queues hold
+``ORDER_QUEUE_SIZE`` operations each, and callers wait for room beyond
+that.
+"""
+import asyncio
+import logging
+import os
+import zlib
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from services.matching_engine import DEPTH_LEVELS, MatchingEngine, matching_engine
+from services.order_book import Fill, Order
+from services.scheduler import Scheduler, scheduler as default_scheduler
+
+logger = logging.getLogger(__name__)
+
+ORDER_SHARDS = int(os.getenv("ORDER_SHARDS", "8"))
+ORDER_QUEUE_SIZE = int(os.getenv("ORDER_QUEUE_SIZE", "10000"))
+
+Job = Callable[[], Awaitable]
+
+class OrderPipeline:
+    """Per-shard queues and sequencers in front of the matching engine"""
+
+    def __init__(self, engine: MatchingEngine = matching_engine, shards: int = ORDER_SHARDS,
+                 queue_size: int = ORDER_QUEUE_SIZE, scheduler: Scheduler = default_scheduler):
+        self.engine = engine
+        self.scheduler = scheduler
+        self.shards = max(shards, 1)
+        self.queue_size = queue_size
+        self._queues: List[asyncio.Queue] = []
+        self._workers: List[asyncio.Task] = []
+        # Symbols waiting for the queued re-quote job of each shard
+        self._requotes: Dict[int, Set[str]] = defaultdict(set)
+        # Market time -> orders expiring then, each time with one scheduler timer
+        self._expiries: Dict[float, List[Order]] = {}
+        self.processed = [0] * self.shards
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    async def start(self):
+        """Start one sequencer per shard (no-op if they are already running)"""
+        if self.running:
+            return
+        self._queues = [asyncio.Queue(self.queue_size) for _ in range(self.shards)]
+        self._workers = [asyncio.create_task(self._run(shard)) for shard in range(self.shards)]
+
+    async def stop(self):
+        """Stop the sequencers; operations still queued are dropped"""
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.cancel()
+        for worker in workers:
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+        for queue in self._queues:
+            while not queue.empty():
+                _, future = queue.get_nowait()
+                if future is not None and not future.done():
+                    future.cancel()
+        self._queues = []
+        self._requotes.clear()
+        self._expiries.clear()
+
+    def shard(self, symbol: str) -> int:
+        # crc32 rather than hash(), so the mapping is the same on every run
+        return zlib.crc32(symbol.encode()) % self.shards
+
+    async def _run(self, shard: int):
+        queue = self._queues[shard]
+        while True:
+            job, future = await queue.get()
+            try:
+                result = await job()
+            except Exception as exc:
+                if future is None:
+                    logger.exception("Order pipeline job failed on shard %d", shard)
+                elif not future.done():
+                    future.set_exception(exc)
+            else:
+                if future is not None and not future.done():
+                    future.set_result(result)
+            self.processed[shard] += 1
+
+    async def call(self, symbol: str, job: Job):
+        """Run ``job`` on the sequencer that owns ``symbol`` and return its result"""
+        if not self.running:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queues[self.shard(symbol)].put((job, future))
+        return await future
+
+    async def post(self, symbol: str, job: Job):
+        """Queue ``job`` on the sequencer that owns ``symbol`` without waiting for it to run"""
+        if not self.running:
+            await self.start()
+        await self._queues[self.shard(symbol)].put((job, None))
+
+    async def submit(self, order: Order) -> List[Fill]:
+        fills = await self.call(order.symbol, lambda: self.engine.submit(order))
+        self._schedule_expiry(order)
+        return fills
+
+    async def submit_many(self, orders: List[Order]) -> List[Fill]:
+        """Submit a batch; each shard runs its part back to back"""
+        by_shard: Dict[int, List[Order]] = defaultdict(list)
+        for order in orders:
+            by_shard[self.shard(order.symbol)].append(order)
+        results = await asyncio.gather(*(
+            self.call(shard_orders[0].symbol, lambda shard_orders=shard_orders: self.engine.submit_many(shard_orders))
+            for shard_orders in by_shard.values()
+        ))
+        for order in orders:
+            self._schedule_expiry(order)
+        return [fill for fills in results for fill in fills]
+
+    def _schedule_expiry(self, order: Order):
+        if order.expires_at is None or self.engine.get(order.id) is not order:
+            return
+        orders = self._expiries.get(order.expires_at)
+        if orders is None:
+            orders = self._expiries[order.expires_at] = []
+            self.scheduler.call_at(order.expires_at, self._expire, order.expires_at)
+        orders.append(order)
+
+    async def _expire(self, when: float):
+        """Queue one expiry job per shard for the orders due at ``when``"""
+        by_shard: Dict[int, List[Order]] = defaultdict(list)
+        for order in self._expiries.pop(when, ()):
+            by_shard[self.shard(order.symbol)].append(order)
+        for orders in by_shard.values():
+            await self.post(orders[0].symbol, lambda orders=orders: self.engine.expire(orders))
+
+    async def cancel(self, order_id: str, user_id=None) -> Optional[Order]:
+        order = self.engine.get(order_id, user_id)
+        if order is None:
+            return None
+        # The engine checks again on the shard, in case the order filled while queued
+        return await self.call(order.symbol, lambda: self.engine.cancel(order_id, user_id))
+
+    async def replace(self, order_id: str, user_id=None, price: Optional[float] = None,
+                      quantity: Optional[int] = None) -> Optional[Tuple[Order, List[Fill]]]:
+        order = self.engine.get(order_id, user_id)
+        if order is None:
+            return None
+        return await self.call(order.symbol, lambda: self.engine.replace(order_id, user_id, price, quantity))
+
+    async def snapshot(self, symbol: str, levels: int = DEPTH_LEVELS) -> dict:
+        return await self.call(symbol, lambda: self.engine.snapshot(symbol, levels))
+
+    async def on_tick(self, tick):
+        """Queue re-quotes for the books that follow the market"""
+        if not self.running:
+            return
+        for symbol in self.engine.requote_due(tick):
+            shard = self.shard(symbol)
+            pending = self._requotes[shard]
+            if not pending:
+                try:
+                    self._queues[shard].put_nowait((lambda shard=shard: self._requote(shard), None))
+                except asyncio.QueueFull:
+                    # The shard is backed up with orders, which re-quote anyway
+                    continue
+            pending.add(symbol)
+
+    async def _requote(self, shard: int):
+        symbols = self._requotes.pop(shard, ())
+        for symbol in symbols:
+            await self.engine.requote(symbol)
+
+    def stats(self) -> List[dict]:
+        return [
+            {"shard": shard, "queued": queue.qsize(), "processed": self.processed[shard]}
+            for shard, queue in enumerate(self._queues)
+        ]
+
+order_pipeline = OrderPipeline()
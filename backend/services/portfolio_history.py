@@ -0,0 +1,241 @@
+"""
+Portfolio value and P&L history for charts.
+
+Every ``PORTFOLIO_SNAPSHOT_INTERVAL`` seconds the snapshot job reads each
+user's market value and total P&L from the valuation engine. It folds
+them into the current bucket of every rollup tier: one row per snapshot,
+plus 15-minute, hourly and daily buckets. Each row keeps the last value
+in its bucket and the bucket's min and max. Rows are upserted into
+``portfolio_snapshots`` write-behind. Open buckets are rewritten at every
+snapshot, so the table is never more than one interval behind.
+
+Every worker books only the fills it matched, so each writes its own
+share under its worker id and reads sum the shares. A worker's share is
+what its fills changed since it loaded the positions; the leader's also
+holds the loaded positions, so they count once. A bucket's range is then
+the sum of the shares' ranges, which bounds the true one.
+
+A chart reads the finest tier that covers its period in at most
+``MAX_HISTORY_ROWS`` rows. It then downsamples them to the requested
+number of points (see services.downsampling):
+
+lttb
+    follows the shape of the last values
+min_max
+    keeps each output bucket's lowest and highest point, taken from the
+    rows' own min and max, so spikes inside a rollup bucket still show
+
+A 1Y chart therefore reads at most a few hundred daily rows, however
+fine the snapshots are.
+"""
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from database import SessionLocal, upsert_statement
+from models.portfolio import PortfolioSnapshot
+from services.downsampling import lttb, min_max
+from services.trade_store import WORKER_ID
+from services.valuation import ValuationEngine, valuation_engine
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_INTERVAL = int(os.getenv("PORTFOLIO_SNAPSHOT_INTERVAL", "60"))
+ROLLUPS = (900, 3600, 86400)
+MAX_HISTORY_ROWS = int(os.getenv("PORTFOLIO_HISTORY_MAX_ROWS", "5000"))
+DOWNSAMPLING = ("lttb", "min_max")
+
+# Rows are (bucket_start, value, value_min, value_max, pnl, pnl_min, pnl_max)
+SERIES_COLUMNS = {"value": (1, 2, 3), "pnl": (4, 5, 6)}
+# Rows of the valuation engine's figures kept per snapshot
+FIGURE_ROWS = [0, 3]  # market value, total P&L
+
+class Rollup:
+    """The open bucket of one tier: its start and each user's running min and max"""
+
+    def __init__(self, resolution: int):
+        self.resolution = resolution
+        self.start = None
+        self.low = np.zeros((2, 0))
+        self.high = np.zeros((2, 0))
+
+    def update(self, now: float, series: np.ndarray):
+        start = int(now // self.resolution) * self.resolution
+        if start != self.start:
+            self.start = start
+            self.low, self.high = series.copy(), series.copy()
+            return
+        seen = self.low.shape[1]
+        np.minimum(self.low, series[:, :seen], out=self.low)
+        np.maximum(self.high, series[:, :seen], out=self.high)
+        if series.shape[1] > seen:
+            # Users who first traded during this bucket
+            self.low = np.concatenate([self.low, series[:, seen:]], axis=1)
+            self.high = np.concatenate([self.high, series[:, seen:]], axis=1)
+
+class PortfolioHistory:
+    """Snapshot job and chart queries over ``portfolio_snapshots``"""
+
+    def __init__(self, valuation: ValuationEngine = valuation_engine, interval: int = SNAPSHOT_INTERVAL,
+                 worker: int = WORKER_ID):
+        self.valuation = valuation
+        self.interval = interval
+        self.worker = worker
+        # Only the leader's share includes the positions loaded at startup; see lead
+        self.leader = False
+        self.tiers = [Rollup(interval)] + [Rollup(seconds) for seconds in ROLLUPS if seconds > interval]
+        self._task: Optional[asyncio.Task] = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="portfolio-history")
+
+    async def start(self):
+        """Start the snapshot job (no-op if it is already running)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def lead(self):
+        self.leader = True
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def wait(self):
+        self._writer.submit(lambda: None).result()
+
+    async def _run(self):
+        while True:
+            # Aligned to the interval, so every worker snapshots the same instants
+            await asyncio.sleep(self.interval - time.time() % self.interval)
+            try:
+                self.snapshot(time.time())
+            except Exception:
+                logger.exception("Portfolio snapshot failed")
+
+    def snapshot(self, now: float):
+        """Fold every user's current figures into the rollups and queue the rows"""
+        series = self.valuation.current()[FIGURE_ROWS]
+        if not self.leader:
+            series = series - self.valuation.baseline()
+        users = self.valuation.positions.users
+        active = np.flatnonzero((series != 0).any(axis=0)).tolist()
+        if not active:
+            return
+        rows = []
+        for tier in self.tiers:
+            tier.update(now, series)
+            values = series[:, active].T.tolist()
+            lows = tier.low[:, active].T.tolist()
+            highs = tier.high[:, active].T.tolist()
+            for user, (value, pnl), (value_min, pnl_min), (value_max, pnl_max) in zip(active, values, lows, highs):
+                rows.append({
+                    "user_id": users[user],
+                    "resolution": tier.resolution,
+                    "bucket_start": tier.start,
+                    "worker": self.worker,
+                    "value": Decimal(f"{value:.2f}"),
+                    "value_min": Decimal(f"{value_min:.2f}"),
+                    "value_max": Decimal(f"{value_max:.2f}"),
+                    "pnl": Decimal(f"{pnl:.2f}"),
+                    "pnl_min": Decimal(f"{pnl_min:.2f}"),
+                    "pnl_max": Decimal(f"{pnl_max:.2f}"),
+                })
+        self._writer.submit(self._write, rows)
+
+    def _write(self, rows: List[dict]):
+        columns = ("value", "value_min", "value_max", "pnl", "pnl_min", "pnl_max")
+        try:
+            with SessionLocal() as session:
+                # Bounded batches keep each statement under the drivers' parameter limits
+                for i in range(0, len(rows), 1000):
+                    batch = rows[i:i + 1000]
+                    statement = upsert_statement(
+                        PortfolioSnapshot, batch, ("user_id", "resolution", "bucket_start", "worker"), columns
+                    )
+                    if statement is not None:
+                        session.execute(statement)
+                    else:
+                        for row in batch:
+                            session.merge(PortfolioSnapshot(**row))
+                session.commit()
+        except SQLAlchemyError:
+            logger.warning("Could not write %d portfolio snapshots", len(rows), exc_info=True)
+
+    def resolution_for(self, span: float) -> int:
+        """The finest tier that covers ``span`` seconds in at most MAX_HISTORY_ROWS rows"""
+        for tier in self.tiers:
+            if span / tier.resolution <= MAX_HISTORY_ROWS:
+                return tier.resolution
+        return self.tiers[-1].resolution
+
+    async def history(self, user_id, start: float, end: float, points: int, series: str = "value",
+                      method: str = "lttb") -> Tuple[int, np.ndarray]:
+        """Downsampled rows between ``start`` and ``end`` and the tier they came from.
+
+        For ``min_max`` the chosen series' last value is replaced with the
+        bucket extreme that was picked.
+        """
+        resolution = self.resolution_for(end - start)
+        rows = await asyncio.to_thread(self._load, user_id, resolution, start, end)
+        return resolution, downsample(rows, points, series, method)
+
+    def _load(self, user_id, resolution: int, start: float, end: float) -> np.ndarray:
+        statement = (
+            select(
+                PortfolioSnapshot.bucket_start,
+                func.sum(PortfolioSnapshot.value), func.sum(PortfolioSnapshot.value_min),
+                func.sum(PortfolioSnapshot.value_max), func.sum(PortfolioSnapshot.pnl),
+                func.sum(PortfolioSnapshot.pnl_min), func.sum(PortfolioSnapshot.pnl_max),
+            )
+            .where(
+                PortfolioSnapshot.user_id == user_id,
+                PortfolioSnapshot.resolution == resolution,
+                PortfolioSnapshot.bucket_start >= int(start // resolution) * resolution,
+                PortfolioSnapshot.bucket_start < end,
+            )
+            .group_by(PortfolioSnapshot.bucket_start)
+            .order_by(PortfolioSnapshot.bucket_start)
+        )
+        try:
+            with SessionLocal() as session:
+                rows = session.execute(statement).all()
+        except SQLAlchemyError:
+            logger.warning("Could not read portfolio history for user %s", user_id, exc_info=True)
+            rows = []
+        return np.array(rows, dtype=np.float64).reshape(-1, 7)
+
+def downsample(rows: np.ndarray, points: int, series: str = "value", method: str = "lttb") -> np.ndarray:
+    """At most ``points`` of ``rows``, in time order"""
+    if len(rows) <= points:
+        return rows
+    last, low, high = SERIES_COLUMNS[series]
+    if method == "lttb":
+        return rows[lttb(rows[:, 0], rows[:, last], points)]
+    # Each row contributes its low then its high as samples
+    samples = np.empty(2 * len(rows))
+    samples[0::2], samples[1::2] = rows[:, low], rows[:, high]
+    chosen = min_max(samples, points)
+    # One point per row: where both of a row's samples were picked, keep the
+    # one further from the row's last value
+    picked = chosen // 2
+    deviation = np.abs(samples[chosen] - rows[picked, last])
+    twin = np.flatnonzero(picked[1:] == picked[:-1])
+    chosen = np.delete(chosen, np.where(deviation[twin] < deviation[twin + 1], twin, twin + 1))
+    result = rows[chosen // 2].copy()
+    result[:, last] = samples[chosen]
+    return result
+
+portfolio_history = PortfolioHistory()
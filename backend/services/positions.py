@@ -0,0 +1,199 @@
+"""
+Positions per (user, symbol), kept up to date fill by fill.
+
+Each position is one row of parallel NumPy columns: user index, symbol
+index, signed quantity, average cost and realized P&L. A dict keyed by
+(user, symbol) finds the row, so a fill is a lookup plus a few scalar
+updates, O(1) however long the user's trade history is. Reading a user's
+holdings is a lookup of their rows and a mark to the current prices. The
+columns also hold the whole book as a sparse users x symbols matrix in
+coordinate form, for valuing every position at once.
+
+Average cost follows the usual rules. A fill that adds to a position
+blends its price into the average. A fill that reduces one realises
+(price - average cost) on the quantity closed. A fill that goes through
+zero opens the remainder at the fill price. Short positions have negative
+quantities.
+
+Every worker books only the fills it matched, so its rows are its own
+view. The ``positions`` table holds the sum over workers: each ``flush``
+hands the fills booked since the last one to a background thread, which
+locks their stored rows and replays the fills onto them. Fills from
+several workers then add up in the table, in the order the workers'
+batches reach it. ``load`` reads the rows back on startup and keeps a copy
+as ``baseline``, so the fills this worker booked since can be told apart
+from what it loaded.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+
+from database import SessionLocal, lock_for_write
+from models.position import Position
+from services.market_data import market_engine
+from services.order_book import BUY
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = (
+    ("user_index", np.int32),
+    ("symbol_index", np.int32),
+    ("quantity", np.int64),
+    ("average_cost", np.float64),
+    ("realized", np.float64),
+)
+
+def book_fill(held: int, average_cost: float, realized: float, change: int,
+              price: float) -> Tuple[int, float, float]:
+    """A position's (quantity, average cost, realized P&L) after a fill of signed ``change``"""
+    total = held + change
+    if held == 0 or (held > 0) == (change > 0):
+        average_cost = (average_cost * abs(held) + price * abs(change)) / abs(total)
+    else:
+        closed = min(abs(change), abs(held))
+        direction = 1 if held > 0 else -1
+        realized += (price - average_cost) * closed * direction
+        if total == 0:
+            average_cost = 0.0
+        elif (total > 0) != (held > 0):
+            average_cost = price
+    return total, average_cost, realized
+
+class PositionBook:
+    """Every user's positions as rows of parallel arrays"""
+
+    def __init__(self, symbols: List[str], capacity: int = 1024, persist: bool = True):
+        self.symbols = symbols
+        self.symbol_ids = {symbol: i for i, symbol in enumerate(symbols)}
+        self.persist = persist
+        self.size = 0
+        # Bumped on every change, so readers can tell when to rebuild derived data
+        self.version = 0
+        for name, dtype in COLUMNS:
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+        # User index -> user id, and back
+        self.users: List[object] = []
+        self.user_ids: Dict[object, int] = {}
+        self._rows: Dict[Tuple[object, int], int] = {}
+        self._user_rows: Dict[object, List[int]] = {}
+        # Row -> the (signed quantity, price) fills booked since the last flush
+        self._fills: Dict[int, List[Tuple[int, float]]] = {}
+        # The first rows' (quantity, average cost, realized) as loaded
+        self.baseline = (np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0))
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="positions")
+
+    def _row(self, user_id, symbol_id: int) -> int:
+        row = self._rows.get((user_id, symbol_id))
+        if row is not None:
+            return row
+        if self.size == len(self.quantity):
+            for name, _ in COLUMNS:
+                column = getattr(self, name)
+                grown = np.zeros(2 * len(column), dtype=column.dtype)
+                grown[:self.size] = column[:self.size]
+                setattr(self, name, grown)
+        user_index = self.user_ids.get(user_id)
+        if user_index is None:
+            user_index = self.user_ids[user_id] = len(self.users)
+            self.users.append(user_id)
+        row = self._rows[(user_id, symbol_id)] = self.size
+        self.size += 1
+        self.user_index[row] = user_index
+        self.symbol_index[row] = symbol_id
+        self._user_rows.setdefault(user_id, []).append(row)
+        return row
+
+    def apply(self, user_id, symbol: str, side: str, quantity: int, price: float) -> int:
+        """Book one fill; returns the position's row"""
+        row = self._row(user_id, self.symbol_ids[symbol])
+        change = quantity if side == BUY else -quantity
+        self.quantity[row], self.average_cost[row], self.realized[row] = book_fill(
+            int(self.quantity[row]), float(self.average_cost[row]), float(self.realized[row]), change, price
+        )
+        self.version += 1
+        if self.persist:
+            self._fills.setdefault(row, []).append((change, price))
+        return row
+
+    def position(self, user_id, symbol: str) -> Optional[dict]:
+        row = self._rows.get((user_id, self.symbol_ids.get(symbol)))
+        return None if row is None else self._position(row)
+
+    def _position(self, row: int) -> dict:
+        return {
+            "symbol": self.symbols[self.symbol_index[row]],
+            "quantity": int(self.quantity[row]),
+            "average_cost": float(self.average_cost[row]),
+            "realized_pnl": float(self.realized[row]),
+        }
+
+    def positions(self, user_id, open_only: bool = True) -> List[dict]:
+        """The user's positions, in the order they were first traded"""
+        return [
+            self._position(row) for row in self._user_rows.get(user_id, ())
+            if not open_only or self.quantity[row]
+        ]
+
+    def flush(self):
+        """Queue the fills booked since the last flush for the table"""
+        if not self._fills:
+            return
+        batch = [
+            (self.users[self.user_index[row]], self.symbols[self.symbol_index[row]], fills)
+            for row, fills in self._fills.items()
+        ]
+        self._fills = {}
+        self._writer.submit(self._write, batch)
+
+    def wait(self):
+        self.flush()
+        self._writer.submit(lambda: None).result()
+
+    def _write(self, batch: List[Tuple[object, str, List[Tuple[int, float]]]]):
+        """Replay each position's fills onto its stored row, locked against other workers"""
+        try:
+            with SessionLocal() as session:
+                lock_for_write(session)
+                # One lock order for every worker, so two batches can't deadlock
+                for user_id, symbol, fills in sorted(batch, key=lambda item: (item[0], item[1])):
+                    position = session.get(Position, (user_id, symbol), with_for_update=True)
+                    if position is None:
+                        position = Position(user_id=user_id, symbol=symbol)
+                        session.add(position)
+                        held, average_cost, realized = 0, 0.0, 0.0
+                    else:
+                        held = position.quantity
+                        average_cost, realized = float(position.average_cost), float(position.realized_pnl)
+                    for change, price in fills:
+                        held, average_cost, realized = book_fill(held, average_cost, realized, change, price)
+                    position.quantity = held
+                    position.average_cost = Decimal(f"{average_cost:.6f}")
+                    position.realized_pnl = Decimal(f"{realized:.6f}")
+                session.commit()
+        except SQLAlchemyError:
+            logger.warning("Could not write %d positions", len(batch), exc_info=True)
+
+    def load(self):
+        """Read the persisted positions into memory"""
+        try:
+            with SessionLocal() as session:
+                for position in session.scalars(select(Position)):
+                    symbol_id = self.symbol_ids.get(position.symbol)
+                    if symbol_id is None:
+                        continue
+                    row = self._row(position.user_id, symbol_id)
+                    self.quantity[row] = position.quantity
+                    self.average_cost[row] = float(position.average_cost)
+                    self.realized[row] = float(position.realized_pnl)
+                    self.version += 1
+        except SQLAlchemyError:
+            logger.warning("Could not load positions", exc_info=True)
+        rows = slice(0, self.size)
+        self.baseline = (self.quantity[rows].copy(), self.average_cost[rows].copy(), self.realized[rows].copy())
+
+position_book = PositionBook(market_engine.symbols)
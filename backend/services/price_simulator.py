@@ -0,0 +1,133 @@
+import zlib
+
+import numpy as np
+from typing import List, Optional, Sequence, Tuple
+
+# Trading seconds in a year (252 sessions of 6.5 hours); drift and
+# volatility are annualised and scaled by this
+SECONDS_PER_TRADING_YEAR = 252 * 6.5 * 3600
+SECONDS_PER_TRADING_DAY = 6.5 * 3600
+
+# Seed quotes for the well-known symbols: price, annual drift, annual volatility
+DEFAULT_UNIVERSE = {
+    'AAPL': (175.50, 0.08, 0.28),
+    'GOOGL': (2845.20, 0.07, 0.30),
+    'MSFT': (378.90, 0.09, 0.26),
+    'TSLA': (245.67, 0.10, 0.60),
+    'AMZN': (3456.78, 0.08, 0.34),
+    'NVDA': (456.32, 0.12, 0.50),
+    'META': (324.15, 0.07, 0.40),
+    'NFLX': (456.78, 0.06, 0.42),
+}
+
+# Sectors used for sector performance and the sector indices
+SECTORS = (
+    "Technology", "Healthcare", "Finance", "Energy",
+    "Consumer", "Industrial", "Utilities", "Real Estate",
+)
+
+# Sector and shares outstanding of the well-known symbols
+DEFAULT_METADATA = {
+    'AAPL': ("Technology", 15.7e9),
+    'GOOGL': ("Technology", 0.63e9),
+    'MSFT': ("Technology", 7.4e9),
+    'TSLA': ("Consumer", 3.2e9),
+    'AMZN': ("Consumer", 0.51e9),
+    'NVDA': ("Technology", 2.5e9),
+    'META': ("Technology", 2.6e9),
+    'NFLX': ("Consumer", 0.44e9),
+}
+
+def universe_metadata(symbols: Sequence[str]) -> Tuple[List[str], np.ndarray]:
+    """Sector and shares outstanding of every symbol.
+
+    Synthetic tickers get theirs from a hash of the name, so a universe
+    rebuilt from a recording classifies them the same way.
+    """
+    hashes = np.array([zlib.crc32(symbol.encode()) for symbol in symbols], dtype=np.uint64)
+    sectors = [SECTORS[h % len(SECTORS)] for h in hashes.tolist()]
+    # High bits pick the size so it isn't tied to the sector
+    fraction = (hashes >> np.uint64(8)) / float(1 << 24)
+    shares = np.round(np.exp(np.log(1e7) + fraction * (np.log(2e9) - np.log(1e7))))
+    for i, symbol in enumerate(symbols):
+        if symbol in DEFAULT_METADATA:
+            sectors[i], shares[i] = DEFAULT_METADATA[symbol]
+    return sectors, shares
+
+class PriceSimulator:
+    """Array-backed geometric Brownian motion for a whole symbol universe.
+
+    Prices, drifts and volatilities live in NumPy arrays and ``step`` moves
+    every symbol in one vectorised update::
+
+        S(t + dt) = S(t) * exp((mu - sigma^2 / 2) * dt + sigma * sqrt(dt) * Z)
+
+    ``Z`` is standard normal, optionally correlated across symbols through
+    the Cholesky factor of ``correlation``. A full correlation matrix is
+    O(n^2) memory, so it is meant for universes of a few thousand symbols.
+    """
+
+    def __init__(self, symbols: Sequence[str], prices, drifts, volatilities,
+                 correlation=None, average_daily_volume=None, seed: Optional[int] = None):
+        self.symbols: List[str] = list(symbols)
+        self.size = len(self.symbols)
+        self.sectors, self.shares_outstanding = universe_metadata(self.symbols)
+        self.prices = np.asarray(prices, dtype=np.float64).copy()
+        self.drifts = np.asarray(drifts, dtype=np.float64)
+        self.volatilities = np.asarray(volatilities, dtype=np.float64)
+        self.changes = np.zeros(self.size, dtype=np.float64)
+        self.volumes = np.zeros(self.size, dtype=np.int64)
+        if average_daily_volume is None:
+            average_daily_volume = np.full(self.size, 1_000_000.0)
+        self.average_daily_volume = np.asarray(average_daily_volume, dtype=np.float64)
+        self.cholesky = None
+        if correlation is not None:
+            self.cholesky = np.linalg.cholesky(np.asarray(correlation, dtype=np.float64))
+        self.rng = np.random.default_rng(seed)
+
+    @classmethod
+    def with_universe(cls, size: int = len(DEFAULT_UNIVERSE), seed: Optional[int] = None,
+                      correlation=None) -> "PriceSimulator":
+        """Build a universe of ``size`` symbols.
+
+        The well-known symbols come first; the rest are synthetic tickers
+        (``SYM00008``...) with randomised starting prices and parameters.
+        """
+        symbols = list(DEFAULT_UNIVERSE)[:size]
+        prices = [DEFAULT_UNIVERSE[s][0] for s in symbols]
+        drifts = [DEFAULT_UNIVERSE[s][1] for s in symbols]
+        volatilities = [DEFAULT_UNIVERSE[s][2] for s in symbols]
+        average_daily_volume = [5_000_000.0] * len(symbols)
+
+        extra = size - len(symbols)
+        if extra > 0:
+            rng = np.random.default_rng(seed)
+            symbols += [f"SYM{i:05d}" for i in range(len(symbols), size)]
+            prices = np.concatenate([prices, np.round(np.exp(rng.uniform(np.log(5), np.log(500), extra)), 2)])
+            drifts = np.concatenate([drifts, rng.uniform(0.0, 0.12, extra)])
+            volatilities = np.concatenate([volatilities, rng.uniform(0.15, 0.60, extra)])
+            average_daily_volume = np.concatenate([
+                average_daily_volume, np.round(np.exp(rng.uniform(np.log(1e5), np.log(1e7), extra)))
+            ])
+
+        # Derive the path seed from the universe seed so the two don't share a stream
+        path_seed = None if seed is None else seed + 1
+        return cls(symbols, prices, drifts, volatilities, correlation, average_daily_volume, path_seed)
+
+    def step(self, dt_seconds: float) -> np.ndarray:
+        """Advance the universe by ``dt_seconds`` of trading time.
+
+        Updates ``prices``, ``changes`` and ``volumes`` in place and returns
+        the indices of the symbols whose price moved.
+        """
+        dt = dt_seconds / SECONDS_PER_TRADING_YEAR
+        shocks = self.rng.standard_normal(self.size)
+        if self.cholesky is not None:
+            shocks = self.cholesky @ shocks
+        log_returns = (self.drifts - 0.5 * self.volatilities ** 2) * dt
+        log_returns += self.volatilities * np.sqrt(dt) * shocks
+        new_prices = np.maximum(self.prices * np.exp(log_returns), 0.01)
+        np.subtract(new_prices, self.prices, out=self.changes)
+        self.prices = new_prices
+        self.volumes = self.rng.poisson(self.average_daily_volume * (dt_seconds / SECONDS_PER_TRADING_DAY))
+        return np.flatnonzero(self.changes)
@@ -0,0 +1,217 @@
+"""
+Pub/sub backplane connecting the uvicorn workers of one host.
+
+Each worker has its own WebSocket connections, so anything that has to
+reach every client (price ticks, trade prints) is published on the
+backplane and every worker fans it out to its own sockets.
+
+Backends (``PUBSUB_BACKEND``):
+
+inprocess (default)
+    Handlers are called directly; fine for a single worker and for tests.
+
+unix
+    The first worker to take ``PUBSUB_SOCKET_PATH + ".lock"`` becomes the
+    hub: it listens on the Unix socket and relays every message to all other
+    workers. The hub is also the leader that runs the market data producer.
+    If it dies, the remaining workers race for the lock and one of them
+    takes over.
+"""
+import asyncio
+import fcntl
+import logging
+import os
+import struct
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+BACKEND = os.getenv("PUBSUB_BACKEND", "inprocess")
+SOCKET_PATH = os.getenv("PUBSUB_SOCKET_PATH", "/tmp/stock-simulator-bus.sock")
+
+# Peers whose unsent backlog grows past this are dropped (they reconnect)
+MAX_PEER_BUFFER = 64 * 1024 * 1024
+
+Handler = Callable[[bytes], Awaitable[None]]
+LeaderCallback = Callable[[], Awaitable[None]]
+
+# Wire framing: u32 frame length, u16 channel length, channel, payload
+FRAME_HEADER = struct.Struct(">IH")
+
+def encode_frame(channel: str, payload: bytes) -> bytes:
+    name = channel.encode()
+    return FRAME_HEADER.pack(2 + len(name) + len(payload), len(name)) + name + payload
+
+async def read_frame(reader: asyncio.StreamReader):
+    header = await reader.readexactly(FRAME_HEADER.size)
+    length, name_length = FRAME_HEADER.unpack(header)
+    body = await reader.readexactly(length - 2)
+    return body[:name_length].decode(), body[name_length:]
+
+class Backplane:
+    """Base class: local handler registry plus leader bookkeeping"""
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Handler]] = defaultdict(list)
+        self._leader_callbacks: List[LeaderCallback] = []
+        self.is_leader = False
+
+    def subscribe(self, channel: str, handler: Handler):
+        if handler not in self._handlers[channel]:
+            self._handlers[channel].append(handler)
+
+    def on_leader(self, callback: LeaderCallback):
+        """Register a coroutine to run when this worker becomes the leader"""
+        if callback not in self._leader_callbacks:
+            self._leader_callbacks.append(callback)
+
+    async def start(self):
+        raise NotImplementedError
+
+    async def stop(self):
+        pass
+
+    async def publish(self, channel: str, payload: bytes):
+        raise NotImplementedError
+
+    async def _dispatch(self, channel: str, payload: bytes):
+        for handler in list(self._handlers.get(channel, ())):
+            try:
+                await handler(payload)
+            except Exception:
+                logger.exception("Backplane handler for %s failed", channel)
+
+    async def _become_leader(self):
+        self.is_leader = True
+        for callback in self._leader_callbacks:
+            await callback()
+
+class InProcessBackplane(Backplane):
+    """Single-process backplane: publish calls the local handlers directly"""
+
+    async def start(self):
+        await self._become_leader()
+
+    async def publish(self, channel: str, payload: bytes):
+        await self._dispatch(channel, payload)
+
+class UnixSocketBackplane(Backplane):
+    """Hub-and-spoke backplane over a Unix domain socket"""
+
+    def __init__(self, path: str = SOCKET_PATH, retry_interval: float = 0.2):
+        super().__init__()
+        self.path = path
+        self.retry_interval = retry_interval
+        self._lock_file = None
+        self._server = None
+        self._peers: Dict[asyncio.StreamWriter, asyncio.Task] = {}
+        self._hub_writer = None
+        self._reader_task = None
+
+    async def start(self):
+        await self._connect()
+
+    async def stop(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._hub_writer is not None:
+            self._hub_writer.close()
+            self._hub_writer = None
+        if self._server is not None:
+            self._server.close()
+            for writer, task in list(self._peers.items()):
+                task.cancel()
+                writer.close()
+            self._peers.clear()
+            self._server = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self.is_leader = False
+
+    async def publish(self, channel: str, payload: bytes):
+        frame = encode_frame(channel, payload)
+        if self._server is not None:
+            self._relay(frame)
+        elif self._hub_writer is not None:
+            try:
+                self._hub_writer.write(frame)
+            except Exception:
+                logger.warning("Backplane hub unavailable, message on %s not relayed", channel)
+        await self._dispatch(channel, payload)
+
+    def _try_lock(self) -> bool:
+        lock_file = open(self.path + ".lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    async def _connect(self):
+        """Become the hub if nobody holds the lock, otherwise connect to it"""
+        while True:
+            if self._try_lock():
+                if os.path.exists(self.path):
+                    os.unlink(self.path)
+                self._server = await asyncio.start_unix_server(self._serve_peer, path=self.path)
+                logger.info("Backplane hub listening on %s (pid %s)", self.path, os.getpid())
+                await self._become_leader()
+                return
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                await asyncio.sleep(self.retry_interval)
+                continue
+            self._hub_writer = writer
+            self._reader_task = asyncio.create_task(self._read_hub(reader))
+            return
+
+    async def _read_hub(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                channel, payload = await read_frame(reader)
+                await self._dispatch(channel, payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logger.warning("Lost connection to backplane hub, reconnecting")
+        self._hub_writer = None
+        await self._connect()
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._peers[writer] = asyncio.current_task()
+        try:
+            while True:
+                channel, payload = await read_frame(reader)
+                self._relay(encode_frame(channel, payload), exclude=writer)
+                await self._dispatch(channel, payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._peers.pop(writer, None)
+            writer.close()
+
+    def _relay(self, frame: bytes, exclude: asyncio.StreamWriter = None):
+        for writer in list(self._peers):
+            if writer is exclude:
+                continue
+            if writer.transport.get_write_buffer_size() > MAX_PEER_BUFFER:
+                logger.warning("Dropping backplane peer that stopped reading")
+                self._peers.pop(writer).cancel()
+                writer.close()
+                continue
+            writer.write(frame)
+
+def create_backplane(backend: str = BACKEND) -> Backplane:
+    if backend == "inprocess":
+        return InProcessBackplane()
+    if backend == "unix":
+        return UnixSocketBackplane()
+    raise ValueError(f"Unknown pub/sub backend: {backend}")
+
+bus = create_backplane()
@@ -0,0 +1,183 @@
+"""
+Result cache for the analytics and portfolio endpoints.
+
+Entries are keyed by endpoint and request parameters, expire after a
+per-endpoint TTL and are evicted least recently used once the cache holds
+``RESULT_CACHE_SIZE`` entries. Each entry also remembers the generation
+of the tags it depends on, and is stale as soon as any of them moves on:
+
+ticks
+    bumped on every market tick
+user:<id>
+    bumped when that user trades; published on the backplane so every
+    worker drops the user's entries
+
+Concurrent misses for the same key share one computation (single-flight).
+"""
+import asyncio
+import functools
+import os
+import time
+from collections import Counter, OrderedDict, defaultdict
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from services.pubsub import Backplane
+
+CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1024"))
+
+# Backplane channel carrying tag invalidations between workers
+CACHE_CHANNEL = "cache"
+
+TICKS = "ticks"
+
+def user_tag(user_id) -> str:
+    return f"user:{user_id}"
+
+class CacheEntry:
+    __slots__ = ("value", "expires", "generations")
+
+    def __init__(self, value, expires: float, generations: Tuple[Tuple[str, int], ...]):
+        self.value = value
+        self.expires = expires
+        self.generations = generations
+
+class ResultCache:
+    """Bounded TTL/LRU cache with tag invalidation and single-flight misses"""
+
+    def __init__(self, max_entries: int = CACHE_SIZE, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries: "OrderedDict[tuple, CacheEntry]" = OrderedDict()
+        self._pending: Dict[tuple, asyncio.Future] = {}
+        self._generations: Dict[str, int] = defaultdict(int)
+        self._bus: Optional[Backplane] = None
+        self.hits = Counter()
+        self.misses = Counter()
+        # Misses that waited for a computation already in flight
+        self.coalesced = Counter()
+        self.evictions = 0
+
+    def _is_fresh(self, entry: CacheEntry) -> bool:
+        return entry.expires > self.clock() and all(
+            self._generations[tag] == generation for tag, generation in entry.generations
+        )
+
+    async def get_or_compute(self, endpoint: str, params: tuple, ttl: float, tags: Iterable[str],
+                             compute: Callable[[], Awaitable]):
+        key = (endpoint,) + params
+        entry = self._entries.get(key)
+        if entry is not None:
+            if self._is_fresh(entry):
+                self._entries.move_to_end(key)
+                self.hits[endpoint] += 1
+                return entry.value
+            del self._entries[key]
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.coalesced[endpoint] += 1
+            try:
+                # Shielded so a cancelled waiter doesn't cancel everyone else's result
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+            # The request computing it was cancelled; try again ourselves
+            return await self.get_or_compute(endpoint, params, ttl, tags, compute)
+
+        self.misses[endpoint] += 1
+        # Taken before computing, so a tick or trade that lands meanwhile makes the result stale
+        generations = tuple((tag, self._generations[tag]) for tag in tags)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            # Mark retrieved so an exception nobody else waited for isn't logged
+            future.exception()
+            raise
+        finally:
+            del self._pending[key]
+        future.set_result(value)
+        self._store(key, CacheEntry(value, self.clock() + ttl, generations))
+        return value
+
+    def _store(self, key: tuple, entry: CacheEntry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, tag: str):
+        """Make every entry depending on ``tag`` stale in this worker"""
+        self._generations[tag] += 1
+
+    async def publish_invalidation(self, tag: str):
+        """Invalidate ``tag`` in every worker"""
+        if self._bus is None:
+            self.invalidate(tag)
+        else:
+            await self._bus.publish(CACHE_CHANNEL, tag.encode())
+
+    def attach(self, bus: Backplane):
+        self._bus = bus
+        bus.subscribe(CACHE_CHANNEL, self._on_bus_invalidation)
+
+    async def _on_bus_invalidation(self, payload: bytes):
+        self.invalidate(payload.decode())
+
+    async def on_tick(self, tick):
+        self.invalidate(TICKS)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        endpoints = sorted(set(self.hits) | set(self.misses))
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "evictions": self.evictions,
+            "endpoints": {
+                name: {
+                    "hits": self.hits[name],
+                    "misses": self.misses[name],
+                    "coalesced": self.coalesced[name],
+                    "hit_rate": round(
+                        (self.hits[name] + self.coalesced[name])
+                        / max(self.hits[name] + self.coalesced[name] + self.misses[name], 1), 3
+                    ),
+                }
+                for name in endpoints
+            },
+        }
+
+result_cache = ResultCache()
+
+def cached(endpoint: str, ttl: float, tags: Iterable[str] = (TICKS,), per_user: bool = False):
+    """Cache an endpoint's result by its parameters.
+
+    The authenticated user is left out of the key unless ``per_user`` is
+    set, in which case the entry also depends on the user's tag.
+    """
+    tags = tuple(tags)
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(**kwargs):
+            params = tuple(sorted((name, value) for name, value in kwargs.items() if name != "current_user"))
+            entry_tags = tags
+            if per_user:
+                user_id = kwargs["current_user"]["id"]
+                params += (("user", user_id),)
+                entry_tags += (user_tag(user_id),)
+            return await result_cache.get_or_compute(
+                endpoint, params, ttl, entry_tags, lambda: handler(**kwargs)
+            )
+        return wrapper
+    return decorator
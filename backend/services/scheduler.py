@@ -0,0 +1,252 @@
+"""
+Market clock and the event scheduler that runs on it.
+
+``MarketClock`` is simulated market time. It starts at
+``MARKET_CLOCK_START`` (ISO time, default now) and runs
+``MARKET_CLOCK_SPEED`` times faster than real time. Speed 39 plays a
+6.5-hour session in 10 minutes, for class sessions. On startup it
+resumes where the stored history ends if that is later, so ticks after
+a restart carry on from those of an accelerated session. The trading session
+runs from ``MARKET_OPEN`` to ``MARKET_CLOSE`` in ``MARKET_TIMEZONE``,
+Monday to Friday; DAY orders expire at its close. Unless
+``MARKET_SKIP_CLOSED`` is off, the clock only runs through sessions: it
+jumps from each close to the next open (over the weekend on Fridays), so
+ticks and orders never run while the market is closed. A clock started
+outside a session starts at the next open.
+
+``Scheduler`` keeps every timed callback in one heap, ordered by market
+time, and runs them from one task on the event loop. The task sleeps
+until the earliest entry is due, converting market time to real time at
+the clock's speed. A new earlier entry wakes it. Market ticks and order
+expiries are both scheduled here, so at any speed they run in
+market-time order: an order that expires at 16:00 is gone before any
+later tick is published. Callbacks run one at a time, and a
+coroutine callback is awaited before the next entry runs. Cancelled
+timers stay in the heap until they come up and are skipped then.
+"""
+import asyncio
+import heapq
+import inspect
+import itertools
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+CLOCK_SPEED = float(os.getenv("MARKET_CLOCK_SPEED", "1"))
+CLOCK_START = os.getenv("MARKET_CLOCK_START")
+MARKET_TIMEZONE = os.getenv("MARKET_TIMEZONE", "America/New_York")
+MARKET_OPEN = os.getenv("MARKET_OPEN", "09:30")
+MARKET_CLOSE = os.getenv("MARKET_CLOSE", "16:00")
+SKIP_CLOSED = os.getenv("MARKET_SKIP_CLOSED", "1") == "1"
+
+# datetime.weekday() of Saturday; there are no sessions at weekends
+SATURDAY = 5
+
+def _time_of_day(value: str) -> timedelta:
+    hours, minutes = value.split(":")
+    return timedelta(hours=int(hours), minutes=int(minutes))
+
+class MarketClock:
+    """Simulated market time, ``speed`` times faster than real time"""
+
+    def __init__(self, speed: float = CLOCK_SPEED, start: Optional[float] = None,
+                 timezone: str = MARKET_TIMEZONE, open: str = MARKET_OPEN, close: str = MARKET_CLOSE,
+                 skip_closed: bool = SKIP_CLOSED):
+        if speed <= 0:
+            raise ValueError("Clock speed must be positive")
+        self.speed = speed
+        self.timezone = ZoneInfo(timezone)
+        self.open = _time_of_day(open)
+        self.close = _time_of_day(close)
+        if skip_closed and self.close <= self.open:
+            raise ValueError("The market must close after it opens")
+        self.skip_closed = skip_closed
+        self._rebase(time.time() if start is None else start)
+
+    def _rebase(self, start: float):
+        """Run from market time ``start`` as of now"""
+        self.start = start
+        self._started = time.monotonic()
+        if self.skip_closed:
+            # The session the clock is in: market time runs from ``_open`` after
+            # ``_elapsed`` seconds of running, and jumps to the next session at ``_close``
+            self._open, self._close = self.session(start)
+            self._open = max(self._open, start)
+            self._elapsed = 0.0
+
+    def now(self) -> float:
+        """Market time in Unix seconds"""
+        elapsed = (time.monotonic() - self._started) * self.speed
+        if not self.skip_closed:
+            return self.start + elapsed
+        while elapsed > self._elapsed + self._close - self._open:
+            self._elapsed += self._close - self._open
+            self._open, self._close = self.session(self._close)
+        return self._open + elapsed - self._elapsed
+
+    def resume(self, when: float):
+        """Move the clock forward to market time ``when`` if it is behind it"""
+        if when > self.now():
+            self._rebase(when)
+
+    def delay(self, when: float) -> float:
+        """Real seconds until market time ``when``; closed hours take none"""
+        now = self.now()
+        if not self.skip_closed:
+            return max(when - now, 0.0) / self.speed
+        # Seconds of running from the current session's open to ``when``
+        running, open, close = 0.0, self._open, self._close
+        while when > close:
+            running += close - open
+            open, close = self.session(close)
+        running += max(when - open, 0.0)
+        return max(running - (now - self._open), 0.0) / self.speed
+
+    def session(self, when: float) -> Tuple[float, float]:
+        """Open and close of the session in progress at ``when``, or else the next one"""
+        close = self.session_close(when)
+        local = datetime.fromtimestamp(close, self.timezone)
+        day = local.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+        return (day + self.open).replace(tzinfo=self.timezone).timestamp(), close
+
+    def session_close(self, when: Optional[float] = None) -> float:
+        """The first session close after ``when`` (default now)"""
+        when = self.now() if when is None else when
+        local = datetime.fromtimestamp(when, self.timezone)
+        day = local.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+        while True:
+            close = (day + self.close).replace(tzinfo=self.timezone)
+            if day.weekday() < SATURDAY and close.timestamp() > when:
+                return close.timestamp()
+            day += timedelta(days=1)
+
+    def is_open(self, when: Optional[float] = None) -> bool:
+        when = self.now() if when is None else when
+        local = datetime.fromtimestamp(when, self.timezone)
+        if local.weekday() >= SATURDAY:
+            return False
+        since_midnight = local - local.replace(hour=0, minute=0, second=0, microsecond=0)
+        return self.open <= since_midnight < self.close
+
+    def to_dict(self) -> dict:
+        now = self.now()
+        return {
+            "time": datetime.fromtimestamp(now, self.timezone).isoformat(),
+            "speed": self.speed,
+            "skip_closed": self.skip_closed,
+            "open": self.is_open(now),
+            "session_close": datetime.fromtimestamp(self.session_close(now), self.timezone).isoformat(),
+        }
+
+class Timer:
+    __slots__ = ("when", "callback", "args", "cancelled")
+
+    def __init__(self, when: float, callback: Callable, args: tuple):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class Scheduler:
+    """One heap of timers in market time, run by one task"""
+
+    def __init__(self, clock: MarketClock):
+        self.clock = clock
+        self._heap: List[Tuple[float, int, Timer]] = []
+        self._seq = itertools.count()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.fired = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def __len__(self):
+        return len(self._heap)
+
+    async def start(self):
+        """Start the scheduler task (no-op if it is already running)"""
+        if self.running:
+            return
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the task; timers that have not fired are dropped"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._heap.clear()
+
+    def call_at(self, when: float, callback: Callable, *args) -> Timer:
+        """Run ``callback(*args)`` at market time ``when``; coroutines are awaited"""
+        timer = Timer(when, callback, args)
+        heapq.heappush(self._heap, (when, next(self._seq), timer))
+        if self._wake is not None and self._heap[0][2] is timer:
+            self._wake.set()
+        return timer
+
+    def call_later(self, delay: float, callback: Callable, *args) -> Timer:
+        """Run ``callback(*args)`` after ``delay`` seconds of market time"""
+        return self.call_at(self.clock.now() + delay, callback, *args)
+
+    async def sleep_until(self, when: float):
+        """Wait until market time ``when``, in turn with the other timers"""
+        if not self.running:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        self.call_at(when, _resolve, future)
+        await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        heap = self._heap
+        while True:
+            if not heap:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            delay = self.clock.delay(heap[0][0])
+            if delay > 0:
+                self._wake.clear()
+                handle = loop.call_later(delay, self._wake.set)
+                await self._wake.wait()
+                handle.cancel()
+                continue
+            _, _, timer = heapq.heappop(heap)
+            if timer.cancelled:
+                continue
+            self.fired += 1
+            try:
+                result = timer.callback(*timer.args)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                logger.exception("Scheduled callback failed")
+
+    def stats(self) -> dict:
+        return {**self.clock.to_dict(), "timers": len(self._heap), "fired": self.fired}
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+def _clock_start() -> Optional[float]:
+    return datetime.fromisoformat(CLOCK_START).timestamp() if CLOCK_START else None
+
+market_clock = MarketClock(start=_clock_start())
+scheduler = Scheduler(market_clock)
@@ -0,0 +1,206 @@
+"""
+Trigger book for stop, stop-limit and trailing-stop orders of one symbol.
+
+An armed order waits off the order book until the market price reaches
+its trigger. It then goes to the book as a market order (stop, trailing
+stop) or as a limit order at its limit price (stop-limit).
+
+A sell stop triggers when the price falls to its stop and a buy stop when
+the price rises to it. Both sides are kept as "triggers when the price
+falls to" by working in signed prices, as BookSide does: the price for
+sells, the negated price for buys.
+
+Stops sit in a heap with the highest signed stop on top. A price check
+peeks at the top and pops only the stops the price has reached.
+
+A trailing stop follows the best price since it was armed (the high for
+a sell, the low for a buy) at a fixed distance, its trail. Trailing stops
+that have seen the same best price share a group:
+
+- Each group keeps its orders in a heap by trail, so its smallest trail
+  triggers first.
+- Groups sit in a heap by that first stop (best - smallest trail).
+- A new best price merges every group below it into one group at that
+  price. This moves all of their stops at once without touching the
+  orders.
+
+New orders join at the current price, so the groups form a stack with
+the lowest best on top, and merges only pop from the top. Merging moves
+the smaller group's orders into the larger one, so each order is moved
+O(log n) times in total. A price check therefore costs O(log n) per
+triggered order plus amortised merges, however many orders are armed.
+
+Cancelled orders are dropped lazily. Heap entries carry the token the
+order was armed with and are skipped once it no longer matches. The
+heaps are compacted when more than half of their entries are dead.
+"""
+import heapq
+import itertools
+from typing import Dict, List, Tuple
+
+from services.order_book import BUY, OPEN, SELL, Order
+
+STOP, STOP_LIMIT, TRAILING_STOP = "stop", "stop_limit", "trailing_stop"
+STOP_TYPES = (STOP, STOP_LIMIT, TRAILING_STOP)
+
+# Dead heap entries tolerated before compacting
+COMPACT_MIN = 1024
+
+class TrailGroup:
+    __slots__ = ("best", "orders", "version")
+
+    def __init__(self, best: int):
+        # Best signed price seen by every order in the group
+        self.best = best
+        # Heap of (trail, token, order)
+        self.orders: List[Tuple[int, int, Order]] = []
+        # Bumped whenever the group's first stop changes, to spot stale heap entries
+        self.version = 0
+
+class TriggerSide:
+    """Armed orders of one side, in signed prices"""
+
+    def __init__(self, side: str, tokens: Dict[str, int]):
+        self.side = side
+        self._sign = -1 if side == BUY else 1
+        self._tokens = tokens
+        # Heap of (-signed stop, token, order)
+        self.stops: List[Tuple[int, int, Order]] = []
+        # Stack of trailing groups, lowest best on top
+        self.groups: List[TrailGroup] = []
+        # Heap of (-(best - smallest trail), entry number, version, group)
+        self._firsts: List[Tuple[int, int, int, TrailGroup]] = []
+        self._entries = itertools.count()
+        self.live = 0
+        self.dead = 0
+
+    def arm(self, order: Order, token: int, price: int):
+        self.live += 1
+        if order.trail is None:
+            heapq.heappush(self.stops, (-self._sign * order.stop_price, token, order))
+            return
+        signed = self._sign * price
+        self.follow(signed)
+        if self.groups and self.groups[-1].best == signed:
+            group = self.groups[-1]
+        else:
+            group = TrailGroup(signed)
+            self.groups.append(group)
+        first = group.orders[0][0] if group.orders else None
+        heapq.heappush(group.orders, (order.trail, token, order))
+        if first is None or order.trail < first:
+            self._push_first(group)
+
+    def _push_first(self, group: TrailGroup):
+        group.version += 1
+        if group.orders:
+            heapq.heappush(
+                self._firsts, (group.orders[0][0] - group.best, next(self._entries), group.version, group)
+            )
+
+    def follow(self, signed: int):
+        """Raise the best of every trailing group below ``signed`` to it"""
+        groups = self.groups
+        if not groups or groups[-1].best >= signed:
+            return
+        merged = groups.pop()
+        while groups and groups[-1].best < signed:
+            other = groups.pop()
+            if len(other.orders) > len(merged.orders):
+                merged, other = other, merged
+            for entry in other.orders:
+                heapq.heappush(merged.orders, entry)
+            # Entries for the absorbed group are stale now
+            other.version += 1
+        merged.best = signed
+        groups.append(merged)
+        self._push_first(merged)
+
+    def triggered(self, price: int) -> List[Order]:
+        """Pop the orders the price has reached, stops first"""
+        signed = self._sign * price
+        self.follow(signed)
+        tokens = self._tokens
+        orders = []
+        stops = self.stops
+        while stops and -stops[0][0] >= signed:
+            _, token, order = heapq.heappop(stops)
+            if tokens.get(order.id) == token:
+                orders.append(order)
+        firsts = self._firsts
+        while firsts and -firsts[0][0] >= signed:
+            _, _, version, group = heapq.heappop(firsts)
+            if version != group.version:
+                continue
+            reach = group.best - signed
+            while group.orders and group.orders[0][0] <= reach:
+                _, token, order = heapq.heappop(group.orders)
+                if tokens.get(order.id) == token:
+                    orders.append(order)
+            self._push_first(group)
+        self.live -= len(orders)
+        return orders
+
+    def cancelled(self):
+        self.live -= 1
+        self.dead += 1
+        if self.dead > max(self.live, COMPACT_MIN):
+            self.compact()
+
+    def compact(self):
+        """Drop the entries of cancelled orders from every heap"""
+        tokens = self._tokens
+
+        def alive(entry):
+            return tokens.get(entry[2].id) == entry[1]
+
+        self.stops = [entry for entry in self.stops if alive(entry)]
+        heapq.heapify(self.stops)
+        groups = []
+        for group in self.groups:
+            group.orders = [entry for entry in group.orders if alive(entry)]
+            if group.orders:
+                heapq.heapify(group.orders)
+                groups.append(group)
+        self.groups = groups
+        self._firsts = []
+        for group in groups:
+            self._push_first(group)
+        self.dead = 0
+
+class StopBook:
+    """Armed conditional orders for one symbol"""
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        # Order id -> token of its live heap entries
+        self.tokens: Dict[str, int] = {}
+        self._token_seq = itertools.count(1)
+        self.sides = {side: TriggerSide(side, self.tokens) for side in (BUY, SELL)}
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __contains__(self, order_id: str) -> bool:
+        return order_id in self.tokens
+
+    def arm(self, order: Order, price: int):
+        """Wait for ``order``'s trigger; ``price`` is the current price, where trailing stops start"""
+        token = self.tokens[order.id] = next(self._token_seq)
+        self.sides[order.side].arm(order, token, price)
+
+    def cancel(self, order: Order) -> bool:
+        if self.tokens.pop(order.id, None) is None:
+            return False
+        self.sides[order.side].cancelled()
+        return True
+
+    def triggered(self, price: int) -> List[Order]:
+        """Disarm and return the orders triggered at ``price``, in ticks"""
+        orders = []
+        for side in self.sides.values():
+            for order in side.triggered(price):
+                del self.tokens[order.id]
+                order.status = OPEN
+                orders.append(order)
+        return orders
@@ -0,0 +1,155 @@
+"""
+Append-only tick recordings.
+
+A recording is a small header followed by fixed-size records, one per
+tick, so the whole file can be memory-mapped as a NumPy structured array::
+
+    header: b"STKTICK1", u32 symbol count, u32 symbol table length,
+            f64 tick interval, newline-separated symbol table (UTF-8)
+    record: u64 seq, f64 unix timestamp, f64 prices[n], i64 volumes[n]
+
+Readers binary-search the timestamps, so the recorder drops a tick that is
+older than the last one recorded. The engine moves the market clock to
+the end of the recording before it starts ticking, so live ticks aren't.
+"""
+import asyncio
+import logging
+import os
+import struct
+from typing import AsyncIterator, List, Optional
+
+import numpy as np
+
+from services.tick_store import daily_bars
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"STKTICK1"
+HEADER = struct.Struct("<8sIId")
+
+def record_dtype(size: int) -> np.dtype:
+    return np.dtype([
+        ('seq', '<u8'),
+        ('timestamp', '<f8'),
+        ('prices', '<f8', (size,)),
+        ('volumes', '<i8', (size,)),
+    ])
+
+def read_header(path: str):
+    with open(path, "rb") as f:
+        magic, size, table_length, interval = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a tick recording")
+        symbols = f.read(table_length).decode().split("\n")
+    return symbols, interval, HEADER.size + table_length
+
+class TickRecorder:
+    """Appends every tick of the market feed to a recording file"""
+
+    def __init__(self, path: str, symbols: List[str], interval: float, flush_every: int = 10):
+        self.path = path
+        self.symbols = list(symbols)
+        self.flush_every = flush_every
+        self.dtype = record_dtype(len(self.symbols))
+        # Timestamp of the last record
+        self.last = -np.inf
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            recorded, _, offset = read_header(path)
+            if recorded != self.symbols:
+                raise ValueError(f"{path} was recorded with a different symbol universe")
+            count = (os.path.getsize(path) - offset) // self.dtype.itemsize
+            if count:
+                with open(path, "rb") as f:
+                    f.seek(offset + (count - 1) * self.dtype.itemsize)
+                    self.last = float(np.frombuffer(f.read(self.dtype.itemsize), dtype=self.dtype)['timestamp'][0])
+        else:
+            table = "\n".join(self.symbols).encode()
+            with open(path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, len(self.symbols), len(table), interval))
+                f.write(table)
+        self._file = open(path, "ab")
+        self._pending = 0
+        self._dropped = 0
+
+    def record(self, tick):
+        if tick.timestamp < self.last:
+            if self._dropped == 0:
+                logger.warning("Tick at %s is older than the end of %s; dropping ticks until the clock "
+                               "passes %s", tick.timestamp, self.path, self.last)
+            self._dropped += 1
+            return
+        self.last = tick.timestamp
+        record = np.empty(1, dtype=self.dtype)
+        record['seq'] = tick.seq
+        record['timestamp'] = tick.timestamp
+        record['prices'] = tick.prices
+        record['volumes'] = tick.volumes
+        self._file.write(record.tobytes())
+        self._pending += 1
+        if self._pending >= self.flush_every:
+            self.flush()
+
+    async def on_tick(self, tick):
+        self.record(tick)
+
+    def flush(self):
+        self._file.flush()
+        self._pending = 0
+
+    def close(self):
+        self._file.close()
+
+class TickRecording:
+    """Read-only, memory-mapped view of a recording file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.symbols, self.interval, self._offset = read_header(path)
+        self.symbol_ids = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.dtype = record_dtype(len(self.symbols))
+        self._records = None
+        self._mapped_size = -1
+        self.refresh()
+
+    def refresh(self):
+        """Re-map the file if a recorder appended to it since the last call"""
+        size = os.path.getsize(self.path)
+        if size == self._mapped_size:
+            return
+        count = (size - self._offset) // self.dtype.itemsize
+        if count > 0:
+            self._records = np.memmap(self.path, dtype=self.dtype, mode="r", offset=self._offset, shape=(count,))
+        else:
+            self._records = np.empty(0, dtype=self.dtype)
+        self._mapped_size = size
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    @property
+    def records(self) -> np.ndarray:
+        return self._records
+
+    def symbol_series(self, symbol: str):
+        """Timestamps, prices and volumes of one symbol across the recording"""
+        index = self.symbol_ids[symbol]
+        return self._records['timestamp'], self._records['prices'][:, index], self._records['volumes'][:, index]
+
+    def daily_ohlcv(self, symbol: str, start: float, end: float) -> List[dict]:
+        """Daily open/high/low/close/volume bars for ``symbol`` between two unix times"""
+        self.refresh()
+        if symbol not in self.symbol_ids or not len(self):
+            return []
+        timestamps, prices, volumes = self.symbol_series(symbol)
+        lo, hi = np.searchsorted(timestamps, [start, end])
+        return daily_bars(timestamps[lo:hi], prices[lo:hi], volumes[lo:hi])
+
+async def replay(recording: TickRecording, speed: Optional[float], start: int = 0) -> AsyncIterator[np.void]:
+    """Yield recorded records paced at ``speed`` x real time (None = as fast as possible)"""
+    previous = None
+    for record in recording.records[start:]:
+        if previous is not None:
+            gap = record['timestamp'] - previous
+            await asyncio.sleep(gap / speed if speed else 0)
+        previous = record['timestamp']
+        yield record
@@ -0,0 +1,183 @@
+"""
+Columnar, append-only tick store.
+
+Each symbol has its own directory with one flat binary file per column::
+
+    <root>/<SYMBOL>/timestamp.f8   unix seconds, float64
+    <root>/<SYMBOL>/price.f8       float64
+    <root>/<SYMBOL>/volume.i8      int64
+
+Ticks are buffered in memory and appended in batches on a background
+writer thread, so the event loop never waits on disk. Reads memory-map the
+columns, binary-search the timestamp column and return slices of the maps,
+so a time-range query costs O(log n) plus the size of the answer no matter
+how much history is stored. That needs the timestamps in order, so a tick
+older than the last one stored is dropped. The market clock resumes from
+``end`` on startup, so live ticks aren't; replays of older recordings are.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services.scheduler import market_clock
+
+logger = logging.getLogger(__name__)
+
+STORE_PATH = os.getenv("TICK_STORE_PATH", "data/ticks")
+FLUSH_EVERY = int(os.getenv("TICK_STORE_FLUSH_EVERY", "15"))
+
+COLUMNS = (("timestamp", "<f8"), ("price", "<f8"), ("volume", "<i8"))
+
+def ohlcv_buckets(timestamps: np.ndarray, prices: np.ndarray, volumes: np.ndarray,
+                  bucket_seconds: int = 86400):
+    """Group a tick series into OHLCV bars aligned to ``bucket_seconds``.
+
+    Returns parallel arrays (bucket start, open, high, low, close, volume).
+    """
+    if not len(timestamps):
+        empty = np.empty(0)
+        return empty, empty, empty, empty, empty, np.empty(0, dtype=np.int64)
+    buckets = (timestamps // bucket_seconds).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(buckets)] - 1
+    return (
+        buckets[starts] * bucket_seconds,
+        prices[starts],
+        np.maximum.reduceat(prices, starts),
+        np.minimum.reduceat(prices, starts),
+        prices[ends],
+        np.add.reduceat(volumes, starts),
+    )
+
+def daily_bars(timestamps: np.ndarray, prices: np.ndarray, volumes: np.ndarray) -> List[dict]:
+    """Daily OHLCV bars in the format returned by the history endpoint"""
+    starts, opens, highs, lows, closes, totals = ohlcv_buckets(timestamps, prices, volumes)
+    return [
+        {
+            "date": str(np.datetime64(int(start), 's').astype('datetime64[D]')),
+            "open": round(o, 2),
+            "high": round(h, 2),
+            "low": round(l, 2),
+            "close": round(c, 2),
+            "volume": v,
+        }
+        for start, o, h, l, c, v in zip(
+            starts.tolist(), opens.tolist(), highs.tolist(), lows.tolist(), closes.tolist(), totals.tolist()
+        )
+    ]
+
+class SymbolColumns:
+    """Memory-mapped columns of one symbol, re-mapped when the files grow"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.length = -1
+        self.columns: Dict[str, np.ndarray] = {}
+
+    def refresh(self):
+        path = os.path.join(self.directory, "timestamp.f8")
+        length = os.path.getsize(path) // 8 if os.path.exists(path) else 0
+        if length == self.length:
+            return
+        self.columns = {}
+        for name, dtype in COLUMNS:
+            column_path = os.path.join(self.directory, f"{name}.{dtype[1:]}")
+            if length:
+                self.columns[name] = np.memmap(column_path, dtype=dtype, mode="r", shape=(length,))
+            else:
+                self.columns[name] = np.empty(0, dtype=dtype)
+        self.length = length
+
+class TickStore:
+    """Per-symbol columnar tick history backed by append-only files"""
+
+    def __init__(self, root: str = STORE_PATH, flush_every: int = FLUSH_EVERY):
+        self.root = root
+        self.flush_every = flush_every
+        self._symbols: Optional[List[str]] = None
+        self._pending_timestamps: List[float] = []
+        self._pending_prices: List[np.ndarray] = []
+        self._pending_volumes: List[np.ndarray] = []
+        self._maps: Dict[str, SymbolColumns] = {}
+        # Timestamp of the newest tick stored or buffered; None until the first append
+        self._last: Optional[float] = None
+        self._dropped = 0
+        # A single writer thread keeps batches in order
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tick-store")
+
+    def append(self, tick):
+        """Buffer one tick of the whole universe; written out every ``flush_every`` ticks"""
+        if self._last is None:
+            self._last = self.end(tick.symbols)
+        if tick.timestamp < self._last:
+            if self._dropped == 0:
+                logger.warning("Tick at %s is older than the stored history; dropping ticks until the "
+                               "clock passes %s", tick.timestamp, self._last)
+            self._dropped += 1
+            return
+        self._last = tick.timestamp
+        self._symbols = tick.symbols
+        self._pending_timestamps.append(tick.timestamp)
+        self._pending_prices.append(tick.prices)
+        self._pending_volumes.append(tick.volumes)
+        if len(self._pending_timestamps) >= self.flush_every:
+            self._writer.submit(self._write, *self._take_batch())
+
+    def end(self, symbols: List[str]) -> float:
+        """The newest stored timestamp of any of ``symbols``"""
+        last = -np.inf
+        for symbol in symbols:
+            path = os.path.join(self.root, symbol, "timestamp.f8")
+            if os.path.exists(path) and os.path.getsize(path) >= 8:
+                with open(path, "rb") as f:
+                    f.seek(-8, os.SEEK_END)
+                    last = max(last, float(np.frombuffer(f.read(8), dtype="<f8")[0]))
+        return last
+
+    def flush(self):
+        """Write out everything buffered and wait for it to hit the files"""
+        self._writer.submit(self._write, *self._take_batch()).result()
+
+    def _take_batch(self):
+        batch = (self._symbols, self._pending_timestamps, self._pending_prices, self._pending_volumes)
+        self._pending_timestamps, self._pending_prices, self._pending_volumes = [], [], []
+        return batch
+
+    def _write(self, symbols, timestamps, prices, volumes):
+        if not timestamps:
+            return
+        timestamps = np.asarray(timestamps, dtype="<f8").tobytes()
+        # Transpose to symbol-major so each symbol's batch is one contiguous write
+        prices = np.ascontiguousarray(np.vstack(prices).T, dtype="<f8")
+        volumes = np.ascontiguousarray(np.vstack(volumes).T, dtype="<i8")
+        for index, symbol in enumerate(symbols):
+            directory = os.path.join(self.root, symbol)
+            os.makedirs(directory, exist_ok=True)
+            # Timestamp goes last: readers size the columns from it
+            for name, data in (("price.f8", prices[index]), ("volume.i8", volumes[index]),
+                               ("timestamp.f8", timestamps)):
+                with open(os.path.join(directory, name), "ab") as f:
+                    f.write(data if isinstance(data, bytes) else data.tobytes())
+
+    def query(self, symbol: str, start: float = 0.0, end: float = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Timestamps, prices and volumes of ``symbol`` in [start, end).
+
+        The arrays are views into the memory-mapped files, not copies.
+        """
+        if end is None:
+            end = market_clock.now() + 1
+        columns = self._maps.get(symbol)
+        if columns is None:
+            columns = self._maps[symbol] = SymbolColumns(os.path.join(self.root, symbol))
+        columns.refresh()
+        timestamps = columns.columns["timestamp"]
+        lo, hi = np.searchsorted(timestamps, [start, end])
+        return timestamps[lo:hi], columns.columns["price"][lo:hi], columns.columns["volume"][lo:hi]
+
+    def daily_bars(self, symbol: str, start: float, end: float = None) -> List[dict]:
+        return daily_bars(*self.query(symbol, start, end))
+
+tick_store = TickStore()
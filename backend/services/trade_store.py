@@ -0,0 +1,287 @@
+"""
+Executed trades per user, indexed for history queries.
+
+Trade ids are snowflakes: 41 bits of milliseconds since ``EPOCH``, 10 bits
+of worker id and 12 bits of sequence within the millisecond. They never
+collide across workers and they sort by time, so a time range is an id
+range and the id is the pagination cursor. Each worker leases its id by
+holding a lock file in ``WORKER_LOCK_DIR``, so workers on one host never
+share one; set ``WORKER_ID`` per host when several hosts share the table.
+
+The trades this worker records are kept in memory per user, oldest first,
+in one index over all of them plus one per symbol and one per side. An
+index is a list of ids next to the list of trades, so a page is a bisect
+to the cursor plus a slice. Its cost depends on the page size, not on how
+many trades exist. Each user keeps their latest ``TRADE_INDEX_SIZE``
+trades. Older pages, and trades from before this worker started, come
+from the ``trades`` table through its (user_id, ..., id) indexes.
+
+Rows reach the table write-behind: one batch per ``flush``, written on a
+background thread. A batch the table rejects is retried row by row, so one
+bad row costs only itself.
+"""
+import asyncio
+import fcntl
+import logging
+import os
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from database import SessionLocal
+from models.trade import Trade
+
+logger = logging.getLogger(__name__)
+
+# 2024-01-01T00:00:00Z in milliseconds
+EPOCH = 1_704_067_200_000
+WORKER_BITS, SEQUENCE_BITS = 10, 12
+WORKER_LOCK_DIR = os.getenv("WORKER_LOCK_DIR", "/tmp")
+
+_worker_lock = None
+
+def lease_worker_id(directory: str = WORKER_LOCK_DIR) -> int:
+    """The first worker id whose lock file nobody else holds.
+
+    The lock is held for the life of the process, so the id is free again
+    once the worker exits.
+    """
+    global _worker_lock
+    for worker in range(1 << WORKER_BITS):
+        lock_file = open(os.path.join(directory, f"stock-simulator-worker-{worker}.lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            continue
+        _worker_lock = lock_file
+        return worker
+    raise RuntimeError(f"All {1 << WORKER_BITS} worker ids in {directory} are taken")
+
+if "WORKER_ID" in os.environ:
+    WORKER_ID = int(os.environ["WORKER_ID"]) % (1 << WORKER_BITS)
+else:
+    WORKER_ID = lease_worker_id()
+
+TRADE_INDEX_SIZE = int(os.getenv("TRADE_INDEX_SIZE", "10000"))
+
+def id_at(timestamp: float) -> int:
+    """The smallest id issued at or after ``timestamp``"""
+    return max(int(timestamp * 1000) - EPOCH, 0) << (WORKER_BITS + SEQUENCE_BITS)
+
+class SnowflakeIds:
+    def __init__(self, worker: int = WORKER_ID, clock: Callable[[], float] = time.time):
+        self.worker = worker
+        self.clock = clock
+        self._last = -1
+        self._sequence = 0
+
+    def next(self) -> int:
+        # A clock that steps back stays on the last millisecond
+        millis = max(int(self.clock() * 1000) - EPOCH, self._last)
+        if millis == self._last:
+            self._sequence = (self._sequence + 1) & ((1 << SEQUENCE_BITS) - 1)
+            if not self._sequence:
+                # 4096 ids this millisecond; carry on in the next one
+                millis += 1
+        else:
+            self._sequence = 0
+        self._last = millis
+        return (millis << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker << SEQUENCE_BITS) | self._sequence
+
+class TradeRecord:
+    __slots__ = ("id", "user_id", "order_id", "symbol", "side", "quantity", "price", "timestamp")
+
+    def __init__(self, id: int, user_id, order_id: str, symbol: str, side: str, quantity: int,
+                 price: float, timestamp: float):
+        self.id = id
+        self.user_id = user_id
+        self.order_id = order_id
+        self.symbol = symbol
+        self.side = side
+        self.quantity = quantity
+        self.price = price
+        self.timestamp = timestamp
+
+    @property
+    def total(self) -> float:
+        return round(self.price * self.quantity, 2)
+
+    def to_row(self) -> dict:
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "order_id": self.order_id,
+            "symbol": self.symbol,
+            "side": self.side,
+            "quantity": self.quantity,
+            "price": Decimal(str(self.price)),
+            "total": Decimal(str(self.total)),
+            "executed_at": datetime.fromtimestamp(self.timestamp).astimezone(),
+        }
+
+    @classmethod
+    def from_row(cls, row: Trade) -> "TradeRecord":
+        return cls(row.id, row.user_id, row.order_id, row.symbol, row.side, row.quantity,
+                   float(row.price), row.executed_at.timestamp())
+
+class TradeIndex:
+    """Trades in id order with their ids alongside for bisecting"""
+    __slots__ = ("ids", "trades")
+
+    def __init__(self):
+        self.ids: List[int] = []
+        self.trades: List[TradeRecord] = []
+
+    def append(self, trade: TradeRecord):
+        self.ids.append(trade.id)
+        self.trades.append(trade)
+
+    def page(self, lo: int, hi: int, limit: int,
+             keep: Optional[Callable[[TradeRecord], bool]] = None) -> List[TradeRecord]:
+        """Up to ``limit`` trades with ``lo <= id < hi``, newest first"""
+        start, end = bisect_left(self.ids, lo), bisect_left(self.ids, hi)
+        if keep is None:
+            return self.trades[max(start, end - limit):end][::-1]
+        result = []
+        for i in range(end - 1, start - 1, -1):
+            if keep(self.trades[i]):
+                result.append(self.trades[i])
+                if len(result) == limit:
+                    break
+        return result
+
+    def trim(self, floor: int):
+        """Drop the trades below ``floor``"""
+        cut = bisect_left(self.ids, floor)
+        del self.ids[:cut]
+        del self.trades[:cut]
+
+class UserTrades:
+    __slots__ = ("all", "by_symbol", "by_side", "floor")
+
+    def __init__(self, floor: int):
+        self.all = TradeIndex()
+        self.by_symbol: Dict[str, TradeIndex] = {}
+        self.by_side: Dict[str, TradeIndex] = {}
+        # Every trade of this worker's from ``floor`` up is in memory
+        self.floor = floor
+
+class TradeStore:
+    """In-memory per-user trade indexes over a write-behind ``trades`` table"""
+
+    def __init__(self, index_size: int = TRADE_INDEX_SIZE, persist: bool = True,
+                 ids: SnowflakeIds = None):
+        self.index_size = index_size
+        self.persist = persist
+        self.ids = ids or SnowflakeIds()
+        # Trades with smaller ids were recorded before this worker started
+        self.started = id_at(time.time())
+        self.users: Dict[object, UserTrades] = {}
+        self._pending: List[dict] = []
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trade-store")
+
+    def record(self, user_id, order_id: str, symbol: str, side: str, quantity: int,
+               price: float, timestamp: float) -> TradeRecord:
+        trade = TradeRecord(self.ids.next(), user_id, order_id, symbol, side, quantity, price, timestamp)
+        user = self.users.get(user_id)
+        if user is None:
+            user = self.users[user_id] = UserTrades(self.started)
+        user.all.append(trade)
+        user.by_symbol.setdefault(symbol, TradeIndex()).append(trade)
+        user.by_side.setdefault(side, TradeIndex()).append(trade)
+        if len(user.all.ids) > self.index_size:
+            # Keep the newest half so trimming is amortised over many trades
+            user.floor = user.all.ids[len(user.all.ids) - self.index_size // 2]
+            for index in (user.all, *user.by_symbol.values(), *user.by_side.values()):
+                index.trim(user.floor)
+        if self.persist:
+            self._pending.append(trade.to_row())
+        return trade
+
+    def flush(self):
+        """Queue the trades recorded since the last flush for the table"""
+        if self._pending:
+            rows, self._pending = self._pending, []
+            self._writer.submit(self._write, rows)
+
+    def wait(self):
+        self.flush()
+        self._writer.submit(lambda: None).result()
+
+    def _write(self, rows: List[dict]):
+        try:
+            with SessionLocal() as session:
+                session.execute(insert(Trade), rows)
+                session.commit()
+        except IntegrityError:
+            logger.warning("Batch of %d trades rejected, writing them one by one", len(rows), exc_info=True)
+            for row in rows:
+                self._write_row(row)
+        except SQLAlchemyError:
+            logger.warning("Could not write %d trades", len(rows), exc_info=True)
+
+    def _write_row(self, row: dict):
+        try:
+            with SessionLocal() as session:
+                session.execute(insert(Trade), [row])
+                session.commit()
+        except SQLAlchemyError:
+            logger.warning("Could not write trade %s", row["id"], exc_info=True)
+
+    async def query(self, user_id, symbol: Optional[str] = None, side: Optional[str] = None,
+                    start: Optional[float] = None, end: Optional[float] = None,
+                    before: Optional[int] = None, limit: int = 50) -> Tuple[List[TradeRecord], Optional[int]]:
+        """A page of the user's trades, newest first, and the cursor for the next page.
+
+        ``before`` is the cursor of the previous page; ``start`` and ``end``
+        bound the trade time. The cursor is None on the last page.
+        """
+        lo = 0 if start is None else id_at(start)
+        hi = 1 << 63 if end is None else id_at(end)
+        if before is not None:
+            hi = min(hi, before)
+
+        user = self.users.get(user_id)
+        floor = self.started if user is None else user.floor
+        trades = []
+        if user is not None and hi > max(lo, floor):
+            keep = None
+            if symbol is not None:
+                index = user.by_symbol.get(symbol)
+                if side is not None:
+                    keep = lambda trade: trade.side == side
+            elif side is not None:
+                index = user.by_side.get(side)
+            else:
+                index = user.all
+            if index is not None:
+                trades = index.page(max(lo, floor), hi, limit, keep)
+        if len(trades) < limit and lo < floor and self.persist:
+            trades += await asyncio.to_thread(
+                self._load, user_id, symbol, side, lo, min(hi, floor), limit - len(trades)
+            )
+        return trades, trades[-1].id if len(trades) == limit else None
+
+    def _load(self, user_id, symbol: Optional[str], side: Optional[str], lo: int, hi: int,
+              limit: int) -> List[TradeRecord]:
+        statement = select(Trade).where(Trade.user_id == user_id, Trade.id >= lo, Trade.id < hi)
+        if symbol is not None:
+            statement = statement.where(Trade.symbol == symbol)
+        if side is not None:
+            statement = statement.where(Trade.side == side)
+        statement = statement.order_by(Trade.id.desc()).limit(limit)
+        try:
+            with SessionLocal() as session:
+                return [TradeRecord.from_row(row) for row in session.scalars(statement)]
+        except SQLAlchemyError:
+            logger.warning("Could not read trades for user %s", user_id, exc_info=True)
+            return []
+
+trade_store = TradeStore()
@@ -1,9 +1,37 @@
+from sqlalchemy import select, tuple_
 from sqlalchemy.orm import Session
+from database import SessionLocal
 from models.user import User, WalletTransaction
 from schemas.user import UserCreate, WalletUpdate
 from auth import get_password_hash, verify_password
 from fastapi import HTTPException, status
+from datetime import datetime
 from decimal import Decimal
+from typing import Iterator, List, Optional, Tuple
+import base64
+import csv
+import io
+import json
+
+# Rows fetched per round trip when exporting a ledger
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_COLUMNS = ("id", "created_at", "transaction_type", "amount", "balance_after", "description")
+
+def encode_cursor(transaction: WalletTransaction) -> str:
+    """Opaque keyset cursor: the (created_at, id) of the last row of a page"""
+    key = f"{transaction.created_at.isoformat()}|{transaction.id}"
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        created_at, id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
 
 class UserService:
     def __init__(self, db: Session):
@@ -100,14 +128,26 @@ class UserService:
 
         return transaction
 
-    def get_wallet_transactions(self, user_id: int, limit: int = 10):
-        return (
-            self.db.query(WalletTransaction)
-            .filter(WalletTransaction.user_id == user_id)
-            .order_by(WalletTransaction.created_at.desc())
+    def get_wallet_transactions(self, user_id: int, limit: int = 10,
+                                cursor: Optional[str] = None) -> Tuple[List[WalletTransaction], Optional[str]]:
+        """A page of the user's transactions, newest first, and the cursor for the next one.
+
+        Pages seek past the cursor on the (user_id, created_at, id) index
+        instead of using an offset, so every page costs the same.
+        """
+        query = self.db.query(WalletTransaction).filter(WalletTransaction.user_id == user_id)
+        if cursor is not None:
+            query = query.filter(
+                tuple_(WalletTransaction.created_at, WalletTransaction.id) < tuple_(*decode_cursor(cursor))
+            )
+        transactions = (
+            query
+            .order_by(WalletTransaction.created_at.desc(), WalletTransaction.id.desc())
             .limit(limit)
             .all()
         )
+        next_cursor = encode_cursor(transactions[-1]) if len(transactions) == limit else None
+        return transactions, next_cursor
 
     def _create_wallet_transaction(self, user_id: int, transaction_type: str, amount: Decimal, balance_after: Decimal, description: str = None):
         transaction = WalletTransaction(
@@ -121,3 +161,35 @@ class UserService:
         self.db.commit()
         self.db.refresh(transaction)
         return transaction
+
+def export_wallet_transactions(user_id: int, format: str = "ndjson") -> Iterator[str]:
+    """Stream a user's whole ledger, oldest first, as NDJSON or CSV.
+
+    Rows come off a server-side cursor ``EXPORT_BATCH_SIZE`` at a time as
+    plain column tuples (no ORM identity map), and each batch is written
+    out as one chunk, so memory stays flat however long the ledger is. The
+    generator runs after the request's session is gone, so it opens its own.
+    """
+    statement = (
+        select(*(getattr(WalletTransaction, column) for column in EXPORT_COLUMNS))
+        .where(WalletTransaction.user_id == user_id)
+        .order_by(WalletTransaction.created_at, WalletTransaction.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if format == "csv":
+        writer.writerow(EXPORT_COLUMNS)
+    with SessionLocal() as db:
+        for batch in db.execute(statement).partitions():
+            for id, created_at, transaction_type, amount, balance_after, description in batch:
+                row = (id, created_at.isoformat(), transaction_type, str(amount), str(balance_after), description)
+                if format == "csv":
+                    writer.writerow(row)
+                else:
+                    buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + "\n")
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,180 @@
+"""
+Mark-to-market of every portfolio on every tick.
+
+The position book is turned into a sparse users x symbols matrix of
+quantities (CSR), and per-user vectors of cost basis (sum of quantity x
+average cost) and realized P&L. Those are rebuilt only when positions
+have changed since the last tick. A tick is then one sparse
+matrix-vector product with the price vector:
+
+    market_value = Q @ prices
+    unrealized   = market_value - cost_basis
+    total        = unrealized + realized
+
+Users connected over WebSocket are watched. After each tick, every
+watched user whose figures moved by at least a cent gets a
+``portfolio_update`` with just the figures that changed, e.g.
+
+    {"type": "portfolio_update", "seq": 1042, "unrealized_pnl": -12.5,
+     "total_pnl": 3.25}
+
+``snapshot`` gives all of them, for a client that just connected.
+"""
+import logging
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+from scipy import sparse
+
+from services.positions import PositionBook, position_book
+
+logger = logging.getLogger(__name__)
+
+FIGURES = ("market_value", "unrealized_pnl", "realized_pnl", "total_pnl")
+
+PortfolioListener = Callable[[Dict[object, dict]], Awaitable[None]]
+
+class ValuationEngine:
+    """Values every user's positions at once and reports what moved for watched users"""
+
+    def __init__(self, positions: PositionBook = position_book):
+        self.positions = positions
+        self._version = None
+        self.quantities = sparse.csr_matrix((0, len(positions.symbols)))
+        self.cost_basis = np.zeros(0)
+        self.realized = np.zeros(0)
+        # (figures, users) as of the last tick, and as last pushed to each user
+        self.figures = np.zeros((len(FIGURES), 0))
+        self._pushed = np.full((len(FIGURES), 0), np.nan)
+        self.seq = None
+        self._prices: Optional[np.ndarray] = None
+        self._watched = Counter()
+        # Position-book indices of the watched users; None when it needs rebuilding
+        self._watched_indices: Optional[np.ndarray] = None
+        self._listeners: List[PortfolioListener] = []
+
+    def add_listener(self, listener: PortfolioListener):
+        """Register a coroutine called with {user id: portfolio_update} after each tick"""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def watch(self, user_id):
+        self._watched[user_id] += 1
+        self._watched_indices = None
+
+    def unwatch(self, user_id):
+        self._watched[user_id] -= 1
+        if self._watched[user_id] <= 0:
+            del self._watched[user_id]
+        self._watched_indices = None
+
+    def _rebuild(self):
+        """Re-derive the matrix and vectors from the position book"""
+        book = self.positions
+        rows = slice(0, book.size)
+        users = len(book.users)
+        self.quantities = sparse.csr_matrix(
+            (book.quantity[rows].astype(np.float64), (book.user_index[rows], book.symbol_index[rows])),
+            shape=(users, len(book.symbols)),
+        )
+        self.cost_basis = np.bincount(
+            book.user_index[rows], weights=book.quantity[rows] * book.average_cost[rows], minlength=users
+        )
+        self.realized = np.bincount(book.user_index[rows], weights=book.realized[rows], minlength=users)
+        if users > self._pushed.shape[1]:
+            grown = np.full((len(FIGURES), users), np.nan)
+            grown[:, :self._pushed.shape[1]] = self._pushed
+            self._pushed = grown
+            # Watched users may have just traded for the first time
+            self._watched_indices = None
+        self._version = book.version
+
+    def revalue(self, prices: np.ndarray) -> np.ndarray:
+        """(figures, users) for every user at ``prices``, rounded to cents"""
+        if self._version != self.positions.version:
+            self._rebuild()
+        market_value = self.quantities @ prices
+        unrealized = market_value - self.cost_basis
+        self.figures = np.round(np.stack([
+            market_value, unrealized, self.realized, unrealized + self.realized
+        ]), 2)
+        return self.figures
+
+    def changes(self) -> Dict[object, dict]:
+        """``portfolio_update`` messages for the watched users whose figures moved"""
+        if not self._watched:
+            return {}
+        book = self.positions
+        indices = self._watched_indices
+        if indices is None:
+            indices = self._watched_indices = np.array([
+                book.user_ids[user_id] for user_id in self._watched if user_id in book.user_ids
+            ], dtype=np.intp)
+        if not len(indices):
+            return {}
+        current = self.figures[:, indices]
+        moved = current != self._pushed[:, indices]
+        users = np.flatnonzero(moved.any(axis=0))
+        indices = indices[users]
+        self._pushed[:, indices] = current[:, users]
+        messages = {}
+        # Plain lists from here: per-user NumPy indexing would dominate
+        for index, values, flags in zip(indices.tolist(), (current[:, users] + 0.0).T.tolist(),
+                                        moved[:, users].T.tolist()):
+            message = {"type": "portfolio_update", "seq": self.seq}
+            for name, value, flag in zip(FIGURES, values, flags):
+                if flag:
+                    message[name] = value
+            messages[book.users[index]] = message
+        return messages
+
+    def current(self) -> np.ndarray:
+        """(figures, users) at the last tick's prices, including fills since that tick"""
+        if self._prices is not None and self._version != self.positions.version:
+            self.revalue(self._prices)
+        return self.figures
+
+    def baseline(self) -> np.ndarray:
+        """(market value, total P&L) per user of the positions as loaded, at the last tick's prices"""
+        book = self.positions
+        quantity, average_cost, realized = book.baseline
+        users = book.user_index[:len(quantity)]
+        figures = np.zeros((2, len(book.users)))
+        if self._prices is None or not len(quantity):
+            return figures
+        market_value = quantity * self._prices[book.symbol_index[:len(quantity)]]
+        figures[0] = np.bincount(users, weights=market_value, minlength=len(book.users))
+        figures[1] = np.bincount(
+            users, weights=market_value - quantity * average_cost + realized, minlength=len(book.users)
+        )
+        return np.round(figures, 2)
+
+    def snapshot(self, user_id) -> dict:
+        """Every figure for one user at the last tick's prices, and mark them pushed"""
+        self.current()
+        message = {"type": "portfolio_update", "seq": self.seq, "snapshot": True}
+        index = self.positions.user_ids.get(user_id)
+        if index is None or index >= self.figures.shape[1]:
+            message.update({name: 0.0 for name in FIGURES})
+            return message
+        self._pushed[:, index] = self.figures[:, index]
+        message.update({name: float(value) + 0.0 for name, value in zip(FIGURES, self.figures[:, index])})
+        return message
+
+    async def on_tick(self, tick):
+        self.seq = tick.seq
+        self._prices = tick.prices
+        self.revalue(tick.prices)
+        if not self._listeners:
+            return
+        messages = self.changes()
+        if not messages:
+            return
+        for listener in self._listeners:
+            try:
+                await listener(messages)
+            except Exception:
+                logger.exception("Portfolio listener failed")
+
+valuation_engine = ValuationEngine()
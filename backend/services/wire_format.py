@@ -0,0 +1,135 @@
+"""
+Wire formats for the /ws price feed.
+
+Clients pick an encoding when they connect (``/ws?encoding=binary``):
+
+json (default)
+    ``{"type": "price_update", "snapshot": false, "data": {"AAPL": {"price": ..., "change": ...}}}``
+    sent as a text frame. ``snapshot`` is true when the frame carries every
+    symbol the client is subscribed to rather than only the ones that changed.
+
+binary
+    The client first receives a JSON ``symbol_table`` message mapping symbol
+    ids to tickers. Price updates are then binary frames made of a header
+    followed by one fixed-size entry per symbol, all little-endian::
+
+        header: u8 message type, u32 entry count, f64 unix timestamp
+        entry:  u32 symbol id, i64 price, i64 change
+
+    The message type is ``MSG_PRICE_UPDATE`` for deltas and
+    ``MSG_PRICE_SNAPSHOT`` for snapshots. Prices and changes are fixed-point
+    integers scaled by ``PRICE_SCALE``.
+"""
+import json
+import struct
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+ENCODINGS = ("json", "binary")
+
+PRICE_SCALE = 10_000
+
+MSG_PRICE_UPDATE = 1
+MSG_PRICE_SNAPSHOT = 2
+
+HEADER = struct.Struct("<BId")
+PRICE_ENTRY = struct.Struct("<Iqq")
+
+def to_fixed(value: float) -> int:
+    return int(round(value * PRICE_SCALE))
+
+def symbol_table_message(symbols: List[str]) -> str:
+    """JSON message telling binary clients which id maps to which symbol"""
+    return json.dumps({
+        'type': 'symbol_table',
+        'encoding': 'binary',
+        'price_scale': PRICE_SCALE,
+        'symbols': symbols,
+    })
+
+def decode_prices_binary(frame: bytes, symbols: List[str]) -> Dict[str, dict]:
+    """Inverse of the binary price encoding, mainly for clients and benchmarks"""
+    _, count, _ = HEADER.unpack_from(frame, 0)
+    data = {}
+    for symbol_id, price, change in PRICE_ENTRY.iter_unpack(frame[HEADER.size:HEADER.size + count * PRICE_ENTRY.size]):
+        data[symbols[symbol_id]] = {'price': price / PRICE_SCALE, 'change': change / PRICE_SCALE}
+    return data
+
+BINARY_ENTRY_DTYPE = np.dtype([('id', '<u4'), ('price', '<i8'), ('change', '<i8')])
+
+class PriceFrame:
+    """One price tick, encoded lazily.
+
+    Each symbol's JSON fragment and binary entry is encoded at most once per
+    tick, so per-client frames for different subscription sets are built by
+    joining cached pieces. Frames covering everything that changed (or the
+    whole universe, for snapshots) are cached whole and shared by every
+    client subscribed to the full universe; their binary form is packed in
+    one vectorised pass.
+    """
+
+    def __init__(self, tick):
+        self.tick = tick
+        self._fragments = {"json": {}, "binary": {}}
+        self._full = {}
+
+    def encode(self, encoding: str, symbols: Iterable[str] = None, snapshot: bool = False):
+        """Encode the given symbols (default: everything that changed this tick)"""
+        if symbols is None:
+            key = (encoding, snapshot)
+            frame = self._full.get(key)
+            if frame is None:
+                indices = np.arange(len(self.tick.symbols)) if snapshot else self.tick.changed
+                if encoding == "binary":
+                    frame = self._pack_binary(indices, snapshot)
+                else:
+                    frame = self._dump_json(indices, snapshot)
+                self._full[key] = frame
+            return frame
+        symbol_ids = self.tick.symbol_ids
+        return self._join(encoding, [symbol_ids[symbol] for symbol in symbols], snapshot)
+
+    def _header(self, count: int, snapshot: bool) -> bytes:
+        return HEADER.pack(MSG_PRICE_SNAPSHOT if snapshot else MSG_PRICE_UPDATE, count, self.tick.timestamp)
+
+    def _pack_binary(self, indices, snapshot: bool) -> bytes:
+        entries = np.empty(len(indices), dtype=BINARY_ENTRY_DTYPE)
+        entries['id'] = indices
+        entries['price'] = np.rint(self.tick.prices[indices] * PRICE_SCALE)
+        entries['change'] = np.rint(self.tick.changes[indices] * PRICE_SCALE)
+        return self._header(len(indices), snapshot) + entries.tobytes()
+
+    def _dump_json(self, indices, snapshot: bool) -> str:
+        symbols = self.tick.symbols
+        prices = self.tick.prices[indices].tolist()
+        changes = self.tick.changes[indices].tolist()
+        return json.dumps({
+            'type': 'price_update',
+            'snapshot': snapshot,
+            'data': {
+                symbols[i]: {'price': price, 'change': change}
+                for i, price, change in zip(indices.tolist(), prices, changes)
+            }
+        })
+
+    def _join(self, encoding: str, indices, snapshot: bool):
+        fragments = [self._fragment(encoding, index) for index in indices]
+        if encoding == "binary":
+            return self._header(len(fragments), snapshot) + b"".join(fragments)
+        return (
+            '{"type": "price_update", "snapshot": ' + ('true' if snapshot else 'false')
+            + ', "data": {' + ', '.join(fragments) + '}}'
+        )
+
+    def _fragment(self, encoding: str, index: int):
+        cache = self._fragments[encoding]
+        fragment = cache.get(index)
+        if fragment is None:
+            quote = self.tick.quote(index)
+            if encoding == "binary":
+                fragment = PRICE_ENTRY.pack(int(index), to_fixed(quote['price']), to_fixed(quote['change']))
+            else:
+                fragment = json.dumps(self.tick.symbols[index]) + ': ' + json.dumps(quote)
+            cache[index] = fragment
+        return fragment
@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# Module-level stores open their directories on import; keep them out of the tree
+for name in ("TICK_STORE_PATH", "CANDLE_STORE_PATH"):
+    os.environ.setdefault(name, tempfile.mkdtemp(prefix=name.lower() + "-"))
+# A throwaway database unless one is configured
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp(prefix='database-')}/app.db")
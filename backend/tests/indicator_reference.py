@@ -0,0 +1,67 @@
+"""
+Straightforward pure-Python indicator loops: the reference the vectorised
+indicators are tested against, and the baseline bench_indicators times.
+"""
+import math
+
+def py_rsi(closes, period=14):
+    out = [math.nan] * len(closes)
+    gain = loss = 0.0
+    for i in range(1, len(closes)):
+        change = closes[i] - closes[i - 1]
+        up, down = max(change, 0.0), max(-change, 0.0)
+        if i <= period:
+            gain += up
+            loss += down
+            if i < period:
+                continue
+            gain /= period
+            loss /= period
+        else:
+            gain = (gain * (period - 1) + up) / period
+            loss = (loss * (period - 1) + down) / period
+        out[i] = 100.0 if loss == 0 else 100 - 100 / (1 + gain / loss)
+    return out
+
+def py_ema(values, period):
+    alpha = 2.0 / (period + 1)
+    out, current = [], values[0]
+    for value in values:
+        current = alpha * value + (1 - alpha) * current
+        out.append(current)
+    return out
+
+def py_macd(closes, fast=12, slow=26, signal=9):
+    line = [f - s for f, s in zip(py_ema(closes, fast), py_ema(closes, slow))]
+    signal_line = py_ema(line, signal)
+    return line, signal_line, [l - s for l, s in zip(line, signal_line)]
+
+def py_bollinger(closes, period=20, width=2.0):
+    upper, middle, lower = [], [], []
+    for i in range(len(closes)):
+        if i < period - 1:
+            upper.append(math.nan)
+            middle.append(math.nan)
+            lower.append(math.nan)
+            continue
+        window = closes[i - period + 1:i + 1]
+        mean = sum(window) / period
+        std = math.sqrt(sum((x - mean) ** 2 for x in window) / period)
+        upper.append(mean + width * std)
+        middle.append(mean)
+        lower.append(mean - width * std)
+    return upper, middle, lower
+
+def py_atr(highs, lows, closes, period=14):
+    out = [math.nan] * len(closes)
+    total = average = 0.0
+    for i in range(len(closes)):
+        true_range = highs[i] - lows[i]
+        if i:
+            true_range = max(true_range, abs(highs[i] - closes[i - 1]), abs(lows[i] - closes[i - 1]))
+        if i < period - 1:
+            total += true_range
+            continue
+        average = (total + true_range) / period if i == period - 1 else (average * (period - 1) + true_range) / period
+        out[i] = average
+    return out
@@ -0,0 +1,153 @@
+"""
+Cross-worker fan-out over the Unix-socket backplane.
+
+Starts several uvicorn workers as separate processes sharing one
+backplane socket and one SQLite database, connects a WebSocket client to
+each, then places a trade through a worker that is not the hub. Every
+client must see the leader's price ticks and the trade print. Trades
+through two workers must add up in the one stored position.
+"""
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+import httpx
+import pytest
+from websockets.sync.client import connect
+
+BACKEND = Path(__file__).resolve().parent.parent
+WORKERS = 3
+TIMEOUT = 30.0
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_until(check, timeout: float = TIMEOUT, message: str = "condition"):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            result = check()
+        except (httpx.HTTPError, OSError):
+            result = None
+        if result:
+            return result
+        time.sleep(0.1)
+    raise AssertionError(f"Timed out waiting for {message}")
+
+@pytest.fixture
+def workers(tmp_path):
+    env = {
+        **os.environ,
+        "PUBSUB_BACKEND": "unix",
+        # Short path: Unix socket paths are limited to about 100 bytes
+        "PUBSUB_SOCKET_PATH": f"/tmp/bus-test-{os.getpid()}.sock",
+        "DATABASE_URL": f"sqlite:///{tmp_path / 'app.db'}",
+        "TICK_STORE_PATH": str(tmp_path / "ticks"),
+        "CANDLE_STORE_PATH": str(tmp_path / "candles"),
+        "MARKET_SEED": "7",
+        "MARKET_TICK_INTERVAL": "0.2",
+        "PORTFOLIO_SNAPSHOT_INTERVAL": "3600",
+    }
+    ports, processes, logs = [], [], []
+    try:
+        for i in range(WORKERS):
+            port = free_port()
+            log = open(tmp_path / f"worker-{i}.log", "w")
+            logs.append(log)
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                cwd=BACKEND, env=env, stdout=log, stderr=subprocess.STDOUT,
+            ))
+            ports.append(port)
+            # Staggered, so the first worker deterministically becomes the hub
+            wait_until(lambda: httpx.get(f"http://127.0.0.1:{port}/health").status_code == 200,
+                       message=f"worker {i} to start")
+        yield ports
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        for log in logs:
+            log.close()
+        for path in (env["PUBSUB_SOCKET_PATH"], env["PUBSUB_SOCKET_PATH"] + ".lock"):
+            if os.path.exists(path):
+                os.unlink(path)
+
+def receive_until(websocket, match, message: str):
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        event = json.loads(websocket.recv(timeout=deadline - time.monotonic()))
+        if match(event):
+            return event
+    raise AssertionError(f"Timed out waiting for {message}")
+
+def test_trade_on_one_worker_reaches_clients_on_every_worker(workers):
+    stats = [httpx.get(f"http://127.0.0.1:{port}/ws/stats").json() for port in workers]
+    assert len({s["pid"] for s in stats}) == WORKERS
+    assert [s["leader"] for s in stats] == [True] + [False] * (WORKERS - 1)
+
+    with ExitStack() as stack:
+        clients = [stack.enter_context(connect(f"ws://127.0.0.1:{port}/ws")) for port in workers]
+        for websocket in clients:
+            # A delta frame means the leader's ticks arrive through the backplane
+            receive_until(websocket, lambda e: e["type"] == "price_update" and not e["snapshot"], "a tick")
+
+        # Trade through the last worker, so the print goes through the hub to the others
+        api = f"http://127.0.0.1:{workers[-1]}"
+        user = {"username": "alice", "email": "alice@example.com", "password": "secret"}
+        assert httpx.post(f"{api}/auth/register", json=user).status_code == 200
+        token = httpx.post(f"{api}/auth/login", data=user).json()["access_token"]
+        response = httpx.post(f"{api}/trades/place-order", headers={"Authorization": f"Bearer {token}"}, json={
+            "symbol": "AAPL", "quantity": 7, "order_type": "buy", "price_type": "market",
+        })
+        assert response.status_code == 200 and response.json()["filled_quantity"] == 7
+
+        for websocket in clients:
+            trade = receive_until(
+                websocket, lambda e: e["type"] == "trade" and e["symbol"] == "AAPL", "the trade print"
+            )
+            assert trade["side"] == "buy" and trade["quantity"] == 7
+
+def test_positions_add_up_across_workers(workers, tmp_path):
+    from services.positions import book_fill
+
+    user = {"username": "bob", "email": "bob@example.com", "password": "secret"}
+    assert httpx.post(f"http://127.0.0.1:{workers[0]}/auth/register", json=user).status_code == 200
+    token = httpx.post(f"http://127.0.0.1:{workers[0]}/auth/login", data=user).json()["access_token"]
+    database = sqlite3.connect(tmp_path / "app.db")
+
+    def stored():
+        return database.execute(
+            "SELECT quantity, average_cost, realized_pnl FROM positions WHERE symbol = 'MSFT'"
+        ).fetchone()
+
+    # Alternate between two workers, each flush landing before the next fill
+    expected = (0, 0.0, 0.0)
+    for port, side, quantity in ((workers[1], "buy", 10), (workers[2], "buy", 5),
+                                 (workers[1], "sell", 8), (workers[2], "sell", 12)):
+        response = httpx.post(f"http://127.0.0.1:{port}/trades/place-order",
+                              headers={"Authorization": f"Bearer {token}"}, json={
+            "symbol": "MSFT", "quantity": quantity, "order_type": side, "price_type": "market",
+        })
+        assert response.status_code == 200 and response.json()["filled_quantity"] == quantity
+        expected = book_fill(*expected, quantity if side == "buy" else -quantity,
+                             float(response.json()["total"]) / quantity)
+        wait_until(lambda: stored() is not None and stored()[0] == expected[0],
+                   message=f"the position to reach {expected[0]}")
+
+    quantity, average_cost, realized = stored()
+    assert quantity == -5
+    assert float(average_cost) == pytest.approx(expected[1], abs=1e-4)
+    assert float(realized) == pytest.approx(expected[2], abs=1e-4)
@@ -0,0 +1,97 @@
+"""
+Indicator values against hand-computed series, the pure-Python loops in
+indicator_reference, and the streaming state against the bulk functions.
+"""
+import numpy as np
+import pytest
+
+from services.indicators import TechnicalState, atr, bollinger, ema, macd, rsi, sma, vwap, wilder
+from tests.indicator_reference import py_atr, py_bollinger, py_macd, py_rsi
+
+nan = np.nan
+
+def assert_close(actual, expected, atol=1e-12):
+    np.testing.assert_allclose(np.asarray(actual, dtype=np.float64), expected, rtol=0, atol=atol)
+
+def test_sma():
+    assert_close(sma([1, 2, 3, 4, 5], 2), [1.5, 2.5, 3.5, 4.5])
+    assert sma([1, 2], 3).shape == (0,)
+
+def test_ema_is_seeded_with_the_first_value():
+    # alpha = 2 / (3 + 1) = 0.5
+    assert_close(ema([1, 3, 7], 3), [1, 2, 4.5])
+
+def test_wilder_smoothing():
+    # Seed is the mean of the first 3, then (avg * 2 + x) / 3
+    assert_close(wilder([3, 6, 9, 12, 0], 3), [nan, nan, 6, 8, 16 / 3])
+
+def test_rsi():
+    # Changes +1 +1 -1 +1 +1: the seed averages are 2/3 and 1/3, so RS = 2;
+    # then gains 7/9, 23/27 over losses 2/9, 4/27
+    assert_close(rsi([1, 2, 3, 2, 3, 4], 3), [nan, nan, nan, 200 / 3, 700 / 9, 2300 / 27])
+
+def test_rsi_without_losses_is_100():
+    assert_close(rsi([1, 2, 3, 4, 5], 3), [nan, nan, nan, 100, 100])
+
+def test_macd():
+    # Slow EMA (alpha 0.5) of 2, 4, 8 is 2, 3, 5.5; the fast one (alpha 1) is the close
+    line, signal, histogram = macd([2, 4, 8], fast=1, slow=3, signal=3)
+    assert_close(line, [0, 1, 2.5])
+    assert_close(signal, [0, 0.5, 1.5])
+    assert_close(histogram, [0, 0.5, 1])
+
+def test_bollinger_uses_population_deviation():
+    # Windows [1, 3], [3, 3], [3, 7]: means 2, 3, 5 and deviations 1, 0, 2
+    upper, middle, lower = bollinger([1, 3, 3, 7], period=2, width=2)
+    assert_close(middle, [nan, 2, 3, 5])
+    assert_close(upper, [nan, 4, 3, 9])
+    assert_close(lower, [nan, 0, 3, 1])
+
+def test_atr():
+    # True ranges 2, max(1, |12 - 9|, |11 - 9|) = 3, max(1, |11 - 11.5|, |10 - 11.5|) = 1.5
+    assert_close(atr([10, 12, 11], [8, 11, 10], [9, 11.5, 10], period=2), [nan, 2.5, 2])
+
+def test_vwap():
+    assert_close(vwap([10, 20, 30], [10, 20, 30], [10, 20, 30], [1, 1, 2]), [10, 15, 22.5])
+
+@pytest.fixture
+def bars():
+    rng = np.random.default_rng(7)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, 2000)))
+    high = close * (1 + rng.random(2000) * 0.01)
+    low = close * (1 - rng.random(2000) * 0.01)
+    return close, high, low
+
+def test_matches_pure_python_reference(bars):
+    close, high, low = bars
+    assert_close(rsi(close), py_rsi(close.tolist()), atol=1e-9)
+    for fast, slow in zip(macd(close), py_macd(close.tolist())):
+        assert_close(fast, slow, atol=1e-9)
+    for fast, slow in zip(bollinger(close), py_bollinger(close.tolist())):
+        assert_close(fast, slow, atol=1e-9)
+    assert_close(atr(high, low, close), py_atr(high.tolist(), low.tolist(), close.tolist()), atol=1e-9)
+
+def test_matrix_rows_match_single_series(bars):
+    close, _, _ = bars
+    matrix = np.stack([close, close[::-1]])
+    assert_close(rsi(matrix)[1], rsi(close[::-1]))
+    assert_close(macd(matrix)[2][1], macd(close[::-1])[2])
+
+def test_streaming_state_matches_bulk_at_every_bar(bars):
+    close, high, low = bars
+    close, high, low = close[:300], high[:300], low[:300]
+    upper, middle, lower = bollinger(close)
+    line, signal, histogram = macd(close)
+    bulk = {
+        "rsi": rsi(close), "macd": line, "signal": signal, "histogram": histogram,
+        "upper": upper, "middle": middle, "lower": lower, "atr": atr(high, low, close),
+    }
+    state = TechnicalState(1)
+    for i in range(len(close)):
+        live = state.live(close[i:i + 1], high[i:i + 1], low[i:i + 1])
+        for name, values in bulk.items():
+            # The streaming bands use a running sum of squares, so they are
+            # only as exact as E[x^2] - mean^2 allows at these prices
+            tolerance = 1e-6 if name in ("upper", "lower") else 1e-9
+            assert_close(live[name], values[i:i + 1], atol=tolerance)
+        state.push(close[i:i + 1], high[i:i + 1], low[i:i + 1])
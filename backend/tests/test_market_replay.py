@@ -0,0 +1,38 @@
+"""
+Recording a seeded market and replaying it.
+"""
+import asyncio
+
+import numpy as np
+
+from services.market_data import MarketDataEngine
+from services.price_simulator import PriceSimulator
+from services.scheduler import MarketClock, Scheduler
+from services.tick_recorder import TickRecorder
+
+def test_replay_keeps_the_recorded_timestamps(tmp_path):
+    path = str(tmp_path / "session.rec")
+    start = 1_000_000_000
+    # A day of hourly ticks, far from the wall clock, nights included
+    engine = MarketDataEngine(PriceSimulator.with_universe(4, seed=3), interval=3600,
+                              scheduler=Scheduler(MarketClock(start=start, skip_closed=False)))
+    recorder = TickRecorder(path, engine.symbols, engine.interval)
+    recorder.record(engine.latest)
+    for hour in range(1, 25):
+        engine.clock.start = start + hour * 3600
+        recorder.record(engine.step())
+    recorder.close()
+
+    replayed = []
+
+    async def listener(tick):
+        replayed.append((tick.timestamp, tick.prices.copy()))
+
+    player = MarketDataEngine.from_recording(path, speed=None)
+    player.add_listener(listener)
+    asyncio.run(player._replay())
+    assert len(replayed) == 24
+    recorded = player.recording.records
+    assert [timestamp for timestamp, _ in replayed] == recorded['timestamp'][1:].tolist()
+    np.testing.assert_allclose(np.diff(recorded['timestamp']), 3600, atol=1)
+    np.testing.assert_array_equal(replayed[-1][1], recorded['prices'][-1])
@@ -0,0 +1,236 @@
+"""
+OrderBook and MatchingEngine: price-time priority, time in force,
+cancel/replace and the market maker's quotes, as concrete fill sequences.
+"""
+import asyncio
+import itertools
+
+from services.matching_engine import MARKET_MAKER, MatchingEngine
+from services.order_book import (
+    BUY, CANCELLED, FILLED, MARKET, OPEN, PARTIALLY_FILLED, SELL, Order, OrderBook,
+)
+
+_ids = itertools.count(1)
+
+def order(side, quantity, price=None, time_in_force="GTC", user="u"):
+    return Order(f"o{next(_ids)}", user, "TEST", side, quantity,
+                 MARKET if price is None else "limit", price, time_in_force)
+
+def trades(fills):
+    """(maker id, price, quantity) per fill, in order"""
+    return [(fill.maker.id, fill.price, fill.quantity) for fill in fills]
+
+def test_orders_at_one_price_fill_first_in_first_out():
+    book = OrderBook("TEST")
+    first, second, third = order(SELL, 5, 100), order(SELL, 5, 100), order(SELL, 5, 100)
+    for resting in (first, second, third):
+        assert book.submit(resting) == []
+
+    fills = book.submit(order(BUY, 12, 100))
+
+    assert trades(fills) == [(first.id, 100, 5), (second.id, 100, 5), (third.id, 100, 2)]
+    assert (first.status, second.status, third.status) == (FILLED, FILLED, PARTIALLY_FILLED)
+    assert book.depth(5) == {"bids": [], "asks": [[1.0, 3]]}
+
+def test_better_prices_fill_first_and_the_rest_rests():
+    book = OrderBook("TEST")
+    high, low = order(SELL, 4, 102), order(SELL, 4, 101)
+    book.submit(high)
+    book.submit(low)
+
+    taker = order(BUY, 10, 102)
+    fills = book.submit(taker)
+
+    assert trades(fills) == [(low.id, 101, 4), (high.id, 102, 4)]
+    assert taker.status == PARTIALLY_FILLED and taker.remaining == 2
+    assert taker.average_price == 1.015
+    assert book.best_bid() == 102 and book.best_ask() is None
+    assert book.depth(5) == {"bids": [[1.02, 2]], "asks": []}
+
+def test_limit_stops_at_its_price():
+    book = OrderBook("TEST")
+    book.submit(order(SELL, 5, 100))
+    book.submit(order(SELL, 5, 105))
+
+    taker = order(BUY, 8, 103)
+    fills = book.submit(taker)
+
+    assert [(fill.price, fill.quantity) for fill in fills] == [(100, 5)]
+    assert book.depth(5) == {"bids": [[1.03, 3]], "asks": [[1.05, 5]]}
+
+def test_market_order_cancels_what_it_cannot_fill():
+    book = OrderBook("TEST")
+    book.submit(order(BUY, 3, 99))
+
+    taker = order(SELL, 5)
+    fills = book.submit(taker)
+
+    assert [(fill.price, fill.quantity) for fill in fills] == [(99, 3)]
+    assert taker.status == CANCELLED and taker.remaining == 2
+    assert book.depth(5) == {"bids": [], "asks": []}
+
+def test_ioc_fills_what_it_can_and_never_rests():
+    book = OrderBook("TEST")
+    maker = order(SELL, 4, 100)
+    book.submit(maker)
+
+    taker = order(BUY, 10, 100, "IOC")
+    fills = book.submit(taker)
+
+    assert trades(fills) == [(maker.id, 100, 4)]
+    assert taker.status == CANCELLED and taker.filled == 4
+    assert taker.id not in book.orders
+    assert book.best_bid() is None
+
+def test_fok_fills_completely_or_not_at_all():
+    book = OrderBook("TEST")
+    first, second = order(SELL, 4, 100), order(SELL, 4, 101)
+    book.submit(first)
+    book.submit(second)
+
+    short = order(BUY, 9, 101, "FOK")
+    assert book.submit(short) == []
+    assert short.status == CANCELLED and short.filled == 0
+    assert book.depth(5)["asks"] == [[1.0, 4], [1.01, 4]]
+
+    # Liquidity beyond the limit doesn't count
+    assert book.submit(order(BUY, 8, 100, "FOK")) == []
+
+    exact = order(BUY, 8, 101, "FOK")
+    assert trades(book.submit(exact)) == [(first.id, 100, 4), (second.id, 101, 4)]
+    assert exact.status == FILLED
+
+def test_cancel_removes_the_order_and_its_level():
+    book = OrderBook("TEST")
+    only, kept = order(BUY, 5, 99), order(BUY, 5, 98)
+    book.submit(only)
+    book.submit(kept)
+
+    assert book.cancel(only.id) is only
+    assert only.status == CANCELLED
+    assert book.best_bid() == 98
+    assert book.cancel(only.id) is None
+
+    fills = book.submit(order(SELL, 5, 95))
+    assert trades(fills) == [(kept.id, 98, 5)]
+
+def test_reducing_quantity_keeps_queue_priority():
+    book = OrderBook("TEST")
+    first, second = order(SELL, 5, 100), order(SELL, 5, 100)
+    book.submit(first)
+    book.submit(second)
+
+    assert book.replace(first.id, quantity=3) == []
+    assert book.depth(1)["asks"] == [[1.0, 8]]
+
+    fills = book.submit(order(BUY, 4, 100))
+    assert trades(fills) == [(first.id, 100, 3), (second.id, 100, 1)]
+
+def test_increasing_quantity_loses_queue_priority():
+    book = OrderBook("TEST")
+    first, second = order(SELL, 5, 100), order(SELL, 5, 100)
+    book.submit(first)
+    book.submit(second)
+
+    assert book.replace(first.id, quantity=6) == []
+
+    fills = book.submit(order(BUY, 7, 100))
+    assert trades(fills) == [(second.id, 100, 5), (first.id, 100, 2)]
+
+def test_repricing_loses_priority_and_may_trade():
+    book = OrderBook("TEST")
+    first, second = order(BUY, 5, 99), order(BUY, 5, 99)
+    book.submit(first)
+    book.submit(second)
+    ask = order(SELL, 3, 101)
+    book.submit(ask)
+
+    # Away and back: the same price, but now behind ``second``
+    book.replace(first.id, price=98)
+    book.replace(first.id, price=99)
+    assert trades(book.submit(order(SELL, 6, 99))) == [(second.id, 99, 5), (first.id, 99, 1)]
+
+    # Through the spread it trades as an incoming order would
+    fills = book.replace(first.id, price=101)
+    assert trades(fills) == [(ask.id, 101, 3)]
+    assert first.filled == 4 and first.status == PARTIALLY_FILLED
+    assert book.best_bid() == 101 and book.depth(1)["bids"] == [[1.01, 1]]
+
+def test_replace_down_to_the_filled_quantity_cancels():
+    book = OrderBook("TEST")
+    resting = order(SELL, 10, 100)
+    book.submit(resting)
+    book.submit(order(BUY, 4, 100))
+
+    assert book.replace(resting.id, quantity=4) == []
+    assert resting.status == CANCELLED and resting.id not in book.orders
+    assert book.replace(resting.id, quantity=8) is None
+
+def test_deltas_carry_changed_levels_with_sequence_numbers():
+    book = OrderBook("TEST")
+    book.submit(order(BUY, 5, 99))
+    book.submit(order(SELL, 5, 101))
+    assert book.take_changes() == {"seq": 1, "bids": [[0.99, 5]], "asks": [[1.01, 5]]}
+    assert book.take_changes() is None
+
+    book.submit(order(BUY, 5, 101))
+    assert book.take_changes() == {"seq": 2, "bids": [], "asks": [[1.01, 0]]}
+    assert book.snapshot(5) == {"seq": 2, "bids": [[0.99, 5]], "asks": []}
+
+class FakeMarket:
+    symbol_ids = {"TEST": 0}
+    clock = None
+
+    def __init__(self, price):
+        self.prices = {"TEST": price}
+
+    def price(self, symbol):
+        return self.prices[symbol]
+
+def test_market_maker_quotes_around_the_price():
+    market = FakeMarket(100.0)
+    engine = MatchingEngine(market, liquidity=50, spread_bps=20)
+
+    async def run():
+        snapshot = await engine.snapshot("TEST")
+        assert snapshot["bids"] == [[99.9, 50]] and snapshot["asks"] == [[100.1, 50]]
+
+        taker = engine.new_order(1, "TEST", BUY, 20, MARKET)
+        fills = await engine.submit(taker)
+        assert [(fill.maker.user_id, fill.price, fill.quantity) for fill in fills] == [(MARKET_MAKER, 10010, 20)]
+        assert taker.status == FILLED
+
+        # A resting user order ahead of the quote trades first
+        resting = engine.new_order(2, "TEST", SELL, 5, price=100.05)
+        await engine.submit(resting)
+        assert resting.status == OPEN and engine.get(resting.id, 2) is resting
+        fills = await engine.submit(engine.new_order(1, "TEST", BUY, 10, MARKET))
+        assert [(fill.maker.user_id, fill.price, fill.quantity) for fill in fills] == [
+            (2, 10005, 5), (MARKET_MAKER, 10010, 5),
+        ]
+        assert engine.get(resting.id) is None
+    asyncio.run(run())
+
+def test_market_maker_requotes_through_resting_orders():
+    market = FakeMarket(100.0)
+    engine = MatchingEngine(market, liquidity=50, spread_bps=20)
+    seen = []
+
+    async def listener(fills):
+        seen.extend(fills)
+    engine.add_listener(listener)
+
+    async def run():
+        bid = engine.new_order(1, "TEST", BUY, 30, price=100.0)
+        assert await engine.submit(bid) == []
+        assert bid.status == OPEN
+
+        # The market moves through the bid: the new ask quote trades with it
+        market.prices["TEST"] = 99.0
+        snapshot = await engine.snapshot("TEST")
+        assert [(fill.maker.id, fill.taker.user_id, fill.price, fill.quantity) for fill in seen] == [
+            (bid.id, MARKET_MAKER, 10000, 30),
+        ]
+        assert bid.status == FILLED and engine.get(bid.id) is None
+        assert snapshot["bids"] == [[98.9, 50]] and snapshot["asks"] == [[99.1, 20]]
+    asyncio.run(run())
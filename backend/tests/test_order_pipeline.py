@@ -0,0 +1,123 @@
+"""
+OrderPipeline: DAY and GTD expiries grouped on one scheduler timer per
+expiry time and withdrawn shard by shard, on a fast market clock, and the
+replace rules for pending stops.
+"""
+import asyncio
+
+import pytest
+
+from services.matching_engine import MatchingEngine
+from services.order_book import BUY, CANCELLED, EXPIRED, FILLED, OPEN, PENDING, SELL
+from services.order_pipeline import OrderPipeline
+from services.scheduler import MarketClock, Scheduler
+from services.stop_orders import STOP, STOP_LIMIT, TRAILING_STOP
+
+# Friday 2024-01-12 15:59 in New York, a minute before the close
+FRIDAY_3_59PM = 1_705_093_140
+FRIDAY_CLOSE = FRIDAY_3_59PM + 60
+
+class FakeMarket:
+    symbol_ids = {"AAA": 0, "BBB": 1}
+
+    def __init__(self, clock):
+        self.clock = clock
+
+    def price(self, symbol):
+        return 100.0
+
+def make_pipeline():
+    # A market minute takes 1/60 s
+    clock = MarketClock(speed=3600, start=FRIDAY_3_59PM)
+    scheduler = Scheduler(clock)
+    engine = MatchingEngine(FakeMarket(clock), liquidity=1000, spread_bps=20)
+    return OrderPipeline(engine, shards=2, scheduler=scheduler), clock
+
+def test_day_and_gtd_orders_share_a_timer_per_expiry_time():
+    pipeline, clock = make_pipeline()
+    engine, scheduler = pipeline.engine, pipeline.scheduler
+
+    async def run():
+        day = [engine.new_order(1, symbol, BUY, 5, price=95.0, time_in_force="DAY") for symbol in ("AAA", "BBB")]
+        day_stop = engine.new_order(1, "AAA", SELL, 5, STOP, time_in_force="DAY", stop_price=90.0)
+        gtd_at = clock.now() + 20
+        gtd = [engine.new_order(2, symbol, SELL, 5, price=105.0, time_in_force="GTD", expires_at=gtd_at)
+               for symbol in ("AAA", "BBB")]
+        gtc = engine.new_order(3, "AAA", BUY, 5, price=96.0)
+        # Fills at once, so there is nothing left to expire
+        filled = engine.new_order(4, "BBB", BUY, 5, price=101.0, time_in_force="DAY")
+        await pipeline.submit_many(day + gtd + [gtc])
+        await pipeline.submit(day_stop)
+        await pipeline.submit(filled)
+        assert filled.status == FILLED and day_stop.status == PENDING
+        assert {order.expires_at for order in day} == {FRIDAY_CLOSE}
+
+        # Two timers: the session close and the GTD time
+        assert len(scheduler) == 2
+        assert sorted(pipeline._expiries) == [gtd_at, FRIDAY_CLOSE]
+        assert len(pipeline._expiries[FRIDAY_CLOSE]) == 3
+
+        await scheduler.sleep_until(gtd_at)
+        # The expiry jobs were queued ahead of anything submitted now
+        for symbol in ("AAA", "BBB"):
+            await pipeline.snapshot(symbol)
+        assert [order.status for order in gtd] == [EXPIRED, EXPIRED]
+        assert all(order.status == OPEN for order in day)
+        assert engine.get(gtd[0].id) is None
+
+        await scheduler.sleep_until(FRIDAY_CLOSE)
+        for symbol in ("AAA", "BBB"):
+            await pipeline.snapshot(symbol)
+        assert [order.status for order in day + [day_stop]] == [EXPIRED] * 3
+        assert not engine.stops["AAA"]
+        assert engine.open_orders(1) == [] and engine.open_orders(3) == [gtc]
+        assert pipeline._expiries == {}
+
+        await scheduler.stop()
+        await pipeline.stop()
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+def test_an_order_cancelled_before_its_expiry_stays_cancelled():
+    pipeline, _ = make_pipeline()
+    engine, scheduler = pipeline.engine, pipeline.scheduler
+
+    async def run():
+        order = engine.new_order(1, "AAA", BUY, 5, price=95.0, time_in_force="DAY")
+        await pipeline.submit(order)
+        assert (await pipeline.cancel(order.id, 1)) is order
+
+        await scheduler.sleep_until(FRIDAY_CLOSE)
+        await pipeline.snapshot("AAA")
+        assert order.status == CANCELLED
+
+        await scheduler.stop()
+        await pipeline.stop()
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+def test_a_price_replace_is_rejected_on_stops_without_a_limit():
+    pipeline, _ = make_pipeline()
+    engine = pipeline.engine
+
+    async def run():
+        stop = engine.new_order(1, "AAA", SELL, 5, STOP, stop_price=95.0)
+        trailing = engine.new_order(1, "AAA", SELL, 5, TRAILING_STOP, trail=2.0)
+        stop_limit = engine.new_order(1, "AAA", SELL, 5, STOP_LIMIT, price=94.0, stop_price=95.0)
+        for order in (stop, trailing, stop_limit):
+            await pipeline.submit(order)
+            assert order.status == PENDING
+
+        for order in (stop, trailing):
+            with pytest.raises(ValueError):
+                await pipeline.replace(order.id, 1, price=96.0)
+            assert order.price is None
+            # The quantity can still change
+            replaced, fills = await pipeline.replace(order.id, 1, quantity=3)
+            assert replaced is order and fills == [] and order.remaining == 3
+
+        # A stop-limit keeps its trigger and takes the new limit
+        await pipeline.replace(stop_limit.id, 1, price=93.5)
+        assert stop_limit.price == 9350 and stop_limit.stop_price == 9500
+        assert engine.stops["AAA"] and all(order.status == PENDING for order in (stop, trailing, stop_limit))
+
+        await pipeline.stop()
+    asyncio.run(asyncio.wait_for(run(), 5))
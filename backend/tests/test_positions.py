@@ -0,0 +1,124 @@
+"""
+PositionBook: average cost and realized P&L against a share-by-share
+replay, and persistence that adds up the fills of several workers.
+"""
+import random
+import threading
+
+import pytest
+
+from database import Base, SessionLocal, engine
+from models.position import Position
+from services.order_book import BUY, SELL
+from services.positions import PositionBook, book_fill
+
+SYMBOLS = [f"S{i}" for i in range(10)]
+
+class ShareReplay:
+    """One position kept as the cost of every open share, pooled at the mean when reduced"""
+
+    def __init__(self):
+        self.shares = []
+        self.short = False
+        self.realized = 0.0
+
+    def fill(self, side, quantity, price):
+        if not self.shares or self.short == (side == SELL):
+            self.short = side == SELL
+            self.shares += [price] * quantity
+            return
+        average = sum(self.shares) / len(self.shares)
+        closed = min(quantity, len(self.shares))
+        self.realized += (price - average) * closed * (-1 if self.short else 1)
+        self.shares = [average] * (len(self.shares) - closed)
+        if quantity > closed:
+            self.short = side == SELL
+            self.shares = [price] * (quantity - closed)
+
+    @property
+    def quantity(self):
+        return -len(self.shares) if self.short else len(self.shares)
+
+    @property
+    def average_cost(self):
+        return sum(self.shares) / len(self.shares) if self.shares else 0.0
+
+def test_random_fills_match_a_share_by_share_replay():
+    rng = random.Random(21)
+    book = PositionBook(SYMBOLS, capacity=4, persist=False)
+    replays = {}
+    for _ in range(20_000):
+        user, symbol = rng.randrange(10), rng.choice(SYMBOLS)
+        side, quantity, price = rng.choice((BUY, SELL)), rng.randint(1, 30), round(rng.uniform(50, 150), 2)
+        book.apply(user, symbol, side, quantity, price)
+        replays.setdefault((user, symbol), ShareReplay()).fill(side, quantity, price)
+
+    assert book.size == len(replays) == 100
+    for (user, symbol), replay in replays.items():
+        position = book.position(user, symbol)
+        assert position["quantity"] == replay.quantity
+        assert position["average_cost"] == pytest.approx(replay.average_cost, abs=1e-6)
+        assert position["realized_pnl"] == pytest.approx(replay.realized, abs=1e-6)
+
+def test_selling_through_zero_realises_the_closed_part_and_opens_a_short():
+    book = PositionBook(SYMBOLS, persist=False)
+    book.apply(1, "S0", BUY, 20, 175.56)
+    book.apply(1, "S0", SELL, 25, 175.39)
+
+    position = book.position(1, "S0")
+    assert position["quantity"] == -5
+    assert position["average_cost"] == 175.39
+    assert position["realized_pnl"] == pytest.approx((175.39 - 175.56) * 20)
+    assert round(position["realized_pnl"], 2) == -3.40
+    assert book.positions(1) == [position]
+
+    book.apply(1, "S0", BUY, 5, 175.00)
+    assert book.positions(1) == []
+    assert book.positions(1, open_only=False)[0]["realized_pnl"] == pytest.approx(-3.40 + 0.39 * 5)
+
+@pytest.fixture
+def positions_table():
+    Base.metadata.create_all(engine)
+    yield
+    Base.metadata.drop_all(engine)
+
+def stored(user_id, symbol):
+    with SessionLocal() as session:
+        position = session.get(Position, (user_id, symbol))
+        return position.quantity, float(position.average_cost), float(position.realized_pnl)
+
+def test_the_table_adds_up_the_fills_of_every_worker(positions_table):
+    # Two workers, each booking only the fills it matched
+    first, second = PositionBook(SYMBOLS), PositionBook(SYMBOLS)
+    fills = [(first, BUY, 10, 100.0), (second, BUY, 5, 106.0), (first, SELL, 8, 110.0),
+             (second, SELL, 12, 95.0), (first, BUY, 2, 90.0)]
+    expected = (0, 0.0, 0.0)
+    for book, side, quantity, price in fills:
+        book.apply(7, "S1", side, quantity, price)
+        book.wait()
+        expected = book_fill(*expected, quantity if side == BUY else -quantity, price)
+
+    assert expected[0] == -3
+    quantity, average_cost, realized = stored(7, "S1")
+    assert quantity == expected[0]
+    assert average_cost == pytest.approx(expected[1], abs=1e-6)
+    assert realized == pytest.approx(expected[2], abs=1e-6)
+    # Neither worker's own view is the whole position
+    assert first.position(7, "S1")["quantity"] == 4 and second.position(7, "S1")["quantity"] == -7
+
+def test_concurrent_flushes_lose_no_fills(positions_table):
+    books = [PositionBook(SYMBOLS) for _ in range(4)]
+
+    def trade(book):
+        for i in range(50):
+            book.apply(3, "S2", BUY if i % 5 else SELL, 3, 100.0 + i)
+            book.flush()
+        book.wait()
+
+    threads = [threading.Thread(target=trade, args=(book,)) for book in books]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert stored(3, "S2")[0] == sum(int(book.quantity[0]) for book in books) == 4 * (40 - 10) * 3
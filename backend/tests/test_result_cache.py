@@ -0,0 +1,113 @@
+"""
+ResultCache: TTL, LRU eviction, tag invalidation and single-flight misses.
+"""
+import asyncio
+
+import pytest
+
+from services.result_cache import TICKS, ResultCache, user_tag
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def counter():
+    calls = []
+
+    async def compute():
+        calls.append(None)
+        return len(calls)
+    return calls, compute
+
+def test_entries_expire_after_their_ttl():
+    clock = FakeClock()
+    cache = ResultCache(clock=clock)
+    calls, compute = counter()
+
+    async def run():
+        assert await cache.get_or_compute("e", (), 5, (), compute) == 1
+        clock.now = 4.9
+        assert await cache.get_or_compute("e", (), 5, (), compute) == 1
+        clock.now = 5.0
+        assert await cache.get_or_compute("e", (), 5, (), compute) == 2
+    asyncio.run(run())
+    assert cache.hits["e"] == 1 and cache.misses["e"] == 2
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResultCache(max_entries=2, clock=FakeClock())
+    _, compute = counter()
+
+    async def run():
+        for key in ("a", "b"):
+            await cache.get_or_compute("e", (key,), 60, (), compute)
+        # Touch "a", so "b" is the least recently used when "c" arrives
+        await cache.get_or_compute("e", ("a",), 60, (), compute)
+        await cache.get_or_compute("e", ("c",), 60, (), compute)
+    asyncio.run(run())
+    assert list(cache._entries) == [("e", "a"), ("e", "c")]
+    assert cache.evictions == 1
+
+def test_invalidated_tag_makes_entries_stale():
+    cache = ResultCache(clock=FakeClock())
+    calls, compute = counter()
+
+    async def run():
+        await cache.get_or_compute("e", (), 60, (TICKS, user_tag(1)), compute)
+        cache.invalidate(user_tag(2))
+        await cache.get_or_compute("e", (), 60, (TICKS, user_tag(1)), compute)
+        cache.invalidate(user_tag(1))
+        await cache.get_or_compute("e", (), 60, (TICKS, user_tag(1)), compute)
+    asyncio.run(run())
+    assert len(calls) == 2
+
+def test_concurrent_misses_share_one_computation():
+    cache = ResultCache(clock=FakeClock())
+    calls = []
+
+    async def compute():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_compute("e", (), 60, (), compute) for _ in range(10)))
+    assert asyncio.run(run()) == ["value"] * 10
+    assert len(calls) == 1
+    assert cache.misses["e"] == 1 and cache.coalesced["e"] == 9
+
+def test_waiters_see_the_computation_fail_and_nothing_is_cached():
+    cache = ResultCache(clock=FakeClock())
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_compute("e", (), 60, (), compute) for _ in range(3)),
+                                    return_exceptions=True)
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert not cache._entries
+
+def test_waiter_recomputes_when_the_computing_request_is_cancelled():
+    cache = ResultCache(clock=FakeClock())
+    calls = []
+
+    async def compute():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def run():
+        first = asyncio.create_task(cache.get_or_compute("e", (), 60, (), compute))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(cache.get_or_compute("e", (), 60, (), compute))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+    assert asyncio.run(run()) == 2
@@ -0,0 +1,132 @@
+"""
+MarketClock and Scheduler: sessions, jumps over closed hours and resuming
+market time after a restart.
+"""
+import asyncio
+
+import numpy as np
+import pytest
+
+from services.candles import CandleStore
+from services.market_data import MarketDataEngine
+from services.price_simulator import PriceSimulator
+from services import scheduler as scheduler_module
+from services.scheduler import MarketClock, Scheduler
+from services.tick_store import TickStore
+
+# Monday 2024-01-08 10:00 in New York
+MONDAY_10AM = 1_704_726_000
+MINUTE, HOUR, DAY = 60, 3600, 86400
+FRIDAY_3PM = MONDAY_10AM + 4 * DAY + 5 * HOUR
+NEXT_MONDAY_OPEN = MONDAY_10AM + 7 * DAY - 30 * MINUTE
+
+class FakeTime:
+    """Stands in for the time module, with a monotonic clock the test moves"""
+
+    def __init__(self):
+        self.elapsed = 0.0
+
+    def monotonic(self):
+        return self.elapsed
+
+    def time(self):
+        return MONDAY_10AM
+
+@pytest.fixture
+def real_time(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(scheduler_module, "time", fake)
+    return fake
+
+def test_session_close_skips_weekends():
+    clock = MarketClock(start=FRIDAY_3PM)
+    friday_close = FRIDAY_3PM + HOUR
+    monday_close = NEXT_MONDAY_OPEN + 6 * HOUR + 30 * MINUTE
+    assert clock.session_close(FRIDAY_3PM) == friday_close
+    assert clock.session_close(friday_close) == monday_close
+    assert clock.session_close(friday_close + DAY) == monday_close
+    assert clock.session(friday_close + 2 * DAY) == (NEXT_MONDAY_OPEN, monday_close)
+    assert clock.is_open(FRIDAY_3PM) and not clock.is_open(friday_close + DAY)
+
+def test_the_clock_jumps_from_the_close_to_the_next_open(real_time):
+    clock = MarketClock(speed=60, start=FRIDAY_3PM)
+    assert clock.now() == FRIDAY_3PM
+    real_time.elapsed = 30
+    assert clock.now() == FRIDAY_3PM + 30 * MINUTE
+    real_time.elapsed = 60
+    assert clock.now() == FRIDAY_3PM + HOUR
+    # A minute after the Friday close is a minute after Monday's open
+    real_time.elapsed = 61
+    assert clock.now() == NEXT_MONDAY_OPEN + MINUTE
+    assert clock.is_open()
+
+def test_closed_hours_take_no_time_to_wait_through(real_time):
+    clock = MarketClock(speed=60, start=FRIDAY_3PM)
+    # The last hour of Friday plus half an hour of Monday
+    assert clock.delay(NEXT_MONDAY_OPEN + 30 * MINUTE) == 90
+    # Times while the market is closed come with the next open
+    assert clock.delay(FRIDAY_3PM + 2 * DAY) == 60
+    assert clock.delay(FRIDAY_3PM - HOUR) == 0
+    real_time.elapsed = 75
+    assert clock.delay(NEXT_MONDAY_OPEN + 30 * MINUTE) == 15
+
+def test_a_clock_started_while_closed_starts_at_the_open(real_time):
+    saturday_noon = FRIDAY_3PM + DAY - 3 * HOUR
+    assert MarketClock(start=saturday_noon).now() == NEXT_MONDAY_OPEN
+    # Unless it runs through closed hours too
+    assert MarketClock(start=saturday_noon, skip_closed=False).now() == saturday_noon
+    with pytest.raises(ValueError):
+        MarketClock(open="16:00", close="09:30")
+
+def test_timers_across_the_weekend_fire_in_market_time_order():
+    clock = MarketClock(speed=3600, start=FRIDAY_3PM + 59 * MINUTE)
+    scheduler = Scheduler(clock)
+    fired = []
+
+    async def run():
+        scheduler.call_at(NEXT_MONDAY_OPEN + MINUTE, lambda: fired.append(("monday", clock.now())))
+        scheduler.call_at(FRIDAY_3PM + HOUR, lambda: fired.append(("close", clock.now())))
+        await scheduler.sleep_until(NEXT_MONDAY_OPEN + 2 * MINUTE)
+        await scheduler.stop()
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+    assert [name for name, _ in fired] == ["close", "monday"]
+    # Two minutes of market time at 3600x: well under a second, weekend and all
+    assert NEXT_MONDAY_OPEN <= fired[1][1] < NEXT_MONDAY_OPEN + 5 * MINUTE
+
+def test_a_restart_resumes_after_an_accelerated_session(tmp_path):
+    simulator = PriceSimulator.with_universe(3, seed=5)
+    store = TickStore(str(tmp_path / "ticks"), flush_every=1)
+    # An hour of market time ahead of a clock that restarts at 10:00
+    engine = MarketDataEngine(simulator, interval=60, scheduler=Scheduler(MarketClock(start=MONDAY_10AM + HOUR)))
+    for _ in range(5):
+        store.append(engine.step())
+        engine.clock.resume(engine.clock.now() + 60)
+    store.flush()
+    end = store.end(engine.symbols)
+    assert end >= MONDAY_10AM + 3600 + 4 * 60
+
+    clock = MarketClock(start=MONDAY_10AM)
+    clock.resume(end)
+    assert end <= clock.now() < end + 1
+    # Resuming never moves the clock back
+    clock.resume(MONDAY_10AM)
+    assert clock.now() >= end
+
+    restarted = MarketDataEngine(simulator, interval=60, scheduler=Scheduler(clock))
+    tick = restarted.step()
+    store.append(tick)
+    store.flush()
+    timestamps, _, _ = store.query(engine.symbols[0])
+    assert len(timestamps) == 6 and timestamps[-1] == tick.timestamp
+
+def test_the_candle_store_ends_with_its_last_bucket(tmp_path):
+    store = CandleStore(["A", "B"], str(tmp_path / "candles"))
+    assert store.end() == -np.inf
+    starts = np.array([MONDAY_10AM, MONDAY_10AM + 60], dtype=float)
+    prices = np.ones((2, 2))
+    store.append("1m", {"start": starts, "open": prices, "high": prices, "low": prices, "close": prices,
+                        "volume": np.zeros((2, 2), dtype=np.int64)})
+    store.wait()
+    # The 10:01 minute is over, so market time goes on from 10:02
+    assert store.end() == MONDAY_10AM + 120
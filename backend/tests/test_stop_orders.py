@@ -0,0 +1,233 @@
+"""
+StopBook: stop and trailing-stop triggers, trailing group merges and lazy
+cancellation, driven through price paths with known trigger points.
+"""
+import asyncio
+import itertools
+import random
+
+from services import stop_orders
+from services.matching_engine import MatchingEngine
+from services.order_book import BUY, FILLED, OPEN, PENDING, SELL, Order
+from services.stop_orders import STOP, TRAILING_STOP, StopBook
+
+_ids = itertools.count(1)
+
+def stop(side, stop_price, quantity=1):
+    return Order(f"s{next(_ids)}", 1, "TEST", side, quantity, STOP, stop_price=stop_price)
+
+def trailing(side, trail, quantity=1):
+    return Order(f"t{next(_ids)}", 1, "TEST", side, quantity, TRAILING_STOP, trail=trail)
+
+def test_sell_stops_trigger_when_the_price_falls_to_them():
+    book = StopBook("TEST")
+    high, low = stop(SELL, 95), stop(SELL, 90)
+    book.arm(low, 100)
+    book.arm(high, 100)
+    assert high.status == PENDING
+
+    assert book.triggered(96) == []
+    assert book.triggered(95) == [high]
+    assert high.status == OPEN and high.id not in book
+    assert book.triggered(91) == []
+    assert book.triggered(80) == [low]
+    assert len(book) == 0
+
+def test_buy_stops_trigger_when_the_price_rises_to_them():
+    book = StopBook("TEST")
+    near, far = stop(BUY, 105), stop(BUY, 110)
+    book.arm(far, 100)
+    book.arm(near, 100)
+
+    assert book.triggered(104) == []
+    # A jump through both triggers them nearest first
+    assert book.triggered(112) == [near, far]
+
+def test_a_gap_triggers_both_sides_it_crosses():
+    book = StopBook("TEST")
+    sell, buy = stop(SELL, 95), stop(BUY, 105)
+    book.arm(sell, 100)
+    book.arm(buy, 100)
+
+    assert book.triggered(94) == [sell]
+    assert book.triggered(106) == [buy]
+
+def test_trailing_sell_follows_the_high():
+    book = StopBook("TEST")
+    order = trailing(SELL, 5)
+    book.arm(order, 100)
+
+    # Stop at 95, then 105 - 5 = 100 after the rally
+    for price in (98, 101, 105, 103, 101):
+        assert book.triggered(price) == []
+    assert book.triggered(100) == [order]
+
+def test_trailing_buy_follows_the_low():
+    book = StopBook("TEST")
+    order = trailing(BUY, 3)
+    book.arm(order, 100)
+
+    for price in (97, 92, 94):
+        assert book.triggered(price) == []
+    assert book.triggered(95) == [order]
+
+def test_trailing_groups_merge_on_a_new_high():
+    book = StopBook("TEST")
+    side = book.sides[SELL]
+    wide = trailing(SELL, 10)
+    book.arm(wide, 100)
+    # Armed lower, after a dip: a group of its own with a lower high
+    assert book.triggered(96) == []
+    tight = trailing(SELL, 2)
+    book.arm(tight, 96)
+    mid = trailing(SELL, 4)
+    book.arm(mid, 96)
+    assert [group.best for group in side.groups] == [100, 96]
+
+    # 94 reaches tight's stop (96 - 2) but not wide's (100 - 10) or mid's (92)
+    assert book.triggered(94) == [tight]
+
+    # A new high above both merges them and moves every stop with it
+    assert book.triggered(103) == []
+    assert [group.best for group in side.groups] == [103]
+    assert sorted(trail for trail, _, _ in side.groups[0].orders) == [4, 10]
+    assert book.triggered(100) == []
+    assert book.triggered(99) == [mid]
+    assert book.triggered(93) == [wide]
+
+def test_stops_come_before_trailing_stops_at_one_price():
+    book = StopBook("TEST")
+    trail = trailing(SELL, 5)
+    plain = stop(SELL, 96)
+    book.arm(trail, 100)
+    book.arm(plain, 100)
+
+    assert book.triggered(95) == [plain, trail]
+
+def test_cancelled_orders_are_skipped_without_touching_the_heaps():
+    book = StopBook("TEST")
+    kept, dropped = stop(SELL, 95), stop(SELL, 95)
+    trail_kept, trail_dropped = trailing(SELL, 5), trailing(SELL, 3)
+    for order in (kept, dropped, trail_kept, trail_dropped):
+        book.arm(order, 100)
+
+    assert book.cancel(dropped) and book.cancel(trail_dropped)
+    assert not book.cancel(dropped)
+    side = book.sides[SELL]
+    # Their entries are still in the heaps, just dead
+    assert len(side.stops) == 2 and side.dead == 2 and side.live == 2
+
+    assert book.triggered(95) == [kept, trail_kept]
+    assert len(book) == 0
+
+def test_rearming_a_cancelled_order_ignores_its_old_entry():
+    book = StopBook("TEST")
+    order = stop(SELL, 95)
+    book.arm(order, 100)
+    book.cancel(order)
+    order.stop_price = 90
+    book.arm(order, 100)
+
+    # The old entry at 95 carries a stale token
+    assert book.triggered(95) == []
+    assert book.triggered(90) == [order]
+
+def test_heaps_are_compacted_once_most_entries_are_dead(monkeypatch):
+    monkeypatch.setattr(stop_orders, "COMPACT_MIN", 4)
+    book = StopBook("TEST")
+    orders = [stop(SELL, 90 - i) for i in range(6)] + [trailing(SELL, 5 + i) for i in range(6)]
+    for order in orders:
+        book.arm(order, 100)
+    for order in orders[:5] + orders[6:11]:
+        book.cancel(order)
+
+    side = book.sides[SELL]
+    assert side.dead < 5
+    assert all(entry[2] in (orders[5], orders[11]) for entry in side.stops)
+    assert book.triggered(50) == [orders[5], orders[11]]
+
+def test_random_paths_trigger_where_a_naive_scan_does():
+    rng = random.Random(24)
+    book = StopBook("TEST")
+    price = 10_000
+    # Naive model: order -> (side, best seen, stop or trail)
+    armed = {}
+
+    def naive(price):
+        hit = []
+        for order, (side, best, is_trail) in list(armed.items()):
+            if is_trail:
+                best = max(best, price) if side == SELL else min(best, price)
+                armed[order] = (side, best, True)
+                level = best - order.trail if side == SELL else best + order.trail
+            else:
+                level = order.stop_price
+            if (price <= level) if side == SELL else (price >= level):
+                hit.append(order)
+                del armed[order]
+        return hit
+
+    for step in range(5_000):
+        price = max(100, price + rng.randint(-60, 60))
+        if rng.random() < 0.3:
+            side = rng.choice((BUY, SELL))
+            if rng.random() < 0.5:
+                offset = rng.randint(1, 400)
+                order = stop(side, price - offset if side == SELL else price + offset)
+                armed[order] = (side, None, False)
+            else:
+                order = trailing(side, rng.randint(1, 400))
+                armed[order] = (side, price, True)
+            book.arm(order, price)
+        if armed and rng.random() < 0.05:
+            order = rng.choice(list(armed))
+            assert book.cancel(order)
+            del armed[order]
+        expected = naive(price)
+        assert set(book.triggered(price)) == set(expected), step
+    assert len(book) == len(armed)
+
+class FakeMarket:
+    symbol_ids = {"TEST": 0}
+    clock = None
+
+    def __init__(self, price):
+        self.prices = {"TEST": price}
+
+    def price(self, symbol):
+        return self.prices[symbol]
+
+def test_engine_fills_triggered_stops_in_trigger_order():
+    market = FakeMarket(100.0)
+    engine = MatchingEngine(market, liquidity=1000, spread_bps=20)
+    fills = []
+
+    async def listener(batch):
+        fills.extend(batch)
+    engine.add_listener(listener)
+
+    async def move(price):
+        market.prices["TEST"] = price
+        await engine.requote("TEST")
+        return [(fill.taker.id, fill.price, fill.quantity) for fill in fills]
+
+    async def run():
+        trail = engine.new_order(1, "TEST", SELL, 3, TRAILING_STOP, trail=2.0)
+        plain = engine.new_order(1, "TEST", SELL, 4, STOP, stop_price=99.0)
+        await engine.submit(trail)
+        await engine.submit(plain)
+        assert engine.get(trail.id) is trail and trail.status == PENDING
+
+        # The high-water mark follows the rally to 104, so the trailing stop moves from 98 to 102
+        for price in (101.5, 104.0, 102.5):
+            assert await move(price) == []
+        assert engine.stops["TEST"].sides[SELL].groups[0].best == 10400
+
+        # Each sells to the market maker's bid just under the price that triggered it
+        assert await move(101.5) == [(trail.id, 10140, 3)]
+        assert engine.get(trail.id) is None and engine.get(plain.id) is plain
+        assert await move(99.5) == [(trail.id, 10140, 3)]
+        assert await move(98.5) == [(trail.id, 10140, 3), (plain.id, 9840, 4)]
+        assert trail.status == plain.status == FILLED
+        assert not engine.stops["TEST"]
+    asyncio.run(run())
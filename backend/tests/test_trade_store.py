@@ -0,0 +1,118 @@
+"""
+TradeStore: snowflake ids and cursor pagination over the in-memory indexes
+and the ``trades`` table behind them.
+"""
+import asyncio
+import time
+
+import pytest
+
+from database import Base, engine
+from services.trade_store import EPOCH, SEQUENCE_BITS, WORKER_BITS, SnowflakeIds, TradeStore, id_at
+
+class FakeClock:
+    """Advances a millisecond per call from ``start``"""
+
+    def __init__(self, start: float):
+        self.now = start
+
+    def __call__(self):
+        self.now += 0.001
+        return self.now
+
+@pytest.fixture(autouse=True)
+def trades_table():
+    Base.metadata.create_all(engine)
+    yield
+    Base.metadata.drop_all(engine)
+
+def record(store, user_id, count, symbols=("AAPL", "MSFT"), start=0):
+    trades = []
+    for i in range(start, start + count):
+        trades.append(store.record(user_id, f"order_{i}", symbols[i % len(symbols)],
+                                   "buy" if i % 3 else "sell", i + 1, 100.0 + i, store.ids.clock()))
+    return trades
+
+def pages(store, user_id, limit, **filters):
+    """Every page of a query, following the cursors"""
+    async def run():
+        result, before = [], None
+        while True:
+            page, before = await store.query(user_id, before=before, limit=limit, **filters)
+            result.append([trade.id for trade in page])
+            if before is None:
+                return result
+    return asyncio.run(run())
+
+def test_snowflake_ids_increase_and_carry_worker_and_time():
+    clock_time = [EPOCH / 1000 + 5]
+    ids = SnowflakeIds(worker=7, clock=lambda: clock_time[0])
+
+    first = ids.next()
+    same_millisecond = [ids.next() for _ in range(4095)]
+    assert first >> (WORKER_BITS + SEQUENCE_BITS) == 5000
+    assert (first >> SEQUENCE_BITS) & ((1 << WORKER_BITS) - 1) == 7
+    # The 4097th id of a millisecond moves on to the next one
+    overflow = ids.next()
+    assert overflow >> (WORKER_BITS + SEQUENCE_BITS) == 5001
+
+    # A clock that steps back never produces a smaller id
+    clock_time[0] -= 1
+    stepped_back = ids.next()
+    sequence = [first, *same_millisecond, overflow, stepped_back]
+    assert sequence == sorted(set(sequence))
+    assert id_at(EPOCH / 1000 + 5) <= first < id_at(EPOCH / 1000 + 5.001)
+
+def test_cursor_pages_cover_every_trade_newest_first():
+    store = TradeStore(persist=False, ids=SnowflakeIds(worker=1, clock=FakeClock(time.time() + 10)))
+    trades = record(store, 1, 23)
+    record(store, 2, 5)
+
+    result = pages(store, 1, 10)
+    assert [len(page) for page in result] == [10, 10, 3]
+    assert [trade_id for page in result for trade_id in page] == [trade.id for trade in reversed(trades)]
+
+    # A full last page still hands out a cursor, and the page after it is empty
+    assert [len(page) for page in pages(store, 1, 23)] == [23, 0]
+
+def test_filters_and_time_range_page_through_their_own_index():
+    store = TradeStore(persist=False, ids=SnowflakeIds(worker=1, clock=FakeClock(time.time() + 10)))
+    trades = record(store, 1, 30)
+
+    def expected(keep):
+        return [trade.id for trade in reversed(trades) if keep(trade)]
+
+    def flat(result):
+        return [trade_id for page in result for trade_id in page]
+
+    assert flat(pages(store, 1, 4, symbol="AAPL")) == expected(lambda t: t.symbol == "AAPL")
+    assert flat(pages(store, 1, 4, side="sell")) == expected(lambda t: t.side == "sell")
+    assert flat(pages(store, 1, 4, symbol="MSFT", side="buy")) == expected(
+        lambda t: t.symbol == "MSFT" and t.side == "buy"
+    )
+    # Time bounds are id bounds
+    start, end = trades[5].timestamp, trades[20].timestamp
+    in_range = flat(pages(store, 1, 4, start=start, end=end))
+    assert in_range == expected(lambda t: id_at(start) <= t.id < id_at(end))
+    assert 14 <= len(in_range) <= 16
+    assert pages(store, 1, 4, symbol="TSLA") == [[]]
+    assert pages(store, 99, 4) == [[]]
+
+def test_pages_continue_from_the_table_past_memory():
+    # Trades a previous worker wrote before this one started
+    earlier = TradeStore(ids=SnowflakeIds(worker=2, clock=FakeClock(time.time() - 100)))
+    old = record(earlier, 1, 7)
+    earlier.wait()
+
+    store = TradeStore(index_size=6, ids=SnowflakeIds(worker=1, clock=FakeClock(time.time() + 10)))
+    new = record(store, 1, 14, start=7)
+    store.wait()
+    # Only the newest trades stay in memory
+    assert len(store.users[1].all.ids) < len(new)
+
+    result = pages(store, 1, 5)
+    assert [len(page) for page in result] == [5, 5, 5, 5, 1]
+    assert [trade_id for page in result for trade_id in page] == [trade.id for trade in reversed(old + new)]
+
+    sells = [trade_id for page in pages(store, 1, 2, side="sell") for trade_id in page]
+    assert sells == [trade.id for trade in reversed(old + new) if trade.side == "sell"]
@@ -0,0 +1,79 @@
+"""
+/users wallet ledger: keyset pages through X-Next-Cursor and the streamed
+NDJSON and CSV exports.
+"""
+import csv
+import io
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+DEPOSITS = 12
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+@pytest.fixture(scope="module")
+def headers(client):
+    response = client.post("/users/register", json={
+        "username": "ledger", "email": "ledger@example.com", "password": "secret",
+    })
+    assert response.status_code == 200, response.text
+    token = client.post("/users/token", data={"username": "ledger", "password": "secret"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    for i in range(DEPOSITS):
+        response = client.post("/users/wallet/update", headers=headers, json={
+            "amount": str(i + 1), "transaction_type": "deposit", "description": f"deposit {i}",
+        })
+        assert response.status_code == 200, response.text
+    return headers
+
+def test_pages_follow_the_next_cursor_newest_first(client, headers):
+    pages, cursor = [], None
+    # Bounded, so a cursor that doesn't advance fails instead of hanging
+    for _ in range(DEPOSITS):
+        params = {"limit": 5} if cursor is None else {"limit": 5, "cursor": cursor}
+        response = client.get("/users/wallet/transactions", headers=headers, params=params)
+        assert response.status_code == 200, response.text
+        pages.append(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    else:
+        pytest.fail("X-Next-Cursor never ran out")
+
+    # The initial balance plus every deposit, each exactly once
+    assert [len(page) for page in pages] == [5, 5, 3]
+    transactions = [transaction for page in pages for transaction in page]
+    assert [t["description"] for t in transactions] == (
+        [f"deposit {i}" for i in reversed(range(DEPOSITS))] + ["Initial wallet balance"]
+    )
+    assert float(transactions[0]["balance_after"]) == 10000 + DEPOSITS * (DEPOSITS + 1) / 2
+
+def test_a_bad_cursor_is_rejected(client, headers):
+    response = client.get("/users/wallet/transactions", headers=headers, params={"cursor": "nonsense"})
+    assert response.status_code == 400
+
+def test_export_streams_the_ledger_oldest_first(client, headers):
+    response = client.get("/users/wallet/transactions/export", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["description"] for row in rows] == (
+        ["Initial wallet balance"] + [f"deposit {i}" for i in range(DEPOSITS)]
+    )
+
+    response = client.get("/users/wallet/transactions/export", headers=headers, params={"format": "csv"})
+    assert response.status_code == 200
+    assert 'filename="wallet-transactions.csv"' in response.headers["content-disposition"]
+    table = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["id"] for row in table] == [str(row["id"]) for row in rows]
+    assert table[-1]["balance_after"] == rows[-1]["balance_after"]
+
+    response = client.get("/users/wallet/transactions/export", headers=headers, params={"format": "xml"})
+    assert response.status_code == 400
@@ -1,72 +1,513 @@
 from fastapi import WebSocket, WebSocketDisconnect
-import json
 import asyncio
-import random
-from typing import List
+import itertools
+import json
+import logging
+import os
+from collections import deque
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Union
+
+from routers.auth import user_from_token
+from services.market_data import Tick, market_engine
+from services.market_indices import market_indices
+from services.matching_engine import matching_engine
+from services.order_pipeline import order_pipeline
+from services.pubsub import Backplane
+from services.valuation import valuation_engine
+from services.wire_format import ENCODINGS, PriceFrame, symbol_table_message
+
+logger = logging.getLogger(__name__)
+
+# Outbound queue settings for each WebSocket client
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "32"))
+SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "conflate")
+
+# What to do when a client's queue is full:
+#   drop_oldest - discard the oldest queued message
+#   conflate    - discard every queued price frame, keep only a fresh snapshot
+#   disconnect  - close the connection
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "conflate", "disconnect")
+
+# Backplane channel for JSON events that every worker fans out (e.g. trade prints)
+EVENTS_CHANNEL = "events"
+
+DEPTH_ACTIONS = ("subscribe_depth", "unsubscribe_depth")
+
+class ClientConnection:
+    """A connected client with its own bounded send queue and writer task"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, websocket: WebSocket, queue_size: int = SEND_QUEUE_SIZE,
+                 policy: str = SLOW_CONSUMER_POLICY, encoding: str = "json"):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.id = next(self._ids)
+        self.websocket = websocket
+        self.queue_size = queue_size
+        self.policy = policy
+        self.encoding = encoding
+        # Subscribed symbols; None means the whole universe
+        self.symbols: Optional[Set[str]] = None
+        # Symbols whose order-book depth the client follows
+        self.depth_symbols: Set[str] = set()
+        # Set for clients that connected with a token; they get portfolio updates
+        self.user_id = None
+        # Set when a price frame was dropped, so the next one must be a full snapshot
+        self.needs_snapshot = False
+        self.sent = 0
+        self.dropped = 0
+        # Entries are (message, conflatable) pairs
+        self._queue = deque()
+        self._ready = asyncio.Event()
+        self._writer = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def is_full(self) -> bool:
+        return len(self._queue) >= self.queue_size
+
+    def start(self, on_error):
+        self._writer = asyncio.create_task(self._write_loop(on_error))
+
+    def close(self):
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        self._writer = None
+        self._queue.clear()
+
+    def enqueue(self, message: Union[str, bytes], conflatable: bool = False) -> bool:
+        """Queue a message without blocking.
+
+        Returns False when the queue is full and the policy is to disconnect.
+        """
+        if len(self._queue) >= self.queue_size:
+            if self.policy == "disconnect":
+                return False
+            if self.policy == "conflate" and conflatable:
+                kept = deque(entry for entry in self._queue if not entry[1])
+                if len(kept) < len(self._queue):
+                    self.needs_snapshot = True
+                self.dropped += len(self._queue) - len(kept)
+                self._queue = kept
+            if len(self._queue) >= self.queue_size:
+                _, dropped_conflatable = self._queue.popleft()
+                if dropped_conflatable:
+                    self.needs_snapshot = True
+                self.dropped += 1
+        self._queue.append((message, conflatable))
+        self._ready.set()
+        return True
+
+    async def _write_loop(self, on_error):
+        try:
+            while True:
+                if not self._queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                message, _ = self._queue.popleft()
+                if isinstance(message, bytes):
+                    await self.websocket.send_bytes(message)
+                else:
+                    await self.websocket.send_text(message)
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Socket went away; stop sending to it
+            on_error(self.websocket)
+
+    def stats(self) -> dict:
+        return {
+            "id": self.id,
+            "queue_depth": self.queue_depth,
+            "queue_size": self.queue_size,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "policy": self.policy,
+            "encoding": self.encoding,
+            "symbols": None if self.symbols is None else len(self.symbols),
+            "user_id": self.user_id,
+        }
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    def __init__(self, queue_size: int = SEND_QUEUE_SIZE, policy: str = SLOW_CONSUMER_POLICY):
+        self.queue_size = queue_size
+        self.policy = policy
+        self.connections: Dict[WebSocket, ClientConnection] = {}
+        # symbol -> clients that subscribed to it explicitly
+        self.subscribers: Dict[str, Set[ClientConnection]] = defaultdict(set)
+        # symbol -> clients following its order-book depth
+        self.depth_subscribers: Dict[str, Set[ClientConnection]] = defaultdict(set)
+        # user id -> that user's authenticated clients
+        self.user_clients: Dict[object, Set[ClientConnection]] = defaultdict(set)
+        self._bus = None
+
+    @property
+    def active_connections(self) -> List[WebSocket]:
+        return list(self.connections)
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, encoding: str = "json", user_id=None):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        client = ClientConnection(websocket, self.queue_size, self.policy, encoding)
+        self.connections[websocket] = client
+        if user_id is not None:
+            client.user_id = user_id
+            self.user_clients[user_id].add(client)
+            valuation_engine.watch(user_id)
+        client.start(self.disconnect)
+        return client
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        client = self.connections.pop(websocket, None)
+        if client is not None:
+            self._unindex(client, client.symbols or ())
+            self.unsubscribe_depth(client, list(client.depth_symbols))
+            if client.user_id is not None:
+                valuation_engine.unwatch(client.user_id)
+                clients = self.user_clients.get(client.user_id)
+                if clients is not None:
+                    clients.discard(client)
+                    if not clients:
+                        del self.user_clients[client.user_id]
+            client.close()
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+    async def send_personal_message(self, message: Union[str, bytes], websocket: WebSocket,
+                                    conflatable: bool = False):
+        client = self.connections.get(websocket)
+        if client is not None and not client.enqueue(message, conflatable):
+            await self._drop_slow_consumer(client)
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except:
-                # Remove disconnected connections
-                self.active_connections.remove(connection)
+    async def broadcast(self, message: str, conflatable: bool = False):
+        """Queue a message for every client; never waits on a slow socket"""
+        slow = [
+            client for client in list(self.connections.values())
+            if not client.enqueue(message, conflatable)
+        ]
+        for client in slow:
+            await self._drop_slow_consumer(client)
 
-manager = ConnectionManager()
+    async def broadcast_event(self, event: dict):
+        """Send an event to this worker's clients only, for events every worker
+        derives from the tick stream itself (e.g. index updates)"""
+        await self.broadcast(json.dumps(event))
+
+    def subscribe(self, client: ClientConnection, symbols: Iterable[str]) -> List[str]:
+        """Add symbols to a client's interest set; returns the newly added ones"""
+        if client.symbols is None:
+            # First explicit subscription narrows the client from the whole universe
+            client.symbols = set()
+        added = [symbol for symbol in symbols if symbol not in client.symbols]
+        client.symbols.update(added)
+        for symbol in added:
+            self.subscribers[symbol].add(client)
+        return added
+
+    def subscribe_all(self, client: ClientConnection):
+        self._unindex(client, client.symbols or ())
+        client.symbols = None
+
+    def unsubscribe(self, client: ClientConnection, symbols: Iterable[str]):
+        if client.symbols is None:
+            client.symbols = set(market_engine.symbols)
+            for symbol in client.symbols:
+                self.subscribers[symbol].add(client)
+        removed = [symbol for symbol in symbols if symbol in client.symbols]
+        client.symbols.difference_update(removed)
+        self._unindex(client, removed)
+
+    async def subscribe_depth(self, client: ClientConnection, symbols: Iterable[str]):
+        """Follow order-book depth: a snapshot now, then every book_delta"""
+        for symbol in symbols:
+            if symbol in client.depth_symbols:
+                continue
+
+            async def join(symbol=symbol) -> bool:
+                # The client may have gone while the job was queued; joining
+                # then would leave its subscription and watch behind
+                if self.connections.get(client.websocket) is not client:
+                    return True
+                # Queued before joining, on the book's shard, so the snapshot
+                # reaches the client ahead of every delta after it
+                snapshot = await matching_engine.snapshot(symbol)
+                if not client.enqueue(json.dumps(snapshot)):
+                    return False
+                client.depth_symbols.add(symbol)
+                self.depth_subscribers[symbol].add(client)
+                matching_engine.watch(symbol)
+                return True
 
-# Mock stock data
-stock_data = {
-    'AAPL': {'price': 175.50, 'change': 2.45},
-    'GOOGL': {'price': 2845.20, 'change': -15.30},
-    'MSFT': {'price': 378.90, 'change': 8.75},
-    'TSLA': {'price': 245.67, 'change': -5.23},
-    'AMZN': {'price': 3456.78, 'change': 23.45},
-    'NVDA': {'price': 456.32, 'change': 12.87},
-    'META': {'price': 324.15, 'change': -7.89},
-    'NFLX': {'price': 456.78, 'change': 15.23},
-}
-
-async def get_stock_updates():
-    """Generate random stock price updates"""
-    while True:
-        # Update prices randomly
-        for symbol in stock_data:
-            change = random.uniform(-2.0, 2.0)
-            stock_data[symbol]['price'] = max(0.01, stock_data[symbol]['price'] + change)
-            stock_data[symbol]['change'] = change
-            
-        # Broadcast to all connected clients
-        await manager.broadcast(json.dumps({
-            'type': 'price_update',
-            'data': stock_data
-        }))
-        
-        await asyncio.sleep(2)  # Update every 2 seconds
+            if not await order_pipeline.call(symbol, join):
+                await self._drop_slow_consumer(client)
+                return
+
+    def unsubscribe_depth(self, client: ClientConnection, symbols: Iterable[str]):
+        for symbol in symbols:
+            if symbol not in client.depth_symbols:
+                continue
+            client.depth_symbols.discard(symbol)
+            matching_engine.unwatch(symbol)
+            clients = self.depth_subscribers.get(symbol)
+            if clients is not None:
+                clients.discard(client)
+                if not clients:
+                    del self.depth_subscribers[symbol]
+
+    async def broadcast_depth(self, delta: dict):
+        """Queue a book_delta for the clients following that symbol's depth.
+
+        Deltas are never conflated; a client that sees a gap in ``seq``
+        should resubscribe to get a fresh snapshot.
+        """
+        clients = self.depth_subscribers.get(delta["symbol"])
+        if not clients:
+            return
+        message = json.dumps(delta)
+        slow = [client for client in list(clients) if not client.enqueue(message)]
+        for client in slow:
+            await self._drop_slow_consumer(client)
+
+    async def broadcast_portfolios(self, updates: Dict[object, dict]):
+        """Queue each user's portfolio_update for that user's clients"""
+        slow = []
+        for user_id, update in updates.items():
+            clients = self.user_clients.get(user_id)
+            if not clients:
+                continue
+            message = json.dumps(update)
+            slow += [client for client in clients if not client.enqueue(message)]
+        for client in slow:
+            await self._drop_slow_consumer(client)
+
+    def _unindex(self, client: ClientConnection, symbols: Iterable[str]):
+        for symbol in symbols:
+            clients = self.subscribers.get(symbol)
+            if clients is not None:
+                clients.discard(client)
+                if not clients:
+                    del self.subscribers[symbol]
+
+    async def broadcast_prices(self, tick: Tick):
+        """Queue a price frame for every client with only the symbols it cares about.
+
+        Clients get the symbols that changed this tick and that they subscribed
+        to. A client that lost a price frame to backpressure gets a snapshot of
+        its whole interest set instead, so it never misses a change.
+        """
+        frame = PriceFrame(tick)
+        changed = len(tick.changed) > 0
+
+        # Walk the index from the changed side so work scales with actual interest
+        changes_by_client: Dict[ClientConnection, List[str]] = defaultdict(list)
+        if self.subscribers:
+            if len(self.subscribers) < len(tick.changed):
+                moved = [s for s in self.subscribers if tick.changes[tick.symbol_ids[s]] != 0]
+            else:
+                moved = [s for s in tick.changed_symbols if s in self.subscribers]
+            for symbol in moved:
+                for client in self.subscribers[symbol]:
+                    changes_by_client[client].append(symbol)
+
+        slow = []
+        for client in list(self.connections.values()):
+            snapshot = client.needs_snapshot or (client.is_full and client.policy == "conflate")
+            if snapshot:
+                symbols = None if client.symbols is None else sorted(client.symbols)
+                if symbols is not None and not symbols:
+                    continue
+                message = frame.encode(client.encoding, symbols, snapshot=True)
+            elif client.symbols is None:
+                if not changed:
+                    continue
+                message = frame.encode(client.encoding)
+            else:
+                symbols = changes_by_client.get(client)
+                if not symbols:
+                    continue
+                message = frame.encode(client.encoding, symbols)
+            if not client.enqueue(message, conflatable=True):
+                slow.append(client)
+            elif snapshot:
+                client.needs_snapshot = False
+        for client in slow:
+            await self._drop_slow_consumer(client)
+
+    async def handle_client_message(self, client: ClientConnection, message: str):
+        """Process a subscribe/unsubscribe request sent by a client.
+
+        Messages look like ``{"action": "subscribe", "symbols": ["AAPL", "MSFT"]}``;
+        ``"symbols": ["*"]`` subscribes to the whole universe. The
+        ``subscribe_depth`` and ``unsubscribe_depth`` actions do the same for
+        order-book depth, per symbol only. Anything that is not a JSON object
+        (e.g. keep-alive pings) is ignored.
+        """
+        try:
+            request = json.loads(message)
+        except ValueError:
+            return
+        if not isinstance(request, dict):
+            return
+
+        action = request.get("action")
+        symbols = request.get("symbols") or []
+        if (action not in DEPTH_ACTIONS + ("subscribe", "unsubscribe") or not isinstance(symbols, list)
+                or not all(isinstance(s, str) for s in symbols)):
+            await self.send_personal_message(json.dumps({
+                'type': 'error',
+                'message': 'Expected {"action": "subscribe" | "unsubscribe" | "subscribe_depth"'
+                           ' | "unsubscribe_depth", "symbols": [...]}'
+            }), client.websocket)
+            return
+
+        unknown = [s for s in symbols if s != "*" and s not in market_engine.symbol_ids]
+        if unknown:
+            await self.send_personal_message(json.dumps({
+                'type': 'error',
+                'message': f"Unknown symbols: {', '.join(map(str, unknown))}"
+            }), client.websocket)
+        symbols = [s for s in symbols if s not in unknown]
+
+        if action in DEPTH_ACTIONS:
+            symbols = [s for s in symbols if s != "*"]
+            if action == "subscribe_depth":
+                await self.subscribe_depth(client, symbols)
+            else:
+                self.unsubscribe_depth(client, symbols)
+            await self.send_personal_message(json.dumps({
+                'type': 'depth_subscriptions',
+                'symbols': sorted(client.depth_symbols)
+            }), client.websocket)
+            return
+
+        added = None
+        if action == "subscribe":
+            if "*" in symbols:
+                self.subscribe_all(client)
+                added = list(market_engine.symbols)
+            else:
+                added = self.subscribe(client, symbols)
+        elif "*" in symbols:
+            self.unsubscribe(client, list(client.symbols or market_engine.symbols))
+        else:
+            self.unsubscribe(client, symbols)
+
+        await self.send_personal_message(json.dumps({
+            'type': 'subscriptions',
+            'symbols': None if client.symbols is None else sorted(client.symbols)
+        }), client.websocket)
+        if added:
+            # Give the client current prices for the symbols it just added
+            frame = PriceFrame(market_engine.latest)
+            await self.send_personal_message(
+                frame.encode(client.encoding, added, snapshot=True), client.websocket, conflatable=True
+            )
+
+    def attach(self, bus: Backplane):
+        """Fan out events published by any worker to this worker's sockets"""
+        self._bus = bus
+        bus.subscribe(EVENTS_CHANNEL, self._on_bus_event)
+
+    async def publish_event(self, event: dict):
+        """Send an event to the clients of every worker.
+
+        Events with a ``symbol`` go to that symbol's subscribers and to
+        clients following the whole universe. A ``trades`` event carries a
+        list of trades; each client gets the ones on its symbols. Other
+        events go to everyone.
+        """
+        payload = json.dumps(event, default=str).encode()
+        if self._bus is None:
+            await self._on_bus_event(payload)
+        else:
+            await self._bus.publish(EVENTS_CHANNEL, payload)
+
+    async def _on_bus_event(self, payload: bytes):
+        message = payload.decode()
+        event = json.loads(message)
+        if event.get("type") == "trades":
+            await self._send_trades(message, event)
+            return
+        symbol = event.get("symbol")
+        if symbol is None:
+            await self.broadcast(message)
+            return
+        interested = self.subscribers.get(symbol, set())
+        slow = [
+            client for client in list(self.connections.values())
+            if (client.symbols is None or client in interested) and not client.enqueue(message)
+        ]
+        for client in slow:
+            await self._drop_slow_consumer(client)
+
+    async def _send_trades(self, message: str, event: dict):
+        """Send each client the trades of a batch that are on its symbols"""
+        slow = []
+        for client in list(self.connections.values()):
+            if client.symbols is None:
+                client_message = message
+            else:
+                trades = [trade for trade in event["trades"] if trade["symbol"] in client.symbols]
+                if not trades:
+                    continue
+                client_message = json.dumps({**event, "trades": trades})
+            if not client.enqueue(client_message):
+                slow.append(client)
+        for client in slow:
+            await self._drop_slow_consumer(client)
+
+    async def _drop_slow_consumer(self, client: ClientConnection):
+        logger.warning("Disconnecting slow WebSocket client %s", client.id)
+        self.disconnect(client.websocket)
+        try:
+            await client.websocket.close(code=1013)
+        except Exception:
+            pass
+
+    def stats(self) -> List[dict]:
+        """Per-connection queue statistics, most lagging first"""
+        return sorted(
+            (client.stats() for client in self.connections.values()),
+            key=lambda s: s["queue_depth"],
+            reverse=True,
+        )
+
+manager = ConnectionManager()
 
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
-    
-    # Start broadcasting price updates
-    update_task = asyncio.create_task(get_stock_updates())
+    """Stream prices, indices and trades; with ``?token=<access token>`` also
+    the user's own portfolio figures"""
+    encoding = websocket.query_params.get("encoding", "json")
+    if encoding not in ENCODINGS:
+        await websocket.close(code=1003)
+        return
+    user_id = None
+    token = websocket.query_params.get("token")
+    if token is not None:
+        user = await user_from_token(token)
+        if user is None:
+            await websocket.close(code=1008)
+            return
+        user_id = user["id"]
+    client = await manager.connect(websocket, encoding, user_id)
     
     try:
+        if encoding == "binary":
+            await manager.send_personal_message(symbol_table_message(market_engine.symbols), websocket)
+        # Send the latest prices right away instead of waiting for the next tick
+        frame = PriceFrame(market_engine.latest)
+        await manager.send_personal_message(frame.encode(encoding, snapshot=True), websocket, conflatable=True)
+        await manager.send_personal_message(json.dumps(market_indices.snapshot_message()), websocket)
+        if user_id is not None:
+            await manager.send_personal_message(json.dumps(valuation_engine.snapshot(user_id)), websocket)
         while True:
-            # Keep connection alive
-            await websocket.receive_text()
+            message = await websocket.receive_text()
+            await manager.handle_client_message(client, message)
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
-        update_task.cancel()